@@ -0,0 +1,289 @@
+"""
+Read-only HTTP API над intermark.properties_clean.
+
+Чтобы аналитика не ходила в прод-базу ad-hoc SQL-ем:
+- отдельный пул соединений в режиме default_transaction_read_only
+  (можно указать отдельного read-only пользователя/реплику: POSTGRES_RO_* в .env)
+- фильтры: location (префикс), price_min/price_max, area_min/area_max, param.<ключ>=<значение>
+- keyset-пагинация по id (after=<id>), без OFFSET
+- LRU-кеш ответов с TTL; сбрасывается по NOTIFY intermark_data_changed
+  (шлёт DatabasePipeline.close_spider, ETL может слать тот же NOTIFY) или POST /invalidate
+
+Запуск:
+    python -m intermark_scraper.api --port 8080
+    curl 'localhost:8080/properties?location=Spain&price_min=100000&limit=20'
+"""
+
+import argparse
+import json
+import logging
+import select
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, urlparse
+
+from environs import Env
+from sqlalchemy import MetaData, Table, create_engine, select as sa_select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "intermark_data_changed"
+MAX_LIMIT = 200
+
+# фильтр -> (колонка, оператор); колонки берутся из отражённой таблицы, отсутствующие фильтры отключаются
+RANGE_FILTERS = {
+    "price_min": ("price", ">="),
+    "price_max": ("price", "<="),
+    "area_min": ("area", ">="),
+    "area_max": ("area", "<="),
+}
+
+
+def get_readonly_connection_string() -> str:
+    env = Env()
+    project_root = Path(__file__).resolve().parents[2]
+    env.read_env(project_root / ".env")
+
+    user = env.str("POSTGRES_RO_USER", None) or env.str("POSTGRES_USER")
+    password = env.str("POSTGRES_RO_PASSWORD", None) or env.str("POSTGRES_PASSWORD")
+    db = env.str("POSTGRES_DB")
+    host = env.str("POSTGRES_RO_HOST", None) or env.str("POSTGRES_HOST", "localhost")
+    port = env.int("POSTGRES_RO_PORT", None) or env.int("POSTGRES_PORT", 5432)
+
+    return f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{db}"
+
+
+class TTLCache:
+    """LRU с TTL; потокобезопасный (ThreadingHTTPServer)."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple[float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value: bytes) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+class PropertiesQuery:
+    def __init__(self, engine, table_name: str = "properties_clean", schema: str = "intermark"):
+        self.engine = engine
+        self.table = Table(table_name, MetaData(schema=schema), autoload_with=engine)
+        self.columns = self.table.c
+
+    def run(self, params: Dict[str, str]) -> Dict[str, Any]:
+        t = self.table
+        conds = []
+
+        location = params.get("location")
+        if location and "location" in self.columns:
+            conds.append(t.c.location.ilike(f"{location}%"))
+
+        for name, (column, op) in RANGE_FILTERS.items():
+            if name in params and column in self.columns:
+                value = float(params[name])
+                conds.append(t.c[column] >= value if op == ">=" else t.c[column] <= value)
+
+        # param.<ключ>=<значение> — по JSONB-колонке params (или features->params), если есть
+        param_filters = {k[len("param."):]: v for k, v in params.items() if k.startswith("param.")}
+        if param_filters:
+            if "params" in self.columns and isinstance(t.c.params.type, JSONB):
+                conds.append(t.c.params.contains(param_filters))
+            elif "features" in self.columns and isinstance(t.c.features.type, JSONB):
+                conds.append(t.c.features["params"].contains(param_filters))
+            else:
+                raise ValueError("table has no JSONB params column")
+
+        if "after" in params:
+            conds.append(t.c.id > int(params["after"]))
+
+        limit = max(1, min(int(params.get("limit", 50)), MAX_LIMIT))
+        stmt = sa_select(t).where(*conds).order_by(t.c.id).limit(limit)
+
+        with self.engine.connect() as conn:
+            rows = [dict(r) for r in conn.execute(stmt).mappings()]
+
+        next_after = rows[-1]["id"] if len(rows) == limit else None
+        return {"items": rows, "next_after": next_after}
+
+
+def listen_for_invalidation(dsn: str, cache: TTLCache, stop: threading.Event, retry_delay: float = 5.0) -> None:
+    """
+    Фоновый поток: LISTEN intermark_data_changed -> cache.clear().
+    При обрыве соединения переподключается (с паузой до 60 с); после переподключения кеш
+    сбрасывается — NOTIFY, пришедшие без соединения, потеряны.
+    """
+    import psycopg2
+
+    delay = retry_delay
+    connected_before = False
+    while not stop.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(dsn.replace("postgresql+psycopg2://", "postgresql://"))
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            if connected_before:
+                cache.clear()
+                logger.info("[api] LISTEN reconnected, cache invalidated")
+            connected_before = True
+            delay = retry_delay
+
+            while not stop.is_set():
+                if select.select([conn], [], [], 5.0) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    cache.clear()
+                    logger.info("[api] cache invalidated by NOTIFY")
+        except (psycopg2.Error, OSError, ValueError) as e:
+            logger.warning("[api] LISTEN connection lost: %s; retry in %.0fs", e, delay)
+            stop.wait(delay)
+            delay = min(delay * 2, 60.0)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def make_handler(query: PropertiesQuery, cache: TTLCache):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: bytes, cache_status: str = "") -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            if cache_status:
+                self.send_header("X-Cache", cache_status)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            u = urlparse(self.path)
+            if u.path == "/stats":
+                self._send(200, json.dumps(cache.stats()).encode("utf-8"))
+                return
+            if u.path != "/properties":
+                self._send(404, b'{"error": "not found"}')
+                return
+
+            params = dict(parse_qsl(u.query))
+            key = tuple(sorted(params.items()))
+            body = cache.get(key)
+            if body is not None:
+                self._send(200, body, "HIT")
+                return
+            try:
+                result = query.run(params)
+            except ValueError as e:
+                self._send(400, json.dumps({"error": str(e)}).encode("utf-8"))
+                return
+            except OperationalError as e:
+                # база недоступна / statement_timeout — клиент может повторить позже
+                logger.warning("[api] database unavailable: %s", e)
+                self._send(503, b'{"error": "database unavailable"}')
+                return
+            except SQLAlchemyError:
+                logger.exception("[api] query failed: %s", self.path)
+                self._send(500, b'{"error": "internal error"}')
+                return
+            body = json.dumps(result, ensure_ascii=False, default=_json_default).encode("utf-8")
+            cache.put(key, body)
+            self._send(200, body, "MISS")
+
+        def do_POST(self):
+            if urlparse(self.path).path == "/invalidate":
+                cache.clear()
+                self._send(200, b'{"ok": true}')
+            else:
+                self._send(404, b'{"error": "not found"}')
+
+        def log_message(self, fmt, *args):
+            logger.debug("[api] " + fmt, *args)
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Read-only API над intermark.properties_clean")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--pool-size", type=int, default=5)
+    parser.add_argument("--cache-size", type=int, default=1024)
+    parser.add_argument("--cache-ttl", type=float, default=300.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
+
+    dsn = get_readonly_connection_string()
+    engine = create_engine(
+        dsn,
+        pool_size=args.pool_size,
+        max_overflow=0,
+        pool_pre_ping=True,
+        connect_args={"options": "-c default_transaction_read_only=on -c statement_timeout=5000"},
+    )
+    query = PropertiesQuery(engine)
+    cache = TTLCache(max_size=args.cache_size, ttl=args.cache_ttl)
+
+    stop = threading.Event()
+    listener = threading.Thread(target=listen_for_invalidation, args=(dsn, cache, stop), daemon=True)
+    listener.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(query, cache))
+    logger.info("[api] listening on %s:%s", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
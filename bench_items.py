@@ -0,0 +1,91 @@
+"""
+Бенчмарк item-ов: dict со scraped_at-строкой (как раньше) против ListingItem (items.py).
+
+    python -m intermark_scraper.bench_items --count 20000
+
+Печатает:
+- память на N придержанных item-ов (tracemalloc, без учёта общих строк)
+- подготовку полей для pipeline: ItemAdapter + _parse_iso_dt против PropertyItem.as_dict()
+- сериализацию в строки COPY
+"""
+
+import argparse
+import io
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from intermark_scraper.items import ListingItem, write_copy_rows
+from intermark_scraper.pipelines import DatabasePipeline
+
+FIELDS = dict(
+    source_page="https://intermark.ru/nedvizhimost-za-rubezhom/investicii-spain?page=3",
+    object_id="724599",
+    title="Вилла с видом на море",
+    location="Испания, Коста Бланка, Аликанте",
+    price_raw="€ 896 000 – 1 682 000",
+    area_raw="270 м²",
+    description=None,
+)
+
+
+def _features(i: int):
+    return {"from": "listing", "images": [f"https://cdn.intermark.ru/{i}.jpg"], "params_list": ["3 спальни"]}
+
+
+def make_dicts(n: int):
+    now = datetime.now(timezone.utc).isoformat()
+    return [
+        {"url": f"https://intermark.ru/objects/{i}", "scraped_at": now, **FIELDS, "features": _features(i)}
+        for i in range(n)
+    ]
+
+
+def make_items(n: int):
+    now = datetime.now(timezone.utc)
+    return [
+        ListingItem(url=f"https://intermark.ru/objects/{i}", scraped_at=now, **FIELDS, features=_features(i))
+        for i in range(n)
+    ]
+
+
+def _memory(factory, n: int) -> float:
+    tracemalloc.start()
+    items = factory(n)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return current / n
+
+
+def _timed(fn, items) -> float:
+    start = time.perf_counter()
+    fn(items)
+    return len(items) / (time.perf_counter() - start)
+
+
+def _copy_dicts(items) -> None:
+    rows = (ListingItem(**DatabasePipeline._incoming(x)).as_row() for x in items)
+    write_copy_rows(rows, io.StringIO())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="dict vs ListingItem: память и скорость")
+    parser.add_argument("--count", type=int, default=20000)
+    args = parser.parse_args()
+    n = args.count
+
+    print(f"items={n}")
+    print(f"memory bytes/item   dict={_memory(make_dicts, n):8.0f}  typed={_memory(make_items, n):8.0f}")
+
+    dicts, items = make_dicts(n), make_items(n)
+    incoming = lambda xs: [DatabasePipeline._incoming(x) for x in xs]  # noqa: E731
+    print(f"pipeline fields/s   dict={_timed(incoming, dicts):8.0f}  typed={_timed(incoming, items):8.0f}")
+    print(
+        f"COPY rows/s         dict={_timed(_copy_dicts, dicts):8.0f}  "
+        f"typed={_timed(lambda xs: write_copy_rows((x.as_row() for x in xs), io.StringIO()), items):8.0f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
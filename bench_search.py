@@ -0,0 +1,75 @@
+"""
+Бенчмарк поиска: ILIKE '%...%' (seq scan) против search_tsv/GIN и pg_trgm.
+
+Запуск (после migrate_search.py):
+    python -m intermark_scraper.bench_search "вид на море" бассейн Аликанте
+
+Для каждого запроса печатает медиану времени (мс) и узел плана (Seq Scan / Bitmap Index Scan).
+"""
+
+import statistics
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+
+from intermark_scraper.pipelines import get_connection_string
+
+REPEATS = 20
+
+QUERIES = {
+    "ilike": (
+        "SELECT id FROM intermark.properties_raw WHERE description ILIKE :like LIMIT 20",
+        lambda q: {"like": f"%{q}%"},
+    ),
+    "fts": (
+        "SELECT id FROM intermark.properties_raw "
+        "WHERE search_tsv @@ websearch_to_tsquery('russian', :q) "
+        "ORDER BY ts_rank_cd(search_tsv, websearch_to_tsquery('russian', :q)) DESC, id DESC LIMIT 20",
+        lambda q: {"q": q},
+    ),
+    "trgm": (
+        "SELECT id FROM intermark.properties_raw WHERE title % :q OR location % :q LIMIT 20",
+        lambda q: {"q": q},
+    ),
+}
+
+
+def _plan_nodes(conn, sql: str, params) -> str:
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+    nodes = []
+
+    def walk(node):
+        nodes.append(node["Node Type"])
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return ", ".join(n for n in nodes if "Scan" in n)
+
+
+def main(argv) -> None:
+    terms = argv or ["вид на море", "бассейн", "Аликанте"]
+    engine = create_engine(get_connection_string())
+    try:
+        with engine.connect() as conn:
+            total = conn.execute(text("SELECT count(*) FROM intermark.properties_raw")).scalar()
+            print(f"rows={total} repeats={REPEATS}")
+            for term in terms:
+                for name, (sql, make_params) in QUERIES.items():
+                    params = make_params(term)
+                    timings = []
+                    for _ in range(REPEATS):
+                        start = time.perf_counter()
+                        conn.execute(text(sql), params).all()
+                        timings.append((time.perf_counter() - start) * 1000)
+                    print(
+                        f"{term!r:24} {name:6} median={statistics.median(timings):8.2f}ms "
+                        f"plan=[{_plan_nodes(conn, sql, params)}]"
+                    )
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,88 @@
+"""
+Ленивый запуск Chrome для паука.
+
+selenium/webdriver_manager импортируются только при первом рендере, поэтому
+`scrapy list`/`scrapy check` и чисто HTTP-раны их не грузят.
+Путь к chromedriver кешируется в json (CHROMEDRIVER_CACHE) вместе с версией:
+ChromeDriverManager().install() (проверка версий, сеть) вызывается только если
+кеша нет, файл драйвера пропал или закреплённая версия (CHROMEDRIVER_VERSION) изменилась.
+"""
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHROME_ARGS = (
+    "--headless=new",
+    "--disable-gpu",
+    "--window-size=1600,900",
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--lang=ru-RU",
+)
+
+
+def resolve_chromedriver(cache_file: str, version: Optional[str] = None) -> str:
+    """
+    Возвращает путь к chromedriver.
+    Порядок: env CHROMEDRIVER_PATH -> кеш (если версия совпала и файл на месте) -> webdriver_manager.
+    """
+    env_path = os.environ.get("CHROMEDRIVER_PATH")
+    if env_path:
+        return env_path
+
+    cache = Path(cache_file)
+    if cache.exists():
+        try:
+            cached = json.loads(cache.read_text(encoding="utf-8"))
+            if Path(cached["path"]).exists() and (version is None or cached.get("version") == version):
+                return cached["path"]
+        except (ValueError, KeyError, OSError) as e:
+            logger.warning("[selenium] broken chromedriver cache %s: %s", cache, e)
+
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    # без закреплённой версии кеш живёт, пока файл драйвера на месте
+    path = ChromeDriverManager(driver_version=version).install() if version else ChromeDriverManager().install()
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    cache.write_text(json.dumps({"path": path, "version": version}), encoding="utf-8")
+    logger.info("[selenium] chromedriver resolved path=%s version=%s", path, version)
+    return path
+
+
+def create_chrome(
+    cache_file: str,
+    version: Optional[str] = None,
+    proxy_server: Optional[str] = None,
+    user_agent: Optional[str] = None,
+) -> Tuple[object, float, float]:
+    """
+    Поднимает headless Chrome.
+    proxy_server/user_agent — сессии из пула (sessions.py); логин/пароль прокси Chrome через флаг не принимает.
+    Возвращает (driver, import_seconds, init_seconds) — для статистики старта.
+    """
+    t0 = time.perf_counter()
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+    import_s = time.perf_counter() - t0
+
+    t1 = time.perf_counter()
+    options = Options()
+    for arg in CHROME_ARGS:
+        options.add_argument(arg)
+    if proxy_server:
+        options.add_argument(f"--proxy-server={proxy_server}")
+    if user_agent:
+        options.add_argument(f"--user-agent={user_agent}")
+
+    service = Service(resolve_chromedriver(cache_file, version))
+    driver = webdriver.Chrome(service=service, options=options)
+    init_s = time.perf_counter() - t1
+
+    return driver, import_s, init_s
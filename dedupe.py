@@ -0,0 +1,215 @@
+"""
+Дедупликация объектов между разными url.
+
+Один и тот же объект встречается под разными url (query-строки, разделы сайта).
+Сущность определяем тремя способами (по убыванию надёжности):
+1) точный object_id ("ID 724599" с карточки)
+2) канонический url (без query/fragment, хвостового "/", регистра хоста)
+3) near-duplicate описания: MinHash по шинглам + LSH-бакеты (без сравнения всех пар)
+
+EntityIndex — in-memory индекс для краула (паук не идёт в detail для известной сущности)
+и для batch-режима (find_duplicates / python -m intermark_scraper.dedupe).
+"""
+
+import hashlib
+import json
+import re
+import struct
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlparse, urlunparse
+
+_MERSENNE = (1 << 61) - 1
+_WORD_RE = re.compile(r"\w+", flags=re.UNICODE)
+
+
+def canonicalize_url(url: str) -> str:
+    """https://Intermark.ru/objects/x/?utm=1#top -> https://intermark.ru/objects/x"""
+    u = urlparse(url.strip())
+    path = re.sub(r"/{2,}", "/", u.path).rstrip("/") or "/"
+    return urlunparse((u.scheme.lower() or "https", u.netloc.lower(), path, "", "", ""))
+
+
+def shingles(text: str, k: int = 5) -> Set[str]:
+    """Словные k-шинглы нормализованного текста."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= k:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+
+def _base_hash(s: str) -> int:
+    return struct.unpack("<Q", hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest())[0]
+
+
+class MinHasher:
+    """MinHash на универсальных хешах (a*x + b) mod p; коэффициенты детерминированы seed-ом."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        self.num_perm = num_perm
+        self._params: List[Tuple[int, int]] = []
+        for i in range(num_perm):
+            a = _base_hash(f"a:{seed}:{i}") % (_MERSENNE - 1) + 1
+            b = _base_hash(f"b:{seed}:{i}") % _MERSENNE
+            self._params.append((a, b))
+
+    def signature(self, tokens: Set[str]) -> Tuple[int, ...]:
+        if not tokens:
+            return ()
+        hashes = [_base_hash(t) for t in tokens]
+        return tuple(min((a * h + b) % _MERSENNE for h in hashes) for a, b in self._params)
+
+
+def jaccard_estimate(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+    if not sig_a or not sig_b:
+        return 0.0
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+class EntityIndex:
+    """
+    Индекс сущностей: key сущности — url первого увиденного представителя.
+
+    - by_object_id / by_canonical_url: точные совпадения, O(1)
+    - LSH: bands x rows = num_perm; кандидаты — только объекты с общим бакетом хотя бы в одной полосе,
+      затем проверка оценки Жаккара >= threshold
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = 0.8, shingle_size: int = 5):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.hasher = MinHasher(num_perm=num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+
+        self.by_object_id: Dict[str, str] = {}
+        self.by_canonical_url: Dict[str, str] = {}
+        self._signatures: Dict[str, Tuple[int, ...]] = {}
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], List[str]] = defaultdict(list)
+        # описания из seed(): MinHash считается при первом поиске near-duplicate, а не на старте краула
+        self._pending: List[Tuple[str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.by_canonical_url)
+
+    def _band_keys(self, sig: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield band, sig[band * self.rows:(band + 1) * self.rows]
+
+    def resolve(self, url: str, object_id: Optional[str] = None) -> Optional[str]:
+        """Быстрая проверка без описания (стадия listing): object_id, затем канонический url."""
+        if object_id and object_id in self.by_object_id:
+            return self.by_object_id[object_id]
+        return self.by_canonical_url.get(canonicalize_url(url))
+
+    def find_near_duplicate(self, description: Optional[str]) -> Optional[str]:
+        if not description:
+            return None
+        sig = self.hasher.signature(shingles(description, self.shingle_size))
+        return self._match_signature(sig)
+
+    def _index_pending(self) -> None:
+        pending, self._pending = self._pending, []
+        for entity, description in pending:
+            self._register_signature(entity, self.hasher.signature(shingles(description, self.shingle_size)))
+
+    def _register_signature(self, entity: str, sig: Tuple[int, ...]) -> None:
+        if sig and entity not in self._signatures:
+            self._signatures[entity] = sig
+            for key in self._band_keys(sig):
+                self._buckets[key].append(entity)
+
+    def _match_signature(self, sig: Tuple[int, ...]) -> Optional[str]:
+        if not sig:
+            return None
+        self._index_pending()
+        seen: Set[str] = set()
+        for key in self._band_keys(sig):
+            for entity in self._buckets.get(key, ()):
+                if entity in seen:
+                    continue
+                seen.add(entity)
+                if jaccard_estimate(sig, self._signatures[entity]) >= self.threshold:
+                    return entity
+        return None
+
+    def add(self, url: str, object_id: Optional[str] = None, description: Optional[str] = None) -> str:
+        """
+        Регистрирует представителя и возвращает key сущности
+        (равен url, если объект новый, иначе — url ранее известного дубля).
+        """
+        canonical = canonicalize_url(url)
+        entity = self.resolve(url, object_id)
+
+        sig: Tuple[int, ...] = ()
+        if description:
+            sig = self.hasher.signature(shingles(description, self.shingle_size))
+            self._index_pending()
+            if entity is None:
+                entity = self._match_signature(sig)
+
+        if entity is None:
+            entity = url
+
+        self.by_canonical_url.setdefault(canonical, entity)
+        if object_id:
+            self.by_object_id.setdefault(object_id, entity)
+        self._register_signature(entity, sig)
+
+        return entity
+
+    def seed(self, url: str, object_id: Optional[str] = None, description: Optional[str] = None) -> str:
+        """
+        Как add(), но для известных строк из БД на старте краула: точные ключи — сразу,
+        MinHash описания — отложенно (при первом add() с описанием / find_near_duplicate).
+        """
+        canonical = canonicalize_url(url)
+        entity = self.resolve(url, object_id) or url
+        self.by_canonical_url.setdefault(canonical, entity)
+        if object_id:
+            self.by_object_id.setdefault(object_id, entity)
+        if description and entity not in self._signatures:
+            self._pending.append((entity, description))
+        return entity
+
+
+def find_duplicates(
+    rows: Iterable[Tuple[str, Optional[str], Optional[str]]],
+    **index_kwargs,
+) -> Dict[str, List[str]]:
+    """
+    Batch-режим для ETL: rows = (url, object_id, description).
+    Возвращает {entity_url: [url, ...]} только для групп из 2+ url.
+    """
+    index = EntityIndex(**index_kwargs)
+    groups: Dict[str, List[str]] = defaultdict(list)
+    for url, object_id, description in rows:
+        if not url:
+            continue
+        groups[index.add(url, object_id, description)].append(url)
+    return {k: v for k, v in groups.items() if len(v) > 1}
+
+
+def main() -> None:
+    """Печатает группы дублей из properties_raw в JSON."""
+    from sqlalchemy import create_engine, text
+
+    from intermark_scraper.pipelines import get_connection_string
+
+    engine = create_engine(get_connection_string())
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT url, object_id, description FROM intermark.properties_raw ORDER BY id"
+            ))
+            groups = find_duplicates(rows)
+    finally:
+        engine.dispose()
+
+    print(json.dumps(groups, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Выгрузка intermark.properties_raw в Parquet для аналитики (вместо JDBC / SELECT * по проду).
+
+- server-side cursor (stream_results): строки идут чанками по --chunk-size, вся таблица в память не грузится
+- hive-секции crawl_date=YYYY-MM-DD/region_id=N (region_id — нормализованный location, см. locations.py)
+- dictionary encoding для низкокардинальных текстовых колонок, zstd
+- features.params раскладывается в типизированные колонки param_<ключ>: список ключей и их тип
+  (число/строка) считается в Postgres (jsonb_each_text) — самые частые --max-param-columns ключей;
+  features целиком остаётся JSON-строкой
+- ключи, дающие одно имя колонки (регистр/пунктуация), различаются суффиксом _2, _3 (assign_param_columns)
+- инкрементально: в <out>/_export_state.json хранится водяной знак scraped_at и схема params (типы и имена колонок);
+  следующий запуск дописывает только строки с scraped_at > водяного знака (новые файлы, старые не трогаются).
+  properties_raw обновляется на месте, поэтому один url может встретиться в нескольких выгрузках —
+  последнее состояние = строка с максимальным scraped_at
+
+Запуск:
+    python -m intermark_scraper.export_parquet --out exports/properties_raw
+    python -m intermark_scraper.export_parquet --out exports/properties_raw --full
+
+Как feed exporter Scrapy (FEED_EXPORTERS["parquet"] в settings.py):
+    scrapy crawl intermark_spain -O items.parquet:parquet
+
+pyarrow — опциональная зависимость, импортируется только здесь.
+"""
+
+import argparse
+import json
+import logging
+import re
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from itemadapter import ItemAdapter
+from scrapy.exporters import BaseItemExporter
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "_export_state.json"
+PARTITION_COLS = ["crawl_date", "region_id"]
+BASE_COLUMNS = (
+    "id",
+    "url",
+    "scraped_at",
+    "source_page",
+    "title",
+    "location",
+    "country_id",
+    "region_id",
+    "city_id",
+    "price_raw",
+    "area_raw",
+    "object_id",
+    "description",
+)
+DICTIONARY_COLUMNS = ["source_page", "location", "price_raw", "area_raw"]
+
+_NUMBER_RE = re.compile(r"-?\d[\d\s ]*(?:[.,]\d+)?")
+_COLUMN_RE = re.compile(r"[^\w]+")
+# "3", "120 м²", "1 200,5 m2" — число и короткая единица измерения
+_NUMERIC_PARAM_SQL = r"'^\s*-?\d[\d\s]*([.,]\d+)?\s*\S{0,4}\s*$'"
+
+
+def param_column(key: str) -> str:
+    """'Кол-во спален' -> 'param_кол_во_спален'"""
+    return "param_" + _COLUMN_RE.sub("_", key.lower()).strip("_")
+
+
+def assign_param_columns(params: Dict[str, bool], known: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    Ключ params -> уникальная колонка. Разные ключи с одним param_column ("Этаж" / "этаж:")
+    получают суффикс _2, _3, ...; назначенные в прошлых выгрузках (state["columns"]) не меняются.
+    """
+    columns = {key: name for key, name in (known or {}).items() if key in params}
+    used = set(columns.values())
+    for key in sorted(params):
+        if key in columns:
+            continue
+        base = name = param_column(key)
+        n = 2
+        while name in used:
+            name = f"{base}_{n}"
+            n += 1
+        columns[key] = name
+        used.add(name)
+    return columns
+
+
+def parse_number(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    m = _NUMBER_RE.search(str(value))
+    if not m:
+        return None
+    try:
+        return float(re.sub(r"[\s ]", "", m.group(0)).replace(",", "."))
+    except ValueError:
+        return None
+
+
+def _load_state(out_dir: Path) -> Dict[str, Any]:
+    path = out_dir / STATE_FILE
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _save_state(out_dir: Path, state: Dict[str, Any]) -> None:
+    path = out_dir / STATE_FILE
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, ensure_ascii=False, indent=1), encoding="utf-8")
+    tmp.replace(path)
+
+
+def discover_params(conn, since: Optional[datetime], max_columns: int) -> Dict[str, bool]:
+    """Самые частые ключи features.params -> числовой ли тип (все значения похожи на число)."""
+    where = "WHERE p.scraped_at > :since" if since is not None else ""
+    rows = conn.execute(text(
+        "SELECT kv.key, count(*) AS n, bool_and(kv.value ~ " + _NUMERIC_PARAM_SQL + ") AS is_numeric "
+        "FROM intermark.properties_raw p "
+        "CROSS JOIN LATERAL jsonb_each_text(CASE WHEN jsonb_typeof(p.features->'params') = 'object' "
+        "THEN p.features->'params' ELSE '{}'::jsonb END) kv "
+        f"{where} GROUP BY kv.key ORDER BY n DESC LIMIT :max_columns"
+    ), {"since": since, "max_columns": max_columns}).all()
+    return {key: bool(is_numeric) for key, _, is_numeric in rows}
+
+
+def build_schema(params: Dict[str, bool], columns: Dict[str, str]):
+    import pyarrow as pa
+
+    fields = [
+        pa.field("id", pa.int64()),
+        pa.field("url", pa.string()),
+        pa.field("scraped_at", pa.timestamp("us", tz="UTC")),
+        pa.field("crawl_date", pa.string()),
+        pa.field("source_page", pa.string()),
+        pa.field("title", pa.string()),
+        pa.field("location", pa.string()),
+        pa.field("country_id", pa.int32()),
+        pa.field("region_id", pa.int32()),
+        pa.field("city_id", pa.int32()),
+        pa.field("price_raw", pa.string()),
+        pa.field("area_raw", pa.string()),
+        pa.field("object_id", pa.string()),
+        pa.field("description", pa.string()),
+        pa.field("features", pa.string()),
+    ]
+    for key, is_numeric in sorted(params.items()):
+        fields.append(pa.field(columns[key], pa.float64() if is_numeric else pa.string()))
+    return pa.schema(fields)
+
+
+def rows_to_table(rows, params: Dict[str, bool], columns_by_key: Dict[str, str], schema):
+    import pyarrow as pa
+
+    columns: Dict[str, List[Any]] = {name: [] for name in schema.names}
+    for row in rows:
+        for name in BASE_COLUMNS:
+            columns[name].append(row[name])
+        columns["crawl_date"].append(row["scraped_at"].date().isoformat())
+        features = row["features"]
+        columns["features"].append(None if features is None else json.dumps(features, ensure_ascii=False))
+
+        row_params = features.get("params") if isinstance(features, dict) else None
+        if not isinstance(row_params, dict):
+            row_params = {}
+        for key, is_numeric in params.items():
+            value = row_params.get(key)
+            columns[columns_by_key[key]].append(parse_number(value) if is_numeric else value)
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def export(
+    engine,
+    out_dir: str,
+    full: bool = False,
+    chunk_size: int = 5000,
+    max_param_columns: int = 50,
+) -> int:
+    """Выгружает новые (или все при full=True) строки; возвращает их число."""
+    import pyarrow.parquet as pq
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    state = {} if full else _load_state(out)
+    since = datetime.fromisoformat(state["since"]) if state.get("since") else None
+
+    with engine.connect() as conn:
+        # схема params не сужается между выгрузками: старые ключи сохраняют колонку и тип
+        params = {**discover_params(conn, since, max_param_columns), **state.get("params", {})}
+    param_columns = assign_param_columns(params, state.get("columns"))
+    schema = build_schema(params, param_columns)
+
+    where = "WHERE scraped_at > :since" if since is not None else ""
+    stmt = text(f"SELECT {', '.join(BASE_COLUMNS)}, features FROM intermark.properties_raw {where}")
+    token = uuid.uuid4().hex[:12]
+    total = 0
+    watermark = since
+
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=chunk_size) as conn:
+        result = conn.execute(stmt, {"since": since}).mappings()
+        for chunk_no, rows in enumerate(result.partitions(chunk_size)):
+            table = rows_to_table(rows, params, param_columns, schema)
+            pq.write_to_dataset(
+                table,
+                root_path=str(out),
+                partition_cols=PARTITION_COLS,
+                basename_template=f"part-{token}-{chunk_no:05d}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+                use_dictionary=DICTIONARY_COLUMNS,
+                compression="zstd",
+            )
+            total += len(rows)
+            chunk_max = max(r["scraped_at"] for r in rows)
+            watermark = chunk_max if watermark is None else max(watermark, chunk_max)
+            logger.info("[export] chunk %s: %s rows (total %s)", chunk_no, len(rows), total)
+
+    _save_state(out, {
+        "since": watermark.isoformat() if watermark is not None else None,
+        "params": params,
+        "columns": param_columns,
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+    })
+    return total
+
+
+# -------------------------
+# Scrapy feed exporter
+# -------------------------
+FEED_ITEM_FIELDS = ("url", "source_page", "title", "location", "price_raw", "area_raw", "object_id", "description")
+
+
+def _feed_schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [pa.field("scraped_at", pa.timestamp("us", tz="UTC")), pa.field("stage", pa.string())]
+        + [pa.field(name, pa.string()) for name in FEED_ITEM_FIELDS]
+        + [pa.field("params", pa.map_(pa.string(), pa.string())), pa.field("features", pa.string())]
+    )
+
+
+class ParquetItemExporter(BaseItemExporter):
+    """
+    FEED_EXPORTERS = {"parquet": ...}: item-ы паука -> один Parquet-файл, row group на batch_size item-ов.
+    Ключи params заранее неизвестны, поэтому здесь они — map<string, string>, а не отдельные колонки.
+    """
+
+    def __init__(self, file, batch_size: int = 1000, **kwargs):
+        super().__init__(dont_fail=True, **kwargs)
+        self.file = file
+        self.batch_size = int(batch_size)
+        self._batch: List[Dict[str, Any]] = []
+        self._writer = None
+        self._schema = None
+
+    def start_exporting(self):
+        import pyarrow.parquet as pq
+
+        self._schema = _feed_schema()
+        self._writer = pq.ParquetWriter(
+            self.file, self._schema, use_dictionary=DICTIONARY_COLUMNS, compression="zstd"
+        )
+
+    def export_item(self, item):
+        self._batch.append(ItemAdapter(item).asdict())
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        import pyarrow as pa
+
+        if not self._batch:
+            return
+        columns: Dict[str, List[Any]] = {name: [] for name in self._schema.names}
+        for a in self._batch:
+            scraped_at = a.get("scraped_at")
+            if isinstance(scraped_at, str):
+                scraped_at = datetime.fromisoformat(scraped_at)
+            features = a.get("features") if isinstance(a.get("features"), dict) else {}
+            params = features.get("params") if isinstance(features.get("params"), dict) else {}
+
+            columns["scraped_at"].append(scraped_at)
+            columns["stage"].append(features.get("from"))
+            for name in FEED_ITEM_FIELDS:
+                columns[name].append(a.get(name))
+            columns["params"].append([(str(k), None if v is None else str(v)) for k, v in params.items()])
+            columns["features"].append(json.dumps(features, ensure_ascii=False, default=str))
+        self._writer.write_table(pa.Table.from_pydict(columns, schema=self._schema))
+        self._batch = []
+
+    def finish_exporting(self):
+        self._flush()
+        self._writer.close()
+
+
+def main() -> None:
+    from intermark_scraper.pipelines import get_connection_string
+
+    parser = argparse.ArgumentParser(description="properties_raw -> Parquet (crawl_date/region_id)")
+    parser.add_argument("--out", default="exports/properties_raw")
+    parser.add_argument("--full", action="store_true", help="выгрузить всё, игнорируя водяной знак")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--max-param-columns", type=int, default=50)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
+    engine = create_engine(get_connection_string())
+    try:
+        total = export(engine, args.out, full=args.full, chunk_size=args.chunk_size,
+                       max_param_columns=args.max_param_columns)
+        logger.info("Exported %s rows to %s", total, args.out)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+# Extensions проекта
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import gc
+import logging
+import os
+import time
+import tracemalloc
+from typing import Dict
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.defer import deferred_from_coro
+from twisted.internet import task
+
+logger = logging.getLogger(__name__)
+
+# Кастомные сигналы (шлёт TabRenderMiddleware / слушает AdaptiveConcurrency)
+render_finished = object()        # kwargs: seconds: float, ok: bool
+render_limit_changed = object()   # kwargs: limit: int
+
+
+class _Window:
+    """Метрики за одно окно контроллера."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.blocks = 0
+        self.latency_sum = 0.0
+
+    def add(self, latency: float, error: bool = False, blocked: bool = False) -> None:
+        self.count += 1
+        self.latency_sum += latency
+        self.errors += int(error)
+        self.blocks += int(blocked)
+
+    @property
+    def mean_latency(self) -> float:
+        return self.latency_sum / self.count if self.count else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.count if self.count else 0.0
+
+
+class _AIMD:
+    """Additive increase / multiplicative decrease в пределах [floor, ceiling]."""
+
+    def __init__(self, name: str, floor: int, ceiling: int, target_latency: float, max_error_rate: float):
+        self.name = name
+        self.floor = floor
+        self.ceiling = max(ceiling, floor)
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.value = floor
+
+    def decide(self, w: _Window) -> str:
+        if w.count == 0:
+            return "hold"
+        if w.blocks or w.error_rate > self.max_error_rate or w.mean_latency > self.target_latency:
+            new = max(self.floor, self.value // 2)
+            action = "decrease"
+        else:
+            new = min(self.ceiling, self.value + 1)
+            action = "increase"
+        if new == self.value:
+            return "hold"
+        self.value = new
+        return action
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD-контроллер параллельности: отдельно для HTTP и для рендеров.
+
+    HTTP: сигнал response_downloaded (до RetryMiddleware/HTTPERROR_ALLOWED_CODES, поэтому видим
+    и 403/429, на которые реагирует SmartRetryMiddleware, и 5xx) + request_left_downloader без ответа
+    (таймауты/обрывы). Слоты из DOWNLOAD_SLOTS ("images") в окно не попадают и не регулируются.
+    Render: сигнал render_finished от TabRenderMiddleware.
+
+    Раз в ADAPTIVE_INTERVAL секунд: блок (403/429), доля ошибок > ADAPTIVE_MAX_ERROR_RATE или
+    средняя задержка > ADAPTIVE_TARGET_LATENCY -> делим пополам, иначе +1.
+    Решения пишутся в stats (adaptive/*) и в лог.
+
+    Slot отдаёт не больше одного запроса за slot.delay, поэтому контроллер ведёт и задержку:
+    delay = DOWNLOAD_DELAY / concurrency (при concurrency 1 — как без контроллера).
+    AutoThrottle при этом должен быть выключен (паук выключает его сам, см. update_settings);
+    слоты, появившиеся между тиками, настраиваются на request_reached_downloader.
+    """
+
+    BLOCK_CODES = {403, 429}
+
+    def __init__(self, crawler):
+        s = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.interval = s.getfloat("ADAPTIVE_INTERVAL", 10.0)
+        self.reserved_slots = set((s.getdict("DOWNLOAD_SLOTS") or {}).keys())
+        self.base_delay = s.getfloat("DOWNLOAD_DELAY", 0.0)
+
+        self.http = _AIMD(
+            "http",
+            s.getint("ADAPTIVE_HTTP_MIN", 1),
+            s.getint("ADAPTIVE_HTTP_MAX", 8),
+            s.getfloat("ADAPTIVE_TARGET_LATENCY", 2.0),
+            s.getfloat("ADAPTIVE_MAX_ERROR_RATE", 0.05),
+        )
+        self.render = _AIMD(
+            "render",
+            s.getint("ADAPTIVE_RENDER_MIN", 1),
+            s.getint("ADAPTIVE_RENDER_MAX", 4),
+            s.getfloat("ADAPTIVE_RENDER_TARGET_LATENCY", 8.0),
+            s.getfloat("ADAPTIVE_MAX_ERROR_RATE", 0.05),
+        )
+        self._windows: Dict[str, _Window] = {"http": _Window(), "render": _Window()}
+        self._loop = None
+        self._answered = set()  # id(request) HTTP-запросов, на которые пришёл ответ
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED", False):
+            raise NotConfigured("ADAPTIVE_CONCURRENCY_ENABLED is off")
+        if crawler.settings.getbool("AUTOTHROTTLE_ENABLED"):
+            logger.warning("[adaptive] AUTOTHROTTLE_ENABLED is on: AutoThrottle will fight the controller over slot.delay")
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(ext.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(ext.request_left_downloader, signal=signals.request_left_downloader)
+        crawler.signals.connect(ext.on_render_finished, signal=render_finished)
+        return ext
+
+    def spider_opened(self, spider):
+        self._apply(spider)
+        self._loop = task.LoopingCall(self._tick, spider)
+        self._loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+
+    def _http_slot(self, request) -> bool:
+        """
+        Запрос из HTTP-выборки контроллера. Не считаем: зарезервированные слоты (картинки),
+        data:-заглушки (Selenium-деталка рендерится в callback-е, idle-flush coalescer-а) — ~0 мс
+        или время рендера, и meta["render"] — их учитывает окно render (render_finished).
+        """
+        return (
+            request.meta.get("download_slot") not in self.reserved_slots
+            and not request.url.startswith("data:")
+            and not request.meta.get("render")
+        )
+
+    def request_reached_downloader(self, request, spider):
+        # слот создаётся при первом запросе в него — настраиваем сразу, а не на следующем тике
+        if self._http_slot(request):
+            slot = self.crawler.engine.downloader.slots.get(request.meta.get("download_slot"))
+            if slot is not None and slot.concurrency != self.http.value:
+                self._apply_slot(slot)
+
+    def response_downloaded(self, response, request, spider):
+        if not self._http_slot(request):
+            return
+        self._answered.add(id(request))
+        latency = request.meta.get("download_latency") or 0.0
+        self._windows["http"].add(
+            latency,
+            error=response.status >= 500,
+            blocked=response.status in self.BLOCK_CODES,
+        )
+
+    def request_left_downloader(self, request, spider):
+        if not self._http_slot(request):
+            return
+        if id(request) in self._answered:
+            self._answered.discard(id(request))
+            return
+        # ушёл из загрузчика без ответа: таймаут/обрыв соединения
+        w = self._windows["http"]
+        w.count += 1
+        w.errors += 1
+
+    def on_render_finished(self, seconds: float, ok: bool):
+        self._windows["render"].add(seconds, error=not ok)
+
+    def _tick(self, spider):
+        for ctl in (self.http, self.render):
+            w = self._windows[ctl.name]
+            action = ctl.decide(w)
+            if action != "hold":
+                self.stats.inc_value(f"adaptive/{ctl.name}/{action}")
+                logger.info(
+                    "[adaptive] %s %s -> %s (n=%s lat=%.2fs err=%.2f blocks=%s)",
+                    ctl.name, action, ctl.value, w.count, w.mean_latency, w.error_rate, w.blocks,
+                )
+            self._windows[ctl.name] = _Window()
+        self._apply(spider)
+
+    def _apply(self, spider):
+        downloader = self.crawler.engine.downloader
+        # общий лимит движка = HTTP + рендеры (рендер-запросы тоже занимают слот движка)
+        downloader.total_concurrency = self.http.value + self.render.value
+        for key, slot in downloader.slots.items():
+            if key not in self.reserved_slots:
+                self._apply_slot(slot)
+        self.crawler.signals.send_catch_log(render_limit_changed, limit=self.render.value)
+
+        self.stats.set_value("adaptive/http_concurrency", self.http.value)
+        self.stats.set_value("adaptive/render_concurrency", self.render.value)
+        self.stats.max_value("adaptive/http_concurrency_max", self.http.value)
+        self.stats.max_value("adaptive/render_concurrency_max", self.render.value)
+
+    def _apply_slot(self, slot) -> None:
+        slot.concurrency = self.http.value
+        slot.delay = self.base_delay / self.http.value
+
+
+def _proc_rss_mb(pid) -> float:
+    """VmRSS процесса из /proc (Linux); 0.0, если процесса уже нет."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return 0.0
+
+
+def _children(pid: int):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", encoding="ascii") as f:
+            return [int(x) for x in f.read().split()]
+    except (OSError, ValueError):
+        return []
+
+
+def browser_rss_mb(root_pid: int) -> float:
+    """Суммарный RSS потомков процесса, похожих на браузер (chromedriver, chrome, playwright-node)."""
+    total = 0.0
+    stack = _children(root_pid)
+    while stack:
+        pid = stack.pop()
+        stack.extend(_children(pid))
+        try:
+            with open(f"/proc/{pid}/comm", encoding="utf-8") as f:
+                comm = f.read().strip().lower()
+        except OSError:
+            continue
+        if "chrom" in comm or comm in {"node", "headless_shell"}:
+            total += _proc_rss_mb(pid)
+    return total
+
+
+class MemoryGuard:
+    """
+    Диагностика памяти длинных ранов (MEMGUARD_ENABLED).
+
+    Раз в MEMGUARD_INTERVAL секунд пишет в stats (memguard/*):
+    - rss_mb — RSS процесса Python, browser_rss_mb — RSS дочерних процессов браузера
+    - размеры структур паука: _listing_visited, db_urls, db_need_detail_urls, entity_index,
+      очередь планировщика (там лежат listing_item в meta detail-запросов);
+      придержанные coalescer-ом item-ы — в coalesce/pending
+    - при MEMGUARD_TRACEMALLOC — топ аллокаторов (файл:строка) в лог и stats
+
+    Пороги:
+    - browser_rss_mb > MEMGUARD_BROWSER_RECYCLE_MB — в режиме tabs перезапускается Chromium пула
+      (spider.tab_pool.recycle(), после текущих рендеров); в режиме Selenium, если драйвер поднят,
+      он закрывается, следующий рендер поднимет новый (рендеры синхронные, тик не попадает в середину)
+    - rss_mb > MEMGUARD_PAUSE_MB — движок ставится на паузу (gc.collect), снимается при
+      rss_mb < MEMGUARD_RESUME_MB или через MEMGUARD_MAX_PAUSE секунд
+    """
+
+    def __init__(self, crawler):
+        s = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.interval = s.getfloat("MEMGUARD_INTERVAL", 30.0)
+        self.use_tracemalloc = s.getbool("MEMGUARD_TRACEMALLOC", False)
+        self.top_n = s.getint("MEMGUARD_TRACEMALLOC_TOP", 10)
+        self.browser_recycle_mb = s.getfloat("MEMGUARD_BROWSER_RECYCLE_MB", 0)
+        self.pause_mb = s.getfloat("MEMGUARD_PAUSE_MB", 0)
+        self.resume_mb = s.getfloat("MEMGUARD_RESUME_MB", self.pause_mb * 0.8)
+        self.max_pause = s.getfloat("MEMGUARD_MAX_PAUSE", 120.0)
+        self._paused_at = None
+        self._loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("MEMGUARD_ENABLED", False):
+            raise NotConfigured("MEMGUARD_ENABLED is off")
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        if self.use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+        self._loop = task.LoopingCall(self._tick, spider)
+        self._loop.start(self.interval, now=True)
+
+    def spider_closed(self, spider):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self._tick(spider)
+        if self.use_tracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _structure_sizes(self, spider) -> Dict[str, int]:
+        sizes = {}
+        for name in ("_listing_visited", "db_urls", "db_need_detail_urls", "entity_index"):
+            obj = getattr(spider, name, None)
+            if obj is not None:
+                sizes[name.lstrip("_")] = len(obj)
+        engine = self.crawler.engine
+        slot = getattr(engine, "_slot", None) or getattr(engine, "slot", None)
+        scheduler = getattr(slot, "scheduler", None) or getattr(engine, "_scheduler", None)
+        if scheduler is not None:
+            try:
+                sizes["scheduler_queue"] = len(scheduler)
+            except TypeError:
+                pass
+        return sizes
+
+    def _tick(self, spider):
+        rss = _proc_rss_mb("self")
+        browser = browser_rss_mb(os.getpid())
+
+        self.stats.set_value("memguard/rss_mb", round(rss, 1))
+        self.stats.max_value("memguard/rss_mb_max", round(rss, 1))
+        self.stats.set_value("memguard/browser_rss_mb", round(browser, 1))
+        self.stats.max_value("memguard/browser_rss_mb_max", round(browser, 1))
+        sizes = self._structure_sizes(spider)
+        for name, size in sizes.items():
+            self.stats.set_value(f"memguard/size/{name}", size)
+
+        logger.info(
+            "[memguard] rss=%.1fMB browser=%.1fMB sizes=%s", rss, browser, sizes,
+        )
+
+        if self.use_tracemalloc and tracemalloc.is_tracing():
+            top = tracemalloc.take_snapshot().statistics("lineno")[: self.top_n]
+            for i, stat in enumerate(top):
+                frame = stat.traceback[0]
+                where = f"{os.path.basename(frame.filename)}:{frame.lineno}"
+                self.stats.set_value(f"memguard/top/{i}", f"{where} {stat.size / 1024:.0f}KB")
+                logger.info("[memguard] top%s %s size=%.0fKB count=%s", i, where, stat.size / 1024, stat.count)
+
+        if self.browser_recycle_mb and browser > self.browser_recycle_mb:
+            self._recycle_browser(spider, browser)
+
+        self._check_pause(rss)
+
+    def _recycle_browser(self, spider, browser: float) -> None:
+        pool = getattr(spider, "tab_pool", None)
+        if pool is not None:
+            if pool.recycling:
+                return
+            logger.warning("[memguard] browser rss %.1fMB > %.1fMB: recycling tab pool", browser, self.browser_recycle_mb)
+            d = deferred_from_coro(pool.recycle())
+            d.addErrback(lambda f: logger.error("[memguard] tab pool recycle failed: %s", f.value))
+            self.stats.inc_value("memguard/tab_pool_recycled")
+        elif getattr(spider, "_driver", None) is not None:
+            logger.warning("[memguard] browser rss %.1fMB > %.1fMB: recycling driver", browser, self.browser_recycle_mb)
+            spider._quit_driver()
+            self.stats.inc_value("memguard/driver_recycled")
+
+    def _check_pause(self, rss: float) -> None:
+        if not self.pause_mb:
+            return
+        engine = self.crawler.engine
+        if self._paused_at is None and rss > self.pause_mb:
+            logger.warning("[memguard] rss %.1fMB > %.1fMB: pausing engine", rss, self.pause_mb)
+            engine.pause()
+            gc.collect()
+            self._paused_at = time.monotonic()
+            self.stats.inc_value("memguard/paused")
+        elif self._paused_at is not None:
+            waited = time.monotonic() - self._paused_at
+            if rss < self.resume_mb or waited > self.max_pause:
+                logger.info("[memguard] resuming engine rss=%.1fMB after %.0fs", rss, waited)
+                engine.unpause()
+                self._paused_at = None
@@ -0,0 +1,146 @@
+"""
+Выбор способа загрузки detail-страниц: сразу HTTP (static) или сразу рендер браузером.
+
+Раньше каждая detail-страница качалась Scrapy, и если extract_description ничего не находил —
+качалась ещё раз браузером. Для разделов, где в статическом HTML описания не бывает,
+мы каждый раз платили за лишний HTTP-запрос и парсинг.
+
+FetchRouter ведёт долю успехов статического извлечения по двум ключам:
+- pattern — путь без последнего сегмента + форма последнего ("/objects/*", "/objects/#"),
+- section — первый сегмент пути ("objects").
+Решение принимается по самому узкому ключу с достаточным числом наблюдений (ROUTER_MIN_SAMPLES):
+доля успехов ниже ROUTER_STATIC_MIN_SUCCESS -> "render". Каждый ROUTER_PROBE_EVERY-й такой
+запрос всё равно идёт static ("probe") — если сайт начал отдавать описание в HTML, ключ вернётся.
+
+Счётчики — скользящее окно (ROUTER_WINDOW): при переполнении оба масштабируются вниз.
+Состояние сохраняется в json (ROUTER_STATE_FILE) между ранами; решения — в stats router/*.
+"""
+
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+STATIC = "static"
+RENDER = "render"
+PROBE = "probe"
+
+_DIGITS_RE = re.compile(r"^\d+$")
+
+
+def url_keys(url: str) -> Tuple[str, str]:
+    """https://intermark.ru/objects/villa-123/ -> ("pattern:/objects/*", "section:objects")"""
+    segments = [s for s in urlparse(url).path.split("/") if s]
+    if not segments:
+        return "pattern:/", "section:/"
+    last = "#" if _DIGITS_RE.match(segments[-1]) else "*"
+    pattern = "/" + "/".join(segments[:-1] + [last])
+    return f"pattern:{pattern}", f"section:{segments[0]}"
+
+
+class FetchRouter:
+    def __init__(
+        self,
+        state_file: Optional[str] = None,
+        min_samples: int = 10,
+        min_success: float = 0.2,
+        probe_every: int = 20,
+        window: int = 200,
+    ):
+        self.state_file = state_file
+        self.min_samples = min_samples
+        self.min_success = min_success
+        self.probe_every = max(int(probe_every), 1)
+        self.window = window
+        # key -> [static_ok, static_fail]
+        self.counts: Dict[str, List[float]] = {}
+        self._routed: Dict[str, int] = {}
+        self.stats = None
+
+    @classmethod
+    def from_settings(cls, settings) -> "FetchRouter":
+        router = cls(
+            state_file=settings.get("ROUTER_STATE_FILE", ".fetch_router.json"),
+            min_samples=settings.getint("ROUTER_MIN_SAMPLES", 10),
+            min_success=settings.getfloat("ROUTER_STATIC_MIN_SUCCESS", 0.2),
+            probe_every=settings.getint("ROUTER_PROBE_EVERY", 20),
+            window=settings.getint("ROUTER_WINDOW", 200),
+        )
+        router.load()
+        return router
+
+    def load(self) -> None:
+        if not self.state_file or not Path(self.state_file).exists():
+            return
+        try:
+            data = json.loads(Path(self.state_file).read_text(encoding="utf-8"))
+            self.counts = {k: [float(ok), float(fail)] for k, (ok, fail) in data["counts"].items()}
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            logger.warning("[router] broken state file %s: %s", self.state_file, e)
+            return
+        logger.info("[router] loaded %s keys from %s", len(self.counts), self.state_file)
+
+    def save(self) -> None:
+        if not self.state_file:
+            return
+        path = Path(self.state_file)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(json.dumps({"counts": self.counts}, ensure_ascii=False, indent=1), encoding="utf-8")
+        tmp.replace(path)
+
+    def _inc(self, name: str) -> None:
+        if self.stats is not None:
+            self.stats.inc_value(f"router/{name}")
+
+    def success_rate(self, key: str) -> Optional[float]:
+        ok, fail = self.counts.get(key, (0.0, 0.0))
+        if ok + fail < self.min_samples:
+            return None
+        return ok / (ok + fail)
+
+    def decide(self, url: str) -> Tuple[str, Optional[str]]:
+        """(mode, key): mode — STATIC / RENDER / PROBE, key — по какому ключу принято решение."""
+        for key in url_keys(url):
+            rate = self.success_rate(key)
+            if rate is None:
+                continue
+            if rate >= self.min_success:
+                return STATIC, key
+            n = self._routed.get(key, 0)
+            self._routed[key] = n + 1
+            if n % self.probe_every == self.probe_every - 1:
+                return PROBE, key
+            return RENDER, key
+        return STATIC, None
+
+    def route(self, url: str) -> str:
+        mode, key = self.decide(url)
+        self._inc(mode)
+        if mode != STATIC:
+            logger.debug("[router] %s -> %s (by %s)", url, mode, key)
+        return mode
+
+    def record(self, url: str, ok: bool) -> None:
+        """Итог статического извлечения (обычный static-запрос или probe)."""
+        for key in url_keys(url):
+            counts = self.counts.setdefault(key, [0.0, 0.0])
+            counts[0 if ok else 1] += 1
+            total = counts[0] + counts[1]
+            if total > self.window:
+                scale = self.window / total
+                counts[0] *= scale
+                counts[1] *= scale
+        self._inc("static_ok" if ok else "static_fail")
+
+    def report(self) -> Dict[str, str]:
+        """key -> текущее решение (для stats/логов в конце рана)."""
+        out = {}
+        for key in sorted(self.counts):
+            rate = self.success_rate(key)
+            out[key] = "learning" if rate is None else (STATIC if rate >= self.min_success else RENDER)
+        return out
@@ -0,0 +1,141 @@
+"""
+Планировщик пересканирования detail-страниц с учётом "свежести".
+
+Раньше detail качался только для новых url и url без description, известные объекты не обновлялись.
+Теперь для известных url:
+- интервал пересканирования = FRESHNESS_MIN_INTERVAL_H / change_rate (в пределах [min, max]),
+  change_rate — EWMA доли визитов, на которых менялись price_raw/area_raw/description
+- staleness = (now - last_detail_at) / interval; detail идёт, если staleness >= 1;
+  url без last_detail_at (detail по нему ещё не записывался) — максимально устаревший
+- бюджет FRESHNESS_DETAIL_BUDGET тратится на самые устаревшие: на старте (load) выбираются top-N
+  по staleness среди url, которые ещё видны в выдаче (scraped_at не старше FRESHNESS_MAX_INTERVAL_H —
+  его обновляет каждый listing-item), а не первые по порядку выдачи
+- приоритет запроса растёт со staleness
+
+Состояние — intermark.crawl_state (Postgres), обновляет DatabasePipeline после detail-item.
+"""
+
+import heapq
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from intermark_scraper.models import CrawlState, PropertiesRaw
+
+logger = logging.getLogger(__name__)
+
+# приоритет новых объектов и объектов без description — выше любого пересканирования
+PRIORITY_NEW = 1000
+_EWMA_ALPHA = 0.3
+_PRIOR_RATE = 0.5
+
+
+class FreshnessScheduler:
+    def __init__(self, budget: int = 50, min_interval_h: float = 24.0, max_interval_h: float = 24.0 * 30):
+        self.budget = budget
+        self.min_interval = timedelta(hours=min_interval_h)
+        self.max_interval = timedelta(hours=max_interval_h)
+        self.used = 0
+        # url -> (last_detail_at, change_rate)
+        self._state: Dict[str, Tuple[Optional[datetime], float]] = {}
+        # url -> приоритет: выбранные в load() самые устаревшие (не больше budget)
+        self._due: Dict[str, int] = {}
+        # состояние до record_visit в незакоммиченной транзакции pipeline (см. commit/rollback)
+        self._undo: Dict[str, Optional[Tuple[Optional[datetime], float]]] = {}
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            budget=settings.getint("FRESHNESS_DETAIL_BUDGET", 50),
+            min_interval_h=settings.getfloat("FRESHNESS_MIN_INTERVAL_H", 24.0),
+            max_interval_h=settings.getfloat("FRESHNESS_MAX_INTERVAL_H", 24.0 * 30),
+        )
+
+    def load(self, session, now: Optional[datetime] = None) -> None:
+        """crawl_state по известным url + выбор top-N самых устаревших под бюджет рана."""
+        now = now or datetime.now(timezone.utc)
+        listed_since = now - self.max_interval
+        rows = session.execute(
+            select(PropertiesRaw.url, PropertiesRaw.scraped_at, CrawlState.last_detail_at, CrawlState.change_rate)
+            .outerjoin(CrawlState, CrawlState.url == PropertiesRaw.url)
+        ).all()
+
+        candidates = []
+        for url, scraped_at, last_detail_at, change_rate in rows:
+            rate = _PRIOR_RATE if change_rate is None else change_rate
+            self._state[url] = (last_detail_at, rate)
+            # давно не было в выдаче (снят с сайта) — бюджет на него не тратим
+            if scraped_at is not None and scraped_at < listed_since:
+                continue
+            staleness = self.staleness(last_detail_at, rate, now)
+            if staleness >= 1.0:
+                candidates.append((staleness, url))
+
+        self._due = {
+            url: int(min(staleness * 10, PRIORITY_NEW - 1))
+            for staleness, url in heapq.nlargest(self.budget, candidates)
+        }
+        logger.info(
+            "[freshness] loaded state for %s urls: %s stale, %s scheduled (budget=%s)",
+            len(self._state), len(candidates), len(self._due), self.budget,
+        )
+
+    def interval(self, change_rate: float) -> timedelta:
+        floor_rate = self.min_interval / self.max_interval
+        return self.min_interval / max(change_rate, floor_rate)
+
+    def staleness(self, last_detail_at: Optional[datetime], change_rate: float, now: datetime) -> float:
+        if last_detail_at is None:
+            return float("inf")
+        return (now - last_detail_at) / self.interval(change_rate)
+
+    def revisit_priority(self, url: str) -> Optional[int]:
+        """Приоритет пересканирования известного url или None (не в числе самых устаревших / уже выдан)."""
+        priority = self._due.pop(url, None)
+        if priority is not None:
+            self.used += 1
+        return priority
+
+    def record_visit(self, session, url: str, changed: bool, at: Optional[datetime] = None) -> None:
+        """Upsert состояния после detail-визита (в транзакции pipeline)."""
+        at = at or datetime.now(timezone.utc)
+        self._undo.setdefault(url, self._state.get(url))
+        _, old_rate = self._state.get(url, (None, _PRIOR_RATE))
+        rate = (1 - _EWMA_ALPHA) * old_rate + _EWMA_ALPHA * (1.0 if changed else 0.0)
+        self._state[url] = (at, rate)
+
+        stmt = insert(CrawlState).values(
+            url=url,
+            last_detail_at=at,
+            next_due_at=at + self.interval(rate),
+            visits=1,
+            changes=int(changed),
+            change_rate=rate,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CrawlState.url],
+            set_={
+                "last_detail_at": stmt.excluded.last_detail_at,
+                "next_due_at": stmt.excluded.next_due_at,
+                "visits": CrawlState.visits + 1,
+                "changes": CrawlState.changes + stmt.excluded.changes,
+                "change_rate": stmt.excluded.change_rate,
+            },
+        )
+        session.execute(stmt)
+
+    def commit(self) -> None:
+        """Транзакция с record_visit закоммичена: in-memory состояние окончательное."""
+        self._undo.clear()
+
+    def rollback(self) -> None:
+        """Транзакция откатилась: возвращаем _state, иначе повтор пачки применит EWMA второй раз."""
+        for url, previous in self._undo.items():
+            if previous is None:
+                self._state.pop(url, None)
+            else:
+                self._state[url] = previous
+        self._undo.clear()
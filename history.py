@@ -0,0 +1,114 @@
+"""
+CDC-история по properties_raw: какие поля изменились между краулами.
+
+properties_raw хранит только последнее состояние, поэтому изменения цены/площади/описания
+пишем отдельно в intermark.property_changes (append-only, секции по месяцам).
+Тренды цен читают только эту таблицу, а не снимки всей properties_raw.
+"""
+
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select, text
+
+from intermark_scraper.models import PropertiesRaw, PropertyChange
+
+# компактная кодировка полей (SMALLINT вместо имени)
+FIELD_CODES: Dict[str, int] = {
+    "price_raw": 1,
+    "area_raw": 2,
+    "description_hash": 3,
+}
+FIELD_NAMES: Dict[int, str] = {v: k for k, v in FIELD_CODES.items()}
+
+TRACKED_FIELDS = ("price_raw", "area_raw")
+
+_TABLE = "intermark.property_changes"
+
+logger = logging.getLogger(__name__)
+
+
+def description_hash(description: Optional[str]) -> Optional[str]:
+    """Короткий стабильный хеш описания (16 hex-символов), None для пустого."""
+    if not description:
+        return None
+    return hashlib.blake2b(str(description).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def change_row(property_id: int, field: str, old: Any, new: Any, changed_at: Optional[datetime]) -> Dict[str, Any]:
+    return {
+        "property_id": property_id,
+        "field": FIELD_CODES[field],
+        "old_value": None if old is None else str(old),
+        "new_value": None if new is None else str(new),
+        "changed_at": changed_at or datetime.now(timezone.utc),
+    }
+
+
+def write_changes(session, rows: List[Dict[str, Any]]) -> None:
+    """Пакетная вставка (executemany) в той же транзакции, что и upsert."""
+    if rows:
+        session.execute(PropertyChange.__table__.insert(), rows)
+
+
+def _month_start(dt: datetime) -> datetime:
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_month(dt: datetime) -> datetime:
+    if dt.month == 12:
+        return dt.replace(year=dt.year + 1, month=1)
+    return dt.replace(month=dt.month + 1)
+
+
+def ensure_month_partitions(engine, now: Optional[datetime] = None, months_ahead: int = 1) -> None:
+    """
+    Создаёт секции property_changes на текущий месяц (+ months_ahead вперёд).
+
+    DEFAULT-секцию не создаём: строки в ней блокируют CREATE TABLE ... PARTITION OF на их месяц
+    (пересечение диапазонов). Если она осталась от прежних версий, строки нужного месяца
+    переносятся из неё в новую секцию.
+    """
+    start = _month_start(now or datetime.now(timezone.utc))
+
+    with engine.begin() as conn:
+        has_default = conn.execute(text(f"SELECT to_regclass('{_TABLE}_default')")).scalar() is not None
+        for _ in range(months_ahead + 1):
+            end = _add_month(start)
+            name = f"{_TABLE}_{start:%Y%m}"
+            bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            exists = conn.execute(text(f"SELECT to_regclass('{name}')")).scalar() is not None
+            if not exists and has_default:
+                conn.execute(text(f"ALTER TABLE {_TABLE} DETACH PARTITION {_TABLE}_default"))
+                conn.execute(text(f"CREATE TABLE {name} PARTITION OF {_TABLE} {bounds}"))
+                moved = conn.execute(text(
+                    f"WITH moved AS (DELETE FROM {_TABLE}_default "
+                    "WHERE changed_at >= :start AND changed_at < :end RETURNING *) "
+                    f"INSERT INTO {name} SELECT * FROM moved"
+                ), {"start": start, "end": end}).rowcount
+                conn.execute(text(f"ALTER TABLE {_TABLE} ATTACH PARTITION {_TABLE}_default DEFAULT"))
+                if moved:
+                    logger.info("[history] moved %s rows from %s_default into %s", moved, _TABLE, name)
+            elif not exists:
+                conn.execute(text(f"CREATE TABLE {name} PARTITION OF {_TABLE} {bounds}"))
+            start = end
+
+
+def price_trend(session, since: Optional[datetime] = None, url: Optional[str] = None):
+    """
+    История цен: (url, changed_at, old_value, new_value), только строки изменений.
+    Фильтр по since отсекает старые секции (partition pruning).
+    """
+    stmt = (
+        select(PropertiesRaw.url, PropertyChange.changed_at, PropertyChange.old_value, PropertyChange.new_value)
+        .join(PropertiesRaw, PropertiesRaw.id == PropertyChange.property_id)
+        .where(PropertyChange.field == FIELD_CODES["price_raw"])
+        .order_by(PropertyChange.property_id, PropertyChange.changed_at)
+    )
+    if since is not None:
+        stmt = stmt.where(PropertyChange.changed_at >= since)
+    if url is not None:
+        stmt = stmt.where(PropertiesRaw.url == url)
+    return session.execute(stmt).all()
@@ -0,0 +1,252 @@
+"""
+Метаданные картинок объявлений (опционально, IMAGES_META_ENABLED).
+
+features["images"] — только url; одна и та же фотография встречается в разных размерах CDN.
+ImageMetadataPipeline:
+- качает картинки через движок Scrapy (свой download slot + DeferredSemaphore, лимит размера)
+- хранит файлы content-addressed: <store>/ab/abcdef...(sha256), повторно не качает
+- считает размеры и dHash (64 бит), склеивает варианты одного фото по расстоянию Хэмминга
+- пишет компактные строки в features["image_meta"] и уникальные url в features["images_unique"]
+  (между стадиями они мерджатся, а не перезаписываются — см. storage._merge_features)
+- запись файлов и index.jsonl — в пуле потоков (deferToThread), реактор не блокируется
+
+Pillow — необязательная зависимость: без неё pipeline не включается (NotConfigured).
+"""
+
+import hashlib
+import io
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import scrapy
+from itemadapter import ItemAdapter
+from scrapy.exceptions import NotConfigured
+from twisted.internet.defer import DeferredList, DeferredSemaphore
+from twisted.internet.threads import deferToThread
+
+logger = logging.getLogger(__name__)
+
+_BANDS = 4          # 64-битный хеш -> 4 полосы по 16 бит
+_BAND_BITS = 16
+
+
+def dhash(image, size: int = 8) -> int:
+    """Difference hash: 64 бита, устойчив к масштабированию и перекодированию JPEG."""
+    gray = image.convert("L").resize((size + 1, size))
+    px = list(gray.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = px[row * (size + 1) + col]
+            right = px[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    return bits
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _store_and_analyze(path: Path, body: bytes) -> Dict[str, Any]:
+    """
+    Тяжёлая часть (декодирование + dHash, запись файла) — в пуле потоков, не в реакторе.
+    Сначала декодируем целиком: битое/не-картинка падает здесь и не попадает в хранилище под своим sha.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(body)) as img:
+        img.load()
+        width, height = img.size
+        phash = dhash(img)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(body)
+    return {"w": width, "h": height, "p": format(phash, "016x")}
+
+
+class ImageIndex:
+    """
+    Локальный индекс хранилища: url -> sha256, sha256 -> метаданные, поиск близких dHash.
+
+    Поиск близких хешей — multi-index hashing: при расстоянии <= _BANDS - 1 хотя бы одна
+    16-битная полоса совпадает точно, поэтому сравниваем только кандидатов из общих полос.
+    """
+
+    def __init__(self, root: Path, max_distance: int = 3):
+        self.root = root
+        self.max_distance = min(max_distance, _BANDS - 1)
+        self.by_url: Dict[str, str] = {}
+        self.by_sha: Dict[str, Dict[str, Any]] = {}
+        self._bands: Dict[tuple, List[str]] = {}
+        self._index_path = root / "index.jsonl"
+        # index.jsonl дописывается из пула потоков (deferToThread) — строки не должны перемешиваться
+        self._write_lock = threading.Lock()
+
+    def load(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        if not self._index_path.exists():
+            return
+        with self._index_path.open(encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    self._register(json.loads(line), persist=False)
+
+    def path_for(self, sha: str) -> Path:
+        return self.root / sha[:2] / sha
+
+    def _band_keys(self, phash: int):
+        for band in range(_BANDS):
+            yield band, (phash >> (band * _BAND_BITS)) & 0xFFFF
+
+    def find_similar(self, phash: int) -> Optional[str]:
+        for key in self._band_keys(phash):
+            for sha in self._bands.get(key, ()):
+                if hamming(phash, int(self.by_sha[sha]["p"], 16)) <= self.max_distance:
+                    return sha
+        return None
+
+    def _register(self, row: Dict[str, Any], persist: bool = True) -> None:
+        sha = row["sha"]
+        self.by_url[row["url"]] = sha
+        if sha in self.by_sha:
+            return
+        # "dup" — sha канонического варианта (первого увиденного похожего фото)
+        row.setdefault("dup", self.find_similar(int(row["p"], 16)) or sha)
+        self.by_sha[sha] = row
+        for key in self._band_keys(int(row["p"], 16)):
+            self._bands.setdefault(key, []).append(sha)
+        if persist:
+            self._persist(row)
+
+    def _append(self, line: str) -> None:
+        with self._write_lock, self._index_path.open("a", encoding="utf-8") as f:
+            f.write(line)
+
+    def _persist(self, row: Dict[str, Any]) -> None:
+        # сериализуем в реакторе (row потом не меняется), пишем в пуле потоков
+        dfd = deferToThread(self._append, json.dumps(row, ensure_ascii=False) + "\n")
+        dfd.addErrback(lambda f: logger.warning("[images] index write failed: %s", f.getErrorMessage()))
+
+    def add(self, url: str, sha: str, size: int, meta: Dict[str, Any]) -> Dict[str, Any]:
+        """Регистрирует уже записанный файл (см. _store_and_analyze). Вызывается в потоке реактора."""
+        if sha in self.by_sha:
+            self.link(url, sha)
+        else:
+            self._register({"url": url, "sha": sha, "n": size, **meta})
+        return self.by_sha[sha]
+
+    def link(self, url: str, sha: str) -> None:
+        """Новый url уже известного файла (другой размер/CDN-вариант): в памяти и в index.jsonl."""
+        if self.by_url.get(url) == sha:
+            return
+        self.by_url[url] = sha
+        self._persist({**self.by_sha[sha], "url": url})
+
+
+class ImageMetadataPipeline:
+    def __init__(self, crawler, store: str, concurrency: int, max_bytes: int, max_distance: int):
+        self.crawler = crawler
+        self.index = ImageIndex(Path(store), max_distance=max_distance)
+        self.semaphore = DeferredSemaphore(concurrency)
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("IMAGES_META_ENABLED", False):
+            raise NotConfigured("IMAGES_META_ENABLED is off")
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            raise NotConfigured("Pillow is not installed")
+        return cls(
+            crawler,
+            store=settings.get("IMAGES_META_STORE", "images_store"),
+            concurrency=settings.getint("IMAGES_META_CONCURRENCY", 4),
+            max_bytes=settings.getint("IMAGES_META_MAX_BYTES", 5 * 1024 * 1024),
+            max_distance=settings.getint("IMAGES_META_PHASH_DISTANCE", 3),
+        )
+
+    def open_spider(self, spider):
+        self.index.load()
+        logger.info("[images] index loaded: %s files, %s urls", len(self.index.by_sha), len(self.index.by_url))
+
+    def process_item(self, item, spider):
+        a = ItemAdapter(item)
+        features = a.get("features")
+        if not isinstance(features, dict) or not features.get("images"):
+            return item
+
+        stats = self.crawler.stats
+        dfds = []
+        for url in features["images"]:
+            if url in self.index.by_url:
+                stats.inc_value("images/cached")
+                continue
+            dfds.append(self.semaphore.run(self._fetch, url))
+
+        dl = DeferredList(dfds, consumeErrors=True)
+        dl.addCallback(lambda _: self._attach(features))
+        dl.addCallback(lambda _: item)
+        return dl
+
+    def _fetch(self, url: str):
+        request = scrapy.Request(
+            url,
+            meta={
+                # отдельный слот: картинки с CDN не делят очередь с html (см. DOWNLOAD_SLOTS)
+                "download_slot": "images",
+                "download_maxsize": self.max_bytes,
+                "dont_retry": True,
+            },
+        )
+        dfd = self.crawler.engine.download(request)
+        dfd.addCallback(self._on_response, url)
+        dfd.addErrback(self._on_error, url)
+        return dfd
+
+    def _on_response(self, response, url: str):
+        if response.status != 200 or not response.body:
+            self.crawler.stats.inc_value(f"images/status/{response.status}")
+            return None
+        body = response.body
+        sha = hashlib.sha256(body).hexdigest()
+
+        if sha in self.index.by_sha:
+            # тот же файл под другим url: запоминаем url, чтобы в следующих ранах его не качать
+            self.index.link(url, sha)
+            self.crawler.stats.inc_value("images/same_content")
+            return None
+
+        dfd = deferToThread(_store_and_analyze, self.index.path_for(sha), body)
+        dfd.addCallback(lambda meta: self.index.add(url, sha, len(body), meta))
+        dfd.addCallback(lambda _: self.crawler.stats.inc_value("images/downloaded"))
+        dfd.addErrback(self._on_error, url)
+        return dfd
+
+    def _on_error(self, failure, url: str):
+        self.crawler.stats.inc_value("images/failed")
+        logger.warning("[images] failed url=%s err=%s", url, failure.getErrorMessage())
+        return None
+
+    def _attach(self, features: Dict[str, Any]) -> None:
+        meta_rows = []
+        unique: List[str] = []
+        seen_groups = set()
+        for url in features["images"]:
+            sha = self.index.by_url.get(url)
+            if sha is None:
+                continue
+            row = self.index.by_sha[sha]
+            meta_rows.append({"u": url, "s": sha[:16], "w": row["w"], "h": row["h"], "p": row["p"]})
+            group = row["dup"]
+            if group not in seen_groups:
+                seen_groups.add(group)
+                unique.append(url)
+        if meta_rows:
+            features["image_meta"] = meta_rows
+            features["images_unique"] = unique
@@ -1,459 +1,834 @@
-# Вариант 7 (fix pagination)
-
-import re
-import time
-from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Set
-from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
-
-import scrapy
-from scrapy.http import HtmlResponse
-
-from selenium import webdriver
-from selenium.common.exceptions import TimeoutException, WebDriverException
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
-from webdriver_manager.chrome import ChromeDriverManager
-
-
-def _now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
-
-
-def _clean_text(s: Optional[str]) -> Optional[str]:
-    if not s:
-        return None
-    s = re.sub(r"\s+", " ", s).strip()
-    return s or None
-
-
-def _unique_keep_order(items: List[str]) -> List[str]:
-    seen = set()
-    out = []
-    for x in items:
-        if not x:
-            continue
-        if x in seen:
-            continue
-        seen.add(x)
-        out.append(x)
-    return out
-
-
-def _set_query_param(url: str, key: str, value: str) -> str:
-    """
-    Надёжно добавляет/заменяет query-параметр в URL.
-    Пример: .../investicii-spain?page=2
-    """
-    u = urlparse(url)
-    q = parse_qs(u.query)
-    q[key] = [value]
-    new_query = urlencode(q, doseq=True)
-    return urlunparse((u.scheme, u.netloc, u.path, u.params, new_query, u.fragment))
-
-
-class IntermarkSpainSpider(scrapy.Spider):
-    name = "intermark_spain"
-    allowed_domains = ["intermark.ru"]
-    start_urls = ["https://intermark.ru/nedvizhimost-za-rubezhom/investicii-spain"]
-
-    custom_settings = {
-        "LOG_LEVEL": "INFO",
-        "CONCURRENT_REQUESTS": 1,
-        "CONCURRENT_REQUESTS_PER_DOMAIN": 1,
-        "DOWNLOAD_DELAY": 1,
-        "RETRY_TIMES": 5,
-        "DOWNLOAD_TIMEOUT": 30,
-
-        # ВАЖНО: иначе detail (/objects/...) может НЕ скачиваться из-за robots.txt
-        "ROBOTSTXT_OBEY": False,
-
-        "AUTOTHROTTLE_ENABLED": True,
-        "AUTOTHROTTLE_START_DELAY": 1.0,
-        "AUTOTHROTTLE_MAX_DELAY": 10.0,
-    }
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-        # Эти поля заполняет pipeline в open_spider()
-        self.db_urls: Set[str] = set()  # все url из БД
-        self.db_need_detail_urls: Set[str] = set()  # url, где нужно дозаполнить detail (нет description/area_raw)
-
-        # внутреннее
-        self._driver: Optional[webdriver.Chrome] = None
-        self._listing_visited: Set[str] = set()
-
-    # -------------------------
-    # Selenium lifecycle
-    # -------------------------
-    def open_spider(self, spider):
-        """
-        Не обязателен (Scrapy не всегда зовёт open_spider у Spider),
-        но пусть будет: если вызовется — мы точно поднимем драйвер заранее.
-        """
-        self._init_driver()
-
-    def closed(self, reason):
-        """
-        Правильный хук Scrapy для завершения паука.
-        Не переопределяем close(), чтобы не ловить TypeError из signal handler.
-        """
-        self._quit_driver()
-
-    def _init_driver(self) -> None:
-        if self._driver is not None:
-            return
-
-        options = Options()
-        options.add_argument("--headless=new")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--window-size=1600,900")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--lang=ru-RU")
-
-        service = Service(ChromeDriverManager().install())
-        self._driver = webdriver.Chrome(service=service, options=options)
-        self.logger.info("[selenium] driver initialized")
-
-    def _quit_driver(self) -> None:
-        if self._driver is None:
-            return
-        try:
-            self._driver.quit()
-            self.logger.info("[selenium] driver quit ok")
-        except Exception as e:
-            self.logger.warning("[selenium] driver quit error: %s", e)
-        finally:
-            self._driver = None
-
-    def _get_selenium_listing_response(self, url: str, max_scrolls: int = 4) -> HtmlResponse:
-        """
-        Открываем listing через Selenium, ждём контент/карточки, скроллим, чтобы прогрузился AJAX,
-        возвращаем HtmlResponse (как будто это ответ Scrapy).
-
-        Важно: НЕ ПАДАЕМ на TimeoutException — возвращаем страницу как есть (cards может быть 0).
-        Это нужно, чтобы корректно остановить пагинацию (page=3 может быть пустой/другой шаблон).
-        """
-        self._init_driver()
-        assert self._driver is not None
-
-        self.logger.info("[selenium] GET %s", url)
-
-        try:
-            self._driver.get(url)
-        except WebDriverException as e:
-            self.logger.error("[selenium] get() failed url=%s err=%s", url, e)
-            # Возвращаем пустой ответ, чтобы паук не падал
-            return HtmlResponse(url=url, body=b"", encoding="utf-8")
-
-        wait = WebDriverWait(self._driver, 15)
-
-        # Ждём либо карточки, либо хотя бы body (страница отрисовалась).
-        # Если карточек нет — это может быть "последняя страница" или "пустая выдача".
-        try:
-            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "body")))
-        except TimeoutException:
-            self.logger.warning("[selenium] body timeout on %s", url)
-
-        try:
-            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "div.object-card")))
-        except TimeoutException:
-            # Не падаем — просто логируем. Ниже мы всё равно снимем page_source и вернём HtmlResponse.
-            self.logger.info("[selenium] no object-card found (timeout) on %s", url)
-
-        prev_cnt = -1
-        stable_hits = 0
-
-        for i in range(1, max_scrolls + 1):
-            try:
-                self._driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            except WebDriverException as e:
-                self.logger.warning("[selenium] scroll failed url=%s err=%s", url, e)
-                break
-
-            time.sleep(0.7)
-
-            try:
-                cards_cnt = len(self._driver.find_elements(By.CSS_SELECTOR, "div.object-card"))
-            except WebDriverException:
-                cards_cnt = 0
-
-            self.logger.info("[selenium] scroll=%s cards=%s", i, cards_cnt)
-
-            if cards_cnt == prev_cnt:
-                stable_hits += 1
-            else:
-                stable_hits = 0
-
-            prev_cnt = cards_cnt
-            if stable_hits >= 1:
-                break
-
-        html = self._driver.page_source or ""
-        return HtmlResponse(url=url, body=html.encode("utf-8"), encoding="utf-8")
-
-    # -------------------------
-    # 2-stage crawling
-    # -------------------------
-    def start_requests(self):
-        # Listing всегда берём Selenium-ом (динамика)
-        for url in self.start_urls:
-            if url in self._listing_visited:
-                continue
-            self._listing_visited.add(url)
-            response = self._get_selenium_listing_response(url)
-            yield from self.parse_listing(response)
-
-    def parse_listing(self, response: HtmlResponse):
-        """
-        Stage 1: listing
-        - собираем базовые поля
-        - сохраняем listing-features (images + params)
-        - решаем, идти ли на detail
-        """
-        if response.url == self.start_urls[0]:
-            # для дебага
-            with open("intermark_page.html", "wb") as f:
-                f.write(response.body)
-            self.logger.info("[listing] Saved HTML to intermark_page.html")
-
-        self.logger.info("[listing] url=%s len(html)=%s", response.url, len(response.text))
-
-        cards = response.css("div.object-card")
-        self.logger.info("[listing] Found %s cards", len(cards))
-
-        scraped_at = _now_iso()
-
-        for card in cards:
-            link = card.css("a.object-card-main-info__link::attr(href)").get()
-            if not link:
-                link = card.css('a[href*="/objects/"]::attr(href)').get()
-
-            url = response.urljoin(link) if link else None
-            if not url:
-                continue
-
-            id_text = _clean_text(card.css("div.object-card-main-info__id::text").get())
-            object_id = None
-            if id_text:
-                m = re.search(r"\d+", id_text)
-                object_id = m.group(0) if m else None
-
-            title = (
-                _clean_text(card.css("div.object-card-main-info__name-title div.name::text").get())
-                or _clean_text(card.css("div.name::text").get())
-            )
-
-            location = (
-                _clean_text(card.css("div.object-card-main-info__name-title div.address::text").get())
-                or _clean_text(card.css("div.address::text").get())
-            )
-
-            price_raw = (
-                _clean_text(card.css("div.object-card-main-info__price::text").get())
-                or _clean_text(card.css('[class*="price"]::text').get())
-            )
-
-            # listing area_raw (иногда встречается в параметрах карточки)
-            # params_text = " ".join(_clean_text(x) or "" for x in card.css("ul.object-card-param-list ::text").getall())
-            # m_area = re.search(r"(\d[\d\s]{0,10})\s*(?:м²|m²)", params_text, flags=re.IGNORECASE)
-            # area_raw = None
-            # if m_area:
-            #     area_raw = _clean_text(m_area.group(0))
-            # Площадь: ищем по ТЕКСТУ всей карточки (надежнее, чем только ul.object-card-param-list)
-            card_text = " ".join(card.css("::text").getall())
-            card_text = re.sub(r"\s+", " ", card_text)
-
-            m_area = re.search(r"(\d[\d\s]{0,10})\s*(?:м²|m²)", card_text, flags=re.IGNORECASE)
-            area_raw = _clean_text(m_area.group(0)) if m_area else None
-
-            # images (listing)
-            imgs = card.css("picture img::attr(src), picture img::attr(data-lazy)").getall()
-            imgs = _unique_keep_order([response.urljoin(x) for x in imgs if x])
-
-            # params (listing) - как текстовые строки
-            params_list = [
-                _clean_text(" ".join(li.css("::text").getall()))
-                for li in card.css("ul.object-card-param-list li")
-            ]
-            params_list = [x for x in params_list if x]
-
-            listing_item: Dict[str, Any] = {
-                "url": url,
-                "source_page": response.url,
-                "scraped_at": scraped_at,  # обязательное поле по ТЗ
-                "object_id": object_id,
-                "title": title,
-                "location": location,
-                "price_raw": price_raw,
-                "area_raw": area_raw,
-                "description": None,  # на listing может отсутствовать; деталь дозаполнит
-                "features": {
-                    "from": "listing",
-                    "images": imgs,
-                    "params_list": params_list,
-                },
-            }
-
-            # 1) Всегда отдаём listing-item: pipeline сам решит insert/update и смержит features.
-            yield listing_item
-
-            # 2) Решаем, идти ли на detail:
-            #    - если в БД нет строки
-            #    - или pipeline сказал "нужно дозаполнить detail" (нет description/area_raw)
-            need_detail = (url not in self.db_urls) or (url in self.db_need_detail_urls)
-
-            if need_detail:
-                yield response.follow(
-                    url,
-                    callback=self.parse_detail,
-                    meta={"listing_item": listing_item},
-                    dont_filter=True,
-                )
-
-        # -------------------------
-        # ПАГИНАЦИЯ: надёжно через ?page=N
-        # -------------------------
-        # Если карточек на текущей странице 0 — это уже сигнал остановки (например, page=3 пустая).
-        if len(cards) == 0:
-            self.logger.info("[pagination] stop: 0 cards on current page %s", response.url)
-            return
-
-        u = urlparse(response.url)
-        q = parse_qs(u.query)
-        cur_page = 1
-        if "page" in q and q["page"]:
-            try:
-                cur_page = int(q["page"][0])
-            except Exception:
-                cur_page = 1
-
-        next_url = _set_query_param(response.url, "page", str(cur_page + 1))
-
-        if next_url in self._listing_visited:
-            self.logger.info("[pagination] already visited: %s", next_url)
-            return
-
-        next_resp = self._get_selenium_listing_response(next_url)
-        next_cards = next_resp.css("div.object-card")
-        self.logger.info("[pagination] try next_url=%s cards=%s", next_url, len(next_cards))
-
-        if len(next_cards) > 0:
-            self._listing_visited.add(next_url)
-            yield from self.parse_listing(next_resp)
-        else:
-            self.logger.info("[pagination] stop: no cards on %s", next_url)
-
-    def parse_detail(self, response: HtmlResponse):
-        """
-        Stage 2: detail
-        - дозаполняем description, area_raw и доп. features
-        - если description не найден в Scrapy-ответе, делаем Selenium fallback
-        """
-        listing_item: Dict[str, Any] = response.meta.get("listing_item") or {}
-        scraped_at = _now_iso()
-
-        def extract_description(resp: HtmlResponse) -> Optional[str]:
-            # 1) meta description (часто есть, но иногда пусто/не то)
-            desc = resp.xpath('//meta[@name="description"]/@content').get()
-            desc = _clean_text(desc)
-            if desc:
-                return desc
-
-            # 2) пробуем “видимые” блоки описания (селекторы могут отличаться — пробуем набором)
-            candidates = []
-
-            # частые варианты: description/desc/text/content
-            candidates += resp.css('[class*="description"] ::text').getall()
-            candidates += resp.css('[class*="desc"] ::text').getall()
-            candidates += resp.css('[class*="text"] ::text').getall()
-            candidates += resp.css('article ::text').getall()
-            candidates += resp.css('main ::text').getall()
-
-            # склеиваем и чистим
-            txt = _clean_text(" ".join(candidates))
-            return txt
-
-        description = extract_description(response)
-
-        # --- Selenium fallback, если Scrapy не увидел описание (AJAX/динамика) ---
-        if not description:
-            try:
-                self._init_driver()
-                assert self._driver is not None
-                self.logger.info("[detail][selenium-fallback] GET %s", response.url)
-                self._driver.get(response.url)
-
-                wait = WebDriverWait(self._driver, 15)
-                # ждём что-нибудь “контентное”: заголовок/описание/любой крупный блок
-                wait.until(
-                    EC.presence_of_element_located(
-                        (By.CSS_SELECTOR, "body")
-                    )
-                )
-                time.sleep(1.2)  # небольшая пауза на догрузку текста
-
-                html = self._driver.page_source
-                resp2 = HtmlResponse(url=response.url, body=html.encode("utf-8"), encoding="utf-8")
-                description = extract_description(resp2)
-
-                self.logger.info(
-                    "[detail][selenium-fallback] description_len=%s",
-                    0 if not description else len(description)
-                )
-            except Exception as e:
-                self.logger.warning("[detail][selenium-fallback] failed: %s", e)
-
-        # area_raw: пытаемся найти в тексте страницы (Scrapy)
-        area_raw = None
-        page_text = " ".join(response.css("body ::text").getall())
-        page_text = re.sub(r"\s+", " ", page_text)
-        m_area = re.search(r"(\d[\d\s]{0,10})\s*(?:м²|m²)", page_text, flags=re.IGNORECASE)
-        if m_area:
-            area_raw = _clean_text(m_area.group(0))
-
-        # images: detail
-        imgs = response.css("picture img::attr(src), picture img::attr(data-lazy)").getall()
-        imgs = _unique_keep_order([response.urljoin(x) for x in imgs if x])
-
-        # params: detail (пары ключ-значение пытаемся вытащить из li)
-        params: Dict[str, str] = {}
-        for li in response.css("ul li"):
-            txt = _clean_text(" ".join(li.css("::text").getall()))
-            if not txt or ":" not in txt:
-                continue
-            k, v = txt.split(":", 1)
-            k = _clean_text(k)
-            v = _clean_text(v)
-            if k and v and k not in params:
-                params[k] = v
-
-        detail_item: Dict[str, Any] = {
-            "url": listing_item.get("url") or response.url,
-            "source_page": listing_item.get("source_page"),
-            "scraped_at": scraped_at,
-            "object_id": listing_item.get("object_id"),
-            "title": listing_item.get("title"),
-            "location": listing_item.get("location"),
-            "price_raw": listing_item.get("price_raw"),
-            "area_raw": area_raw or listing_item.get("area_raw"),
-            "description": description,  # <-- теперь реально пытаемся добыть
-            "features": {
-                "from": "detail",
-                "images": imgs,
-                "params": params,
-            },
-        }
-
-        self.logger.info(
-            "[detail] url=%s description_len=%s",
-            detail_item["url"],
-            0 if not description else len(description)
-        )
-
-        yield detail_item
+# Вариант 7 (fix pagination)
+
+import re
+import time
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
+
+import scrapy
+from scrapy.http import HtmlResponse
+from scrapy.utils.sitemap import Sitemap
+
+from intermark_scraper.browser import create_chrome
+from intermark_scraper.dedupe import EntityIndex
+from intermark_scraper.fetch_router import RENDER, FetchRouter
+from intermark_scraper.items import DetailItem, ListingItem
+
+# selenium импортируется лениво (browser.create_chrome / методы рендера):
+# scrapy list/check и HTTP-раны не платят за его загрузку.
+# freshness (тянет sqlalchemy + models) — тоже лениво, в _detail_request
+if TYPE_CHECKING:
+    from selenium import webdriver
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _clean_text(s: Optional[str]) -> Optional[str]:
+    if not s:
+        return None
+    s = re.sub(r"\s+", " ", s).strip()
+    return s or None
+
+
+def _unique_keep_order(items: List[str]) -> List[str]:
+    seen = set()
+    out = []
+    for x in items:
+        if not x:
+            continue
+        if x in seen:
+            continue
+        seen.add(x)
+        out.append(x)
+    return out
+
+
+def _set_query_param(url: str, key: str, value: str) -> str:
+    """
+    Надёжно добавляет/заменяет query-параметр в URL.
+    Пример: .../investicii-spain?page=2
+    """
+    u = urlparse(url)
+    q = parse_qs(u.query)
+    q[key] = [value]
+    new_query = urlencode(q, doseq=True)
+    return urlunparse((u.scheme, u.netloc, u.path, u.params, new_query, u.fragment))
+
+
+class IntermarkSpainSpider(scrapy.Spider):
+    name = "intermark_spain"
+    allowed_domains = ["intermark.ru"]
+    start_urls = ["https://intermark.ru/nedvizhimost-za-rubezhom/investicii-spain"]
+
+    custom_settings = {
+        "LOG_LEVEL": "INFO",
+        # HTTP; при RENDER_BACKEND = "tabs" TabRenderMiddleware добавляет к лимиту движка вкладки пула
+        "CONCURRENT_REQUESTS": 1,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 1,
+        "DOWNLOAD_DELAY": 1,
+        "RETRY_TIMES": 5,
+        "DOWNLOAD_TIMEOUT": 30,
+
+        # ВАЖНО: иначе detail (/objects/...) может НЕ скачиваться из-за robots.txt
+        "ROBOTSTXT_OBEY": False,
+
+        "AUTOTHROTTLE_ENABLED": True,
+        "AUTOTHROTTLE_START_DELAY": 1.0,
+        "AUTOTHROTTLE_MAX_DELAY": 10.0,
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Эти поля заполняет pipeline в open_spider()
+        self.db_urls: Set[str] = set()  # все url из БД
+        self.db_need_detail_urls: Set[str] = set()  # url, где нужно дозаполнить detail (нет description/area_raw)
+
+        # планировщик пересканирования (freshness.py); выставляет pipeline, None — старое поведение
+        self.freshness = None
+
+        # пул сессий прокси (sessions.py); выставляет SessionPoolMiddleware, None — без прокси
+        self.session_pool = None
+
+        # ItemCoalescerMiddleware (COALESCE_ENABLED); выставляет сам middleware, см. coalesce_errback()
+        self.item_coalescer = None
+
+        # индекс сущностей (object_id / канонический url / MinHash описания); создаётся в from_crawler
+        # при DEDUPE_SKIP_DETAIL, сидирует pipeline. None — дедупликация между url выключена
+        self.entity_index: Optional[EntityIndex] = None
+
+        # внутреннее
+        self._driver: Optional["webdriver.Chrome"] = None
+        self._first_render_done = False
+        self._listing_visited: Set[str] = set()
+        self._discovery_mode: Optional[str] = None  # "render" | "http", см. _discovery()
+        self._discovery_verified = False
+        self._sitemaps_pending = 0
+        self._sitemap_found = 0
+        self._fetch_router: Optional[FetchRouter] = None
+        self._fetch_router_ready = False
+
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        # AdaptiveConcurrency сам ведёт slot.delay; AutoThrottle правил бы ту же задержку в обратную сторону
+        if settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED", False):
+            settings.set("AUTOTHROTTLE_ENABLED", False, priority="spider")
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        if spider.settings.getbool("DEDUPE_SKIP_DETAIL", True):
+            spider.entity_index = EntityIndex()
+        return spider
+
+    def coalesce_errback(self, failure):
+        """
+        errback detail-запросов, на которые ItemCoalescerMiddleware придержал listing-item.
+        Метод паука (а не middleware), чтобы запрос сериализовался в JOBDIR.
+        """
+        if self.item_coalescer is not None:
+            yield from self.item_coalescer.on_detail_failure(failure, self)
+
+    # -------------------------
+    # Selenium lifecycle
+    # -------------------------
+    def open_spider(self, spider):
+        """
+        Не обязателен (Scrapy не всегда зовёт open_spider у Spider),
+        но пусть будет: если вызовется — мы точно поднимем драйвер заранее.
+        """
+        self._init_driver()
+
+    def closed(self, reason):
+        """
+        Правильный хук Scrapy для завершения паука.
+        Не переопределяем close(), чтобы не ловить TypeError из signal handler.
+        """
+        self._quit_driver()
+        if self._fetch_router is not None:
+            report = self._fetch_router.report()
+            self.crawler.stats.set_value(
+                "router/keys_render", sum(1 for mode in report.values() if mode == RENDER)
+            )
+            self.logger.info("[router] decisions: %s", report)
+            self._fetch_router.save()
+
+    def _init_driver(self) -> None:
+        if self._driver is not None:
+            return
+
+        # пул сессий (SessionPoolMiddleware): драйвер живёт весь ран — берём самую здоровую сессию
+        session = self.session_pool.pick_for_browser() if self.session_pool is not None else None
+        proxy = session.browser_proxy() if session is not None else None
+        if proxy and "username" in proxy:
+            self.logger.warning("[selenium] proxy %s needs auth, Chrome flag can't pass it; using direct", session.key)
+            proxy = None
+
+        self._driver, import_s, init_s = create_chrome(
+            self.settings.get("CHROMEDRIVER_CACHE", ".chromedriver.json"),
+            self.settings.get("CHROMEDRIVER_VERSION"),
+            proxy_server=proxy["server"] if proxy else None,
+            user_agent=session.user_agent if session is not None else None,
+        )
+        self.crawler.stats.set_value("startup/selenium_import_s", round(import_s, 3))
+        self.crawler.stats.set_value("startup/driver_init_s", round(init_s, 3))
+        self.logger.info("[selenium] driver initialized import=%.2fs init=%.2fs", import_s, init_s)
+
+    def _record_first_render(self, started: float) -> None:
+        if self._first_render_done:
+            return
+        self._first_render_done = True
+        elapsed = time.perf_counter() - started
+        self.crawler.stats.set_value("startup/first_render_s", round(elapsed, 3))
+        self.logger.info("[selenium] first render took %.2fs (incl. driver start)", elapsed)
+
+    def _quit_driver(self) -> None:
+        if self._driver is None:
+            return
+        try:
+            self._driver.quit()
+            self.logger.info("[selenium] driver quit ok")
+        except Exception as e:
+            self.logger.warning("[selenium] driver quit error: %s", e)
+        finally:
+            self._driver = None
+
+    def _get_selenium_listing_response(self, url: str, max_scrolls: int = 4) -> HtmlResponse:
+        """
+        Открываем listing через Selenium, ждём контент/карточки, скроллим, чтобы прогрузился AJAX,
+        возвращаем HtmlResponse (как будто это ответ Scrapy).
+
+        Важно: НЕ ПАДАЕМ на TimeoutException — возвращаем страницу как есть (cards может быть 0).
+        Это нужно, чтобы корректно остановить пагинацию (page=3 может быть пустой/другой шаблон).
+        """
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        started = time.perf_counter()
+        self._init_driver()
+        assert self._driver is not None
+
+        self.logger.info("[selenium] GET %s", url)
+
+        try:
+            self._driver.get(url)
+        except WebDriverException as e:
+            self.logger.error("[selenium] get() failed url=%s err=%s", url, e)
+            # Возвращаем пустой ответ, чтобы паук не падал
+            return HtmlResponse(url=url, body=b"", encoding="utf-8")
+
+        wait = WebDriverWait(self._driver, 15)
+
+        # Ждём либо карточки, либо хотя бы body (страница отрисовалась).
+        # Если карточек нет — это может быть "последняя страница" или "пустая выдача".
+        try:
+            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "body")))
+        except TimeoutException:
+            self.logger.warning("[selenium] body timeout on %s", url)
+
+        try:
+            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "div.object-card")))
+        except TimeoutException:
+            # Не падаем — просто логируем. Ниже мы всё равно снимем page_source и вернём HtmlResponse.
+            self.logger.info("[selenium] no object-card found (timeout) on %s", url)
+
+        prev_cnt = -1
+        stable_hits = 0
+
+        for i in range(1, max_scrolls + 1):
+            try:
+                self._driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            except WebDriverException as e:
+                self.logger.warning("[selenium] scroll failed url=%s err=%s", url, e)
+                break
+
+            time.sleep(0.7)
+
+            try:
+                cards_cnt = len(self._driver.find_elements(By.CSS_SELECTOR, "div.object-card"))
+            except WebDriverException:
+                cards_cnt = 0
+
+            self.logger.info("[selenium] scroll=%s cards=%s", i, cards_cnt)
+
+            if cards_cnt == prev_cnt:
+                stable_hits += 1
+            else:
+                stable_hits = 0
+
+            prev_cnt = cards_cnt
+            if stable_hits >= 1:
+                break
+
+        html = self._driver.page_source or ""
+        self._record_first_render(started)
+        self.logger.info(
+            "[selenium] rendered %s cards=%s", url, prev_cnt,
+            extra={"stage": "render_listing", "duration_ms": round((time.perf_counter() - started) * 1000, 2), "url": url},
+        )
+        return HtmlResponse(url=url, body=html.encode("utf-8"), encoding="utf-8")
+
+    # -------------------------
+    # 2-stage crawling
+    # -------------------------
+    def _tabs_backend(self) -> bool:
+        """RENDER_BACKEND = "tabs": рендер через TabRenderMiddleware (вкладки одного Chromium)."""
+        return self.settings.get("RENDER_BACKEND", "selenium") == "tabs"
+
+    def _discovery(self) -> str:
+        """
+        DISCOVERY_MODE: "render" — listing рендерится браузером (как раньше);
+        "http" — listing/пагинация обычным Scrapy HTTP, с fallback на sitemap.xml и рендер.
+        Может переключиться в "render" по ходу рана, если HTTP-выдача разошлась с рендером.
+        """
+        if self._discovery_mode is None:
+            self._discovery_mode = self.settings.get("DISCOVERY_MODE", "render")
+        return self._discovery_mode
+
+    def _router(self) -> Optional[FetchRouter]:
+        """Роутер static/render для detail (fetch_router.py); None — ROUTER_ENABLED выключен."""
+        if not self._fetch_router_ready:
+            self._fetch_router_ready = True
+            if self.settings.getbool("ROUTER_ENABLED", True):
+                self._fetch_router = FetchRouter.from_settings(self.settings)
+                self._fetch_router.stats = self.crawler.stats
+        return self._fetch_router
+
+    def start_requests(self):
+        if self._discovery() == "http":
+            for url in self.start_urls:
+                if url in self._listing_visited:
+                    continue
+                self._listing_visited.add(url)
+                yield scrapy.Request(url, callback=self.parse_listing_http, dont_filter=True)
+            return
+
+        if self._tabs_backend():
+            for url in self.start_urls:
+                if url in self._listing_visited:
+                    continue
+                self._listing_visited.add(url)
+                yield scrapy.Request(url, callback=self.parse_listing, meta={"render": "listing"}, dont_filter=True)
+            return
+
+        # Listing всегда берём Selenium-ом (динамика)
+        for url in self.start_urls:
+            if url in self._listing_visited:
+                continue
+            self._listing_visited.add(url)
+            response = self._get_selenium_listing_response(url)
+            yield from self.parse_listing(response)
+
+    def parse_listing(self, response: HtmlResponse):
+        """
+        Stage 1: listing
+        - собираем базовые поля
+        - сохраняем listing-features (images + params)
+        - решаем, идти ли на detail
+        """
+        if response.url == self.start_urls[0]:
+            # для дебага
+            with open("intermark_page.html", "wb") as f:
+                f.write(response.body)
+            self.logger.info("[listing] Saved HTML to intermark_page.html")
+
+        self.logger.info("[listing] url=%s len(html)=%s", response.url, len(response.text))
+
+        cards = response.css("div.object-card")
+        self.logger.info("[listing] Found %s cards", len(cards))
+
+        scraped_at = _now()
+
+        for card in cards:
+            link = card.css("a.object-card-main-info__link::attr(href)").get()
+            if not link:
+                link = card.css('a[href*="/objects/"]::attr(href)').get()
+
+            url = response.urljoin(link) if link else None
+            if not url:
+                continue
+
+            id_text = _clean_text(card.css("div.object-card-main-info__id::text").get())
+            object_id = None
+            if id_text:
+                m = re.search(r"\d+", id_text)
+                object_id = m.group(0) if m else None
+
+            title = (
+                _clean_text(card.css("div.object-card-main-info__name-title div.name::text").get())
+                or _clean_text(card.css("div.name::text").get())
+            )
+
+            location = (
+                _clean_text(card.css("div.object-card-main-info__name-title div.address::text").get())
+                or _clean_text(card.css("div.address::text").get())
+            )
+
+            price_raw = (
+                _clean_text(card.css("div.object-card-main-info__price::text").get())
+                or _clean_text(card.css('[class*="price"]::text').get())
+            )
+
+            # listing area_raw (иногда встречается в параметрах карточки)
+            # params_text = " ".join(_clean_text(x) or "" for x in card.css("ul.object-card-param-list ::text").getall())
+            # m_area = re.search(r"(\d[\d\s]{0,10})\s*(?:м²|m²)", params_text, flags=re.IGNORECASE)
+            # area_raw = None
+            # if m_area:
+            #     area_raw = _clean_text(m_area.group(0))
+            # Площадь: ищем по ТЕКСТУ всей карточки (надежнее, чем только ul.object-card-param-list)
+            card_text = " ".join(card.css("::text").getall())
+            card_text = re.sub(r"\s+", " ", card_text)
+
+            m_area = re.search(r"(\d[\d\s]{0,10})\s*(?:м²|m²)", card_text, flags=re.IGNORECASE)
+            area_raw = _clean_text(m_area.group(0)) if m_area else None
+
+            # images (listing)
+            imgs = card.css("picture img::attr(src), picture img::attr(data-lazy)").getall()
+            imgs = _unique_keep_order([response.urljoin(x) for x in imgs if x])
+
+            # params (listing) - как текстовые строки
+            params_list = [
+                _clean_text(" ".join(li.css("::text").getall()))
+                for li in card.css("ul.object-card-param-list li")
+            ]
+            params_list = [x for x in params_list if x]
+
+            listing_item = ListingItem(
+                url=url,
+                source_page=response.url,
+                scraped_at=scraped_at,  # обязательное поле по ТЗ
+                object_id=object_id,
+                title=title,
+                location=location,
+                price_raw=price_raw,
+                area_raw=area_raw,
+                description=None,  # на listing может отсутствовать; деталь дозаполнит
+                features={
+                    "from": "listing",
+                    "images": imgs,
+                    "params_list": params_list,
+                },
+            )
+
+            # 1) Всегда отдаём listing-item: pipeline сам решит insert/update и смержит features.
+            yield listing_item
+
+            # 2) Решаем, идти ли на detail (см. _detail_request)
+            detail_request = self._detail_request(response, listing_item)
+            if detail_request is not None:
+                yield detail_request
+
+        # -------------------------
+        # ПАГИНАЦИЯ: надёжно через ?page=N
+        # -------------------------
+        # Если карточек на текущей странице 0 — это уже сигнал остановки (например, page=3 пустая).
+        if len(cards) == 0:
+            self.logger.info("[pagination] stop: 0 cards on current page %s", response.url)
+            return
+
+        u = urlparse(response.url)
+        q = parse_qs(u.query)
+        cur_page = 1
+        if "page" in q and q["page"]:
+            try:
+                cur_page = int(q["page"][0])
+            except Exception:
+                cur_page = 1
+
+        next_url = _set_query_param(response.url, "page", str(cur_page + 1))
+
+        if next_url in self._listing_visited:
+            self.logger.info("[pagination] already visited: %s", next_url)
+            return
+
+        if self._discovery() == "http":
+            self._listing_visited.add(next_url)
+            yield scrapy.Request(next_url, callback=self.parse_listing, dont_filter=True)
+            return
+
+        if self._tabs_backend():
+            # пустая следующая страница остановит пагинацию в её же parse_listing (0 cards)
+            self._listing_visited.add(next_url)
+            yield scrapy.Request(next_url, callback=self.parse_listing, meta={"render": "listing"}, dont_filter=True)
+            return
+
+        next_resp = self._get_selenium_listing_response(next_url)
+        next_cards = next_resp.css("div.object-card")
+        self.logger.info("[pagination] try next_url=%s cards=%s", next_url, len(next_cards))
+
+        if len(next_cards) > 0:
+            self._listing_visited.add(next_url)
+            yield from self.parse_listing(next_resp)
+        else:
+            self.logger.info("[pagination] stop: no cards on %s", next_url)
+
+    # -------------------------
+    # Discovery без браузера (DISCOVERY_MODE = "http")
+    # -------------------------
+    @staticmethod
+    def _card_urls(response) -> Set[str]:
+        urls = set()
+        for card in response.css("div.object-card"):
+            link = (
+                card.css("a.object-card-main-info__link::attr(href)").get()
+                or card.css('a[href*="/objects/"]::attr(href)').get()
+            )
+            if link:
+                urls.add(response.urljoin(link))
+        return urls
+
+    def _discovery_ok(self, http_urls: Set[str], rendered) -> bool:
+        """
+        Сверка HTTP-выдачи с рендером на одной странице.
+        Доля url из рендера, найденных и по HTTP, должна быть >= DISCOVERY_MIN_OVERLAP.
+        """
+        rendered_urls = self._card_urls(rendered)
+        if not rendered_urls:
+            # рендер ничего не нашёл — сравнивать не с чем, доверяем HTTP
+            return True
+        overlap = len(http_urls & rendered_urls) / len(rendered_urls)
+        self.crawler.stats.set_value("discovery/overlap", round(overlap, 3))
+        ok = overlap >= self.settings.getfloat("DISCOVERY_MIN_OVERLAP", 0.9)
+        self.logger.info(
+            "[discovery] check %s http=%s rendered=%s overlap=%.2f -> %s",
+            rendered.url, len(http_urls), len(rendered_urls), overlap, "ok" if ok else "drift",
+        )
+        if not ok:
+            self.crawler.stats.inc_value("discovery/drift")
+            self._discovery_mode = "render"
+        return ok
+
+    def _fallback_to_render(self, url: str):
+        self.logger.warning("[discovery] fallback to browser rendering from %s", url)
+        self.crawler.stats.inc_value("discovery/fallback_render")
+        self._discovery_mode = "render"
+        if self._tabs_backend():
+            yield scrapy.Request(url, callback=self.parse_listing, meta={"render": "listing"}, dont_filter=True)
+        else:
+            yield from self.parse_listing(self._get_selenium_listing_response(url))
+
+    def parse_listing_http(self, response: HtmlResponse):
+        """
+        Первая страница listing по HTTP:
+        - карточки есть -> сверяем с рендером (один раз за ран) и идём обычным parse_listing
+        - карточек нет (нет серверного рендера) -> sitemap.xml
+        """
+        http_urls = self._card_urls(response)
+        self.crawler.stats.inc_value("discovery/http_pages")
+
+        if not http_urls:
+            self.logger.info("[discovery] no cards in plain HTML %s, trying sitemap", response.url)
+            yield self._sitemap_request(
+                response.urljoin(self.settings.get("DISCOVERY_SITEMAP_URL", "/sitemap.xml")), response.url
+            )
+            return
+
+        if self.settings.getbool("DISCOVERY_VERIFY", True) and not self._discovery_verified:
+            self._discovery_verified = True
+            if self._tabs_backend():
+                yield scrapy.Request(
+                    response.url,
+                    callback=self._verify_discovery_rendered,
+                    cb_kwargs={"http_urls": http_urls},
+                    meta={"render": "listing"},
+                    dont_filter=True,
+                )
+                return
+            rendered = self._get_selenium_listing_response(response.url)
+            if not self._discovery_ok(http_urls, rendered):
+                yield from self.parse_listing(rendered)
+                return
+
+        yield from self.parse_listing(response)
+
+    def _verify_discovery_rendered(self, response: HtmlResponse, http_urls: Set[str]):
+        if self._discovery_ok(http_urls, response):
+            # сверка прошла — сам listing дальше идёт по HTTP
+            yield scrapy.Request(response.url, callback=self.parse_listing, dont_filter=True)
+        else:
+            yield from self.parse_listing(response)
+
+    def _sitemap_request(self, url: str, listing_url: str) -> scrapy.Request:
+        self._sitemaps_pending += 1
+        return scrapy.Request(
+            url,
+            callback=self.parse_sitemap,
+            errback=self._sitemap_failed,
+            cb_kwargs={"listing_url": listing_url},
+            dont_filter=True,
+        )
+
+    def _sitemap_done(self, listing_url: str):
+        """Когда разобраны все sitemap-файлы и объектов не нашлось — рендерим listing браузером."""
+        self._sitemaps_pending -= 1
+        if self._sitemaps_pending == 0 and self._sitemap_found == 0:
+            yield from self._fallback_to_render(listing_url)
+
+    def _sitemap_failed(self, failure):
+        self.logger.warning("[discovery] sitemap failed %s: %s", failure.request.url, failure.getErrorMessage())
+        yield from self._sitemap_done(failure.request.cb_kwargs["listing_url"])
+
+    def parse_sitemap(self, response, listing_url: str):
+        """
+        sitemap.xml / sitemap index: собираем /objects/ url раздела. Карточных полей тут нет —
+        их добирает parse_detail со страницы объекта (_card_fields_from_detail).
+        """
+        try:
+            sitemap = Sitemap(response.body)
+        except Exception as e:
+            self.logger.warning("[discovery] bad sitemap %s: %s", response.url, e)
+            yield from self._sitemap_done(listing_url)
+            return
+
+        if sitemap.type == "sitemapindex":
+            for entry in sitemap:
+                yield self._sitemap_request(entry["loc"], listing_url)
+            yield from self._sitemap_done(listing_url)
+            return
+
+        pattern = re.compile(self.settings.get("DISCOVERY_SITEMAP_PATTERN", r"/objects/ispaniya-"))
+        found = 0
+        for entry in sitemap:
+            url = entry.get("loc")
+            if not url or not pattern.search(url):
+                continue
+            found += 1
+            listing_item = ListingItem(url=url, source_page=response.url, scraped_at=_now())
+            detail_request = self._detail_request(response, listing_item)
+            if detail_request is not None:
+                yield detail_request
+
+        self._sitemap_found += found
+        self.crawler.stats.inc_value("discovery/sitemap_urls", found)
+        self.logger.info("[discovery] sitemap %s: %s object urls", response.url, found)
+        yield from self._sitemap_done(listing_url)
+
+    def _detail_request(self, response, listing_item: ListingItem) -> Optional[scrapy.Request]:
+        """
+        Решаем, идти ли на detail:
+        - если в БД нет строки
+        - или pipeline сказал "нужно дозаполнить detail" (нет description/area_raw)
+        - или объект известен, но по оценке свежести пора его пересканировать (в пределах бюджета)
+        - но не идём, если тот же объект уже известен под другим url и у него есть описание
+        """
+        from intermark_scraper.freshness import PRIORITY_NEW
+
+        url = listing_item.url
+        object_id = listing_item.object_id
+
+        need_detail = (url not in self.db_urls) or (url in self.db_need_detail_urls)
+        priority = PRIORITY_NEW if need_detail else 0
+
+        if not need_detail and self.freshness is not None:
+            revisit = self.freshness.revisit_priority(url)
+            if revisit is not None:
+                need_detail = True
+                priority = revisit
+                self.crawler.stats.inc_value("freshness/revisits")
+
+        if need_detail and self.entity_index is not None:
+            entity = self.entity_index.resolve(url, object_id)
+            if entity is not None and entity != url and entity not in self.db_need_detail_urls:
+                self.logger.info("[dedupe] skip detail url=%s duplicate_of=%s", url, entity)
+                self.crawler.stats.inc_value("dedupe/detail_skipped")
+                need_detail = False
+
+        if not need_detail:
+            return None
+
+        # раздел, где описание в статическом HTML не находится, — сразу в рендер, без HTTP-запроса
+        router = self._router()
+        fetch_mode = router.route(url) if router is not None else None
+        meta = {"listing_item": listing_item, "fetch_mode": fetch_mode}
+        if fetch_mode == RENDER:
+            meta["render"] = "detail"
+            if not self._tabs_backend():
+                # Selenium-ветка рендерит сама в parse_detail; data: не ходит в сеть
+                return scrapy.Request(
+                    "data:,", callback=self.parse_detail, meta=meta, priority=priority, dont_filter=True
+                )
+
+        return response.follow(
+            url,
+            callback=self.parse_detail,
+            meta=meta,
+            priority=priority,
+            dont_filter=True,
+        )
+
+    @staticmethod
+    def _card_fields_from_detail(page: HtmlResponse, page_text: str) -> Dict[str, Optional[str]]:
+        """
+        title/location/price_raw/object_id со страницы объекта — для url из sitemap, у которых
+        не было карточки listing. Пустое поле оставляет url в db_need_detail_urls (см. storage._needs_detail).
+        """
+        m_id = re.search(r"\bID\s*:?\s*(\d+)", page_text)
+        return {
+            "title": (
+                _clean_text(" ".join(page.css("h1 ::text").getall()))
+                or _clean_text(page.xpath('//meta[@property="og:title"]/@content').get())
+            ),
+            "location": _clean_text(page.css('[class*="address"]::text').get()),
+            "price_raw": _clean_text(page.css('[class*="price"]::text').get()),
+            "object_id": m_id.group(1) if m_id else None,
+        }
+
+    def parse_detail(self, response: HtmlResponse):
+        """
+        Stage 2: detail
+        - дозаполняем description, area_raw и доп. features
+        - если description не найден в Scrapy-ответе, делаем Selenium fallback
+        - fetch_mode == "render" (см. fetch_router.py): статический ответ не качался, сразу рендер
+        """
+        listing_item: Optional[ListingItem] = response.meta.get("listing_item")
+        if listing_item is None:
+            listing_item = ListingItem(url=response.url, scraped_at=_now())
+        detail_url = listing_item.url
+        scraped_at = _now()
+        routed_to_render = response.meta.get("fetch_mode") == RENDER and not self._tabs_backend()
+        page = response
+
+        def extract_description(resp: HtmlResponse) -> Optional[str]:
+            # 1) meta description (часто есть, но иногда пусто/не то)
+            desc = resp.xpath('//meta[@name="description"]/@content').get()
+            desc = _clean_text(desc)
+            if desc:
+                return desc
+
+            # 2) пробуем “видимые” блоки описания (селекторы могут отличаться — пробуем набором)
+            candidates = []
+
+            # частые варианты: description/desc/text/content
+            candidates += resp.css('[class*="description"] ::text').getall()
+            candidates += resp.css('[class*="desc"] ::text').getall()
+            candidates += resp.css('[class*="text"] ::text').getall()
+            candidates += resp.css('article ::text').getall()
+            candidates += resp.css('main ::text').getall()
+
+            # склеиваем и чистим
+            txt = _clean_text(" ".join(candidates))
+            return txt
+
+        description = None if routed_to_render else extract_description(response)
+
+        # учим роутер только на статических ответах (обычных и probe)
+        router = self._router()
+        if router is not None and not response.meta.get("render"):
+            router.record(detail_url, ok=bool(description))
+
+        # --- Рендер во вкладке (RENDER_BACKEND = "tabs"): переотправляем запрос с meta["render"] ---
+        if not description and self._tabs_backend() and not response.meta.get("render"):
+            self.logger.info("[detail][tabs-fallback] %s", response.url)
+            yield response.request.replace(
+                meta={**response.meta, "render": "detail"},
+                dont_filter=True,
+            )
+            return
+
+        # --- Selenium fallback, если Scrapy не увидел описание (AJAX/динамика) ---
+        if not description and not self._tabs_backend():
+            try:
+                from selenium.webdriver.common.by import By
+                from selenium.webdriver.support import expected_conditions as EC
+                from selenium.webdriver.support.ui import WebDriverWait
+
+                started = time.perf_counter()
+                self._init_driver()
+                assert self._driver is not None
+                self.logger.info("[detail][selenium-fallback] GET %s", detail_url)
+                self._driver.get(detail_url)
+
+                wait = WebDriverWait(self._driver, 15)
+                # ждём что-нибудь “контентное”: заголовок/описание/любой крупный блок
+                wait.until(
+                    EC.presence_of_element_located(
+                        (By.CSS_SELECTOR, "body")
+                    )
+                )
+                time.sleep(1.2)  # небольшая пауза на догрузку текста
+
+                html = self._driver.page_source
+                self._record_first_render(started)
+                resp2 = HtmlResponse(url=detail_url, body=html.encode("utf-8"), encoding="utf-8")
+                description = extract_description(resp2)
+                if routed_to_render:
+                    page = resp2
+
+                self.logger.info(
+                    "[detail][selenium-fallback] description_len=%s",
+                    0 if not description else len(description),
+                    extra={
+                        "stage": "render_detail",
+                        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                        "url": detail_url,
+                    },
+                )
+            except Exception as e:
+                self.logger.warning("[detail][selenium-fallback] failed: %s", e)
+
+        # area_raw: пытаемся найти в тексте страницы (Scrapy)
+        area_raw = None
+        page_text = " ".join(page.css("body ::text").getall())
+        page_text = re.sub(r"\s+", " ", page_text)
+        m_area = re.search(r"(\d[\d\s]{0,10})\s*(?:м²|m²)", page_text, flags=re.IGNORECASE)
+        if m_area:
+            area_raw = _clean_text(m_area.group(0))
+
+        # карточные поля: у объектов из sitemap listing-а не было — добираем со страницы объекта
+        card = self._card_fields_from_detail(page, page_text) if not listing_item.title else {}
+
+        # images: detail
+        imgs = page.css("picture img::attr(src), picture img::attr(data-lazy)").getall()
+        imgs = _unique_keep_order([page.urljoin(x) for x in imgs if x])
+
+        # params: detail (пары ключ-значение пытаемся вытащить из li)
+        params: Dict[str, str] = {}
+        for li in page.css("ul li"):
+            txt = _clean_text(" ".join(li.css("::text").getall()))
+            if not txt or ":" not in txt:
+                continue
+            k, v = txt.split(":", 1)
+            k = _clean_text(k)
+            v = _clean_text(v)
+            if k and v and k not in params:
+                params[k] = v
+
+        # near-duplicate: тот же объект под другим url (совпал object_id, канон. url или MinHash описания)
+        entity = (
+            self.entity_index.add(detail_url, listing_item.object_id or card.get("object_id"), description)
+            if self.entity_index is not None else detail_url
+        )
+
+        detail_item = DetailItem(
+            url=detail_url,
+            source_page=listing_item.source_page,
+            scraped_at=scraped_at,
+            object_id=listing_item.object_id or card.get("object_id"),
+            title=listing_item.title or card.get("title"),
+            location=listing_item.location or card.get("location"),
+            price_raw=listing_item.price_raw or card.get("price_raw"),
+            area_raw=area_raw or listing_item.area_raw,
+            description=description,  # <-- теперь реально пытаемся добыть
+            features={
+                "from": "detail",
+                "images": imgs,
+                "params": params,
+            },
+        )
+        if entity != detail_url:
+            detail_item.features["duplicate_of"] = entity
+            self.crawler.stats.inc_value("dedupe/near_duplicates")
+
+        self.logger.info(
+            "[detail] url=%s description_len=%s",
+            detail_item.url,
+            0 if not description else len(description)
+        )
+
+        yield detail_item
@@ -1,12 +1,135 @@
-# Define here the models for your scraped items
-#
-# See documentation in:
-# https://docs.scrapy.org/en/latest/topics/items.html
-
-import scrapy
-
-
-class IntermarkScraperItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+# Define here the models for your scraped items
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/items.html
+
+"""
+Типизированные item-ы объявлений (listing / detail).
+
+Раньше паук отдавал dict-ы со scraped_at в виде ISO-строки, pipeline разбирал их через
+ItemAdapter + _parse_iso_dt на каждом item-е. Теперь:
+- dataclass со __slots__: нет __dict__ на экземпляр — придержанные (ItemCoalescerMiddleware)
+  и буферизованные item-ы занимают заметно меньше памяти
+- scraped_at — сразу datetime (UTC), поля проверяются при создании
+- as_dict() — быстрый путь для pipeline, as_row() + write_copy_rows() — строки COPY (text format);
+  PostgresStorage вставляет новые url пачки одним COPY через write_copy_rows()
+
+ItemAdapter понимает dataclass-ы, так что feed exports / ImageMetadataPipeline работают как с dict-ами;
+get()/[] оставлены для кода, который обращается к item-у как к словарю.
+Замеры против dict-ов: python -m intermark_scraper.bench_items
+"""
+
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, ClassVar, Dict, Iterable, Optional, Sequence, TextIO, Tuple
+
+# порядок колонок для as_row()/COPY — как в intermark.properties_raw
+ROW_FIELDS = (
+    "url",
+    "scraped_at",
+    "source_page",
+    "title",
+    "location",
+    "price_raw",
+    "area_raw",
+    "object_id",
+    "description",
+    "features",
+)
+
+_TEXT_FIELDS = ("source_page", "title", "location", "price_raw", "area_raw", "object_id", "description")
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+@dataclass(slots=True)
+class PropertyItem:
+    url: str
+    scraped_at: datetime
+    source_page: Optional[str] = None
+    title: Optional[str] = None
+    location: Optional[str] = None
+    price_raw: Optional[str] = None
+    area_raw: Optional[str] = None
+    object_id: Optional[str] = None
+    description: Optional[str] = None
+    features: Dict[str, Any] = field(default_factory=dict)
+
+    STAGE: ClassVar[Optional[str]] = None
+
+    def __post_init__(self):
+        if not isinstance(self.url, str) or not self.url.startswith(("http://", "https://")):
+            raise ValueError(f"{type(self).__name__}: bad url {self.url!r}")
+        if not isinstance(self.scraped_at, datetime) or self.scraped_at.tzinfo is None:
+            raise TypeError(f"{type(self).__name__}: scraped_at must be an aware datetime, got {self.scraped_at!r}")
+        for name in _TEXT_FIELDS:
+            value = getattr(self, name)
+            if value is not None and not isinstance(value, str):
+                raise TypeError(f"{type(self).__name__}: {name} must be str or None, got {type(value).__name__}")
+        if not isinstance(self.features, dict):
+            raise TypeError(f"{type(self).__name__}: features must be a dict")
+        if self.STAGE is not None:
+            self.features.setdefault("from", self.STAGE)
+
+    @property
+    def stage(self) -> Optional[str]:
+        return self.features.get("from")
+
+    # совместимость с кодом, который работает с item-ом как с dict
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in ROW_FIELDS else default
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in ROW_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def items(self):
+        return ((name, getattr(self, name)) for name in ROW_FIELDS)
+
+    def as_row(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, name) for name in ROW_FIELDS)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in ROW_FIELDS}
+
+    def merged_with(self, other: "PropertyItem", features: Dict[str, Any]) -> "PropertyItem":
+        """Непустые поля other поверх self; features — уже смерженные (pipelines._merge_features)."""
+        merged = self.as_dict()
+        merged.update((k, v) for k, v in other.items() if k != "features" and v is not None)
+        merged["features"] = features
+        return type(other)(**merged)
+
+
+@dataclass(slots=True)
+class ListingItem(PropertyItem):
+    STAGE: ClassVar[Optional[str]] = "listing"
+
+
+@dataclass(slots=True)
+class DetailItem(PropertyItem):
+    STAGE: ClassVar[Optional[str]] = "detail"
+
+
+def _copy_value(value: Any) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        value = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def write_copy_rows(rows: Iterable[Sequence[Any]], out: TextIO) -> int:
+    """
+    Пишет строки (item.as_row() или кортежи в порядке колонок COPY) в out в текстовом формате COPY,
+    например для cursor.copy_expert("COPY intermark.properties_raw (...) FROM STDIN", buf).
+    Возвращает число строк.
+    """
+    n = 0
+    for row in rows:
+        out.write("\t".join(_copy_value(v) for v in row))
+        out.write("\n")
+        n += 1
+    return n
@@ -0,0 +1,62 @@
+"""
+Нагрузочный тест read-only API (api.py).
+
+    python -m intermark_scraper.loadtest_api --url http://127.0.0.1:8080 --workers 16 --requests 2000
+
+Случайные фильтры из небольшого набора (чтобы часть запросов повторялась и попадала в кеш);
+печатает RPS, p50/p95/p99 и долю X-Cache: HIT.
+"""
+
+import argparse
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+LOCATIONS = ["Spain", "Spain, Costa Blanca", "Spain, Costa del Sol", "Spain, Barcelona"]
+PRICES = [(None, 300000), (100000, 500000), (500000, None), (None, None)]
+AREAS = [(None, None), (50, 120), (120, None)]
+
+
+def _random_query() -> str:
+    params = {"limit": 50, "location": random.choice(LOCATIONS)}
+    price_min, price_max = random.choice(PRICES)
+    area_min, area_max = random.choice(AREAS)
+    for key, value in (("price_min", price_min), ("price_max", price_max), ("area_min", area_min), ("area_max", area_max)):
+        if value is not None:
+            params[key] = value
+    return urlencode(params)
+
+
+def _one(base_url: str):
+    start = time.perf_counter()
+    with urlopen(f"{base_url}/properties?{_random_query()}", timeout=30) as resp:
+        resp.read()
+        cache = resp.headers.get("X-Cache", "")
+    return (time.perf_counter() - start) * 1000, cache == "HIT"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(lambda _: _one(args.url), range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(r[0] for r in results)
+    hits = sum(1 for r in results if r[1])
+    q = statistics.quantiles(latencies, n=100)
+    print(f"requests={len(results)} workers={args.workers} rps={len(results) / elapsed:.1f}")
+    print(f"p50={q[49]:.1f}ms p95={q[94]:.1f}ms p99={q[98]:.1f}ms max={latencies[-1]:.1f}ms")
+    print(f"cache hits={hits} ({hits / len(results):.0%})")
+
+
+if __name__ == "__main__":
+    main()
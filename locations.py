@@ -0,0 +1,195 @@
+"""
+Нормализация location по локальному справочнику (gazetteer.json).
+
+location — это сырой текст из div.address ("Испания, Коста Бланка, Аликанте", "Торревьеха", ...),
+по нему нельзя агрегировать по регионам без LIKE. Здесь строка превращается в ключ
+(country_id, region_id, city_id) из intermark.geo_places:
+- строка режется по запятым/слешам, каждая часть ищется среди алиасов (ru/en/es, без учёта регистра,
+  ё/диакритики и дефисов); если ни одна часть не совпала — ищем алиас как подстроку
+- берём самое конкретное совпадение (город > регион > страна), родителей добиваем по справочнику
+- lookup мемоизирован (LRU): различных location на порядки меньше, чем объявлений
+
+В пайплайне — LOCATION_GAZETTEER / LOCATION_CACHE_SIZE; в Spark ETL — spark_normalize_locations()
+(distinct location считаются на драйвере и подключаются broadcast join-ом).
+"""
+
+import json
+import re
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import text
+
+DEFAULT_GAZETTEER = Path(__file__).with_name("gazetteer.json")
+
+LEVELS = ("country", "region", "city")
+_SPLIT_RE = re.compile(r"[,/;|]+")
+_NON_WORD_RE = re.compile(r"[^\w]+")
+
+
+class LocationKey(NamedTuple):
+    country_id: Optional[int]
+    region_id: Optional[int]
+    city_id: Optional[int]
+
+
+EMPTY_KEY = LocationKey(None, None, None)
+
+
+def normalize_alias(value: str) -> str:
+    """'Коста-Бланка' -> 'коста бланка', 'Málaga' -> 'malaga'."""
+    value = unicodedata.normalize("NFKD", value.lower().replace("ё", "е"))
+    # снимаем диакритику, но не трогаем й (NFKD раскладывает её на и + бреве)
+    value = "".join(c for c in value if not unicodedata.combining(c) or c == "̆")
+    value = unicodedata.normalize("NFC", value)
+    return _NON_WORD_RE.sub(" ", value).strip()
+
+
+class Gazetteer:
+    def __init__(self, places: List[Dict], cache_size: int = 4096):
+        self.places: Dict[int, Dict] = {p["id"]: p for p in places}
+        self.aliases: Dict[str, int] = {}
+        for p in places:
+            for alias in [p["name"], *p.get("aliases", [])]:
+                self.aliases.setdefault(normalize_alias(alias), p["id"])
+
+        # длинные алиасы первыми: "коста дель соль" раньше, чем "соль"
+        ordered = sorted(self.aliases, key=len, reverse=True)
+        self._substring_re = re.compile(r"\b(" + "|".join(re.escape(a) for a in ordered) + r")\b")
+
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None, cache_size: int = 4096) -> "Gazetteer":
+        with open(path or DEFAULT_GAZETTEER, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["places"], cache_size=cache_size)
+
+    @classmethod
+    def from_settings(cls, settings) -> "Gazetteer":
+        return cls.load(
+            settings.get("LOCATION_GAZETTEER") or None,
+            cache_size=settings.getint("LOCATION_CACHE_SIZE", 4096),
+        )
+
+    def _key_for(self, place_id: int) -> LocationKey:
+        ids = dict.fromkeys(LEVELS)
+        current: Optional[int] = place_id
+        while current is not None:
+            place = self.places[current]
+            ids[place["level"]] = place["id"]
+            current = place.get("parent_id")
+        return LocationKey(ids["country"], ids["region"], ids["city"])
+
+    def _most_specific(self, place_ids: List[int]) -> Optional[int]:
+        if not place_ids:
+            return None
+        return max(place_ids, key=lambda pid: LEVELS.index(self.places[pid]["level"]))
+
+    def _lookup(self, raw: Optional[str]) -> LocationKey:
+        if not raw:
+            return EMPTY_KEY
+
+        parts = [normalize_alias(p) for p in _SPLIT_RE.split(raw)]
+        found = [self.aliases[p] for p in parts if p in self.aliases]
+        if not found:
+            found = [self.aliases[m] for m in self._substring_re.findall(normalize_alias(raw))]
+
+        place_id = self._most_specific(found)
+        return EMPTY_KEY if place_id is None else self._key_for(place_id)
+
+    def normalize(self, raw: Optional[str]) -> LocationKey:
+        return self.lookup(raw.strip() if isinstance(raw, str) else None)
+
+    def cache_info(self):
+        return self.lookup.cache_info()
+
+
+LOCATION_DDL = (
+    "ALTER TABLE intermark.properties_raw ADD COLUMN IF NOT EXISTS country_id integer",
+    "ALTER TABLE intermark.properties_raw ADD COLUMN IF NOT EXISTS region_id integer",
+    "ALTER TABLE intermark.properties_raw ADD COLUMN IF NOT EXISTS city_id integer",
+    "CREATE INDEX IF NOT EXISTS ix_intermark_properties_raw_country_id ON intermark.properties_raw (country_id)",
+    "CREATE INDEX IF NOT EXISTS ix_intermark_properties_raw_region_id ON intermark.properties_raw (region_id)",
+    "CREATE INDEX IF NOT EXISTS ix_intermark_properties_raw_city_id ON intermark.properties_raw (city_id)",
+)
+
+
+def ensure_location_schema(engine) -> None:
+    """Колонки-ключи на уже существующей properties_raw (create_all их не добавит); nullable — без перезаписи таблицы."""
+    with engine.begin() as conn:
+        for ddl in LOCATION_DDL:
+            conn.execute(text(ddl))
+
+
+def has_location_schema(engine) -> bool:
+    """Есть ли колонки-ключи (проверка каталога при старте PostgresStorage; DDL — только migrate_locations.py)."""
+    with engine.connect() as conn:
+        found = conn.execute(text(
+            "SELECT count(*) FROM information_schema.columns "
+            "WHERE table_schema = 'intermark' AND table_name = 'properties_raw' "
+            "AND column_name IN ('country_id', 'region_id', 'city_id')"
+        )).scalar_one()
+    return found == 3
+
+
+def sync_places(engine, gazetteer: Gazetteer) -> None:
+    """Заливает справочник в intermark.geo_places (upsert по id)."""
+    rows = [
+        {"id": p["id"], "level": p["level"], "name": p["name"], "parent_id": p.get("parent_id")}
+        for p in gazetteer.places.values()
+    ]
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO intermark.geo_places (id, level, name, parent_id) "
+            "VALUES (:id, :level, :name, :parent_id) "
+            "ON CONFLICT (id) DO UPDATE SET level = EXCLUDED.level, name = EXCLUDED.name, "
+            "parent_id = EXCLUDED.parent_id"
+        ), rows)
+
+
+def backfill_locations(engine, gazetteer: Gazetteer, batch_size: int = 1000) -> int:
+    """Проставляет ключи существующим строкам: по одному UPDATE на distinct location (индекс по location)."""
+    with engine.connect() as conn:
+        locations = [r[0] for r in conn.execute(text(
+            "SELECT DISTINCT location FROM intermark.properties_raw WHERE location IS NOT NULL"
+        ))]
+
+    updated = 0
+    for start in range(0, len(locations), batch_size):
+        rows = []
+        for loc in locations[start:start + batch_size]:
+            key = gazetteer.normalize(loc)
+            rows.append({"location": loc, **key._asdict()})
+        with engine.begin() as conn:
+            result = conn.execute(text(
+                "UPDATE intermark.properties_raw SET country_id = :country_id, region_id = :region_id, "
+                "city_id = :city_id WHERE location = :location AND ("
+                "country_id IS DISTINCT FROM :country_id OR region_id IS DISTINCT FROM :region_id "
+                "OR city_id IS DISTINCT FROM :city_id)"
+            ), rows)
+            updated += max(result.rowcount, 0)
+    return updated
+
+
+def spark_normalize_locations(df, gazetteer: Gazetteer, column: str = "location"):
+    """
+    Для Spark ETL: добавляет country_id/region_id/city_id к DataFrame.
+    UDF по каждой строке не нужен — distinct location маппятся на драйвере,
+    маленькая таблица соответствий уходит на executor-ы broadcast join-ом.
+    """
+    from pyspark.sql import functions as F
+    from pyspark.sql.types import IntegerType, StringType, StructField, StructType
+
+    distinct = [r[0] for r in df.select(column).distinct().collect() if r[0] is not None]
+    mapping = [(loc, *gazetteer.normalize(loc)) for loc in distinct]
+    schema = StructType([
+        StructField(column, StringType(), False),
+        StructField("country_id", IntegerType(), True),
+        StructField("region_id", IntegerType(), True),
+        StructField("city_id", IntegerType(), True),
+    ])
+    lookup_df = df.sparkSession.createDataFrame(mapping, schema)
+    return df.join(F.broadcast(lookup_df), on=column, how="left")
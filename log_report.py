@@ -0,0 +1,83 @@
+"""
+Отчёт по JSON-логам (LOG_JSON_FILE, см. logging_setup.py).
+
+    python -m intermark_scraper.log_report logs/scrapy_run.jsonl
+
+- по стадиям (stage: pipeline, render_listing, render_detail, ...): число, total, p50/p95/max duration_ms
+- по шаблонам сообщений: число записей
+- по уровням: сколько WARNING/ERROR
+Число, total и счётчики — с поправкой на сэмплирование (sample_every: запись стоит за N исходных);
+перцентили и max — по оставшимся записям (равномерная выборка).
+"""
+
+import json
+import statistics
+import sys
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List
+
+
+def _pct(values: List[float], p: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+def build_report(lines: Iterable[str]) -> Dict[str, dict]:
+    durations: Dict[str, List[float]] = defaultdict(list)
+    counts: Counter = Counter()
+    totals: Dict[str, float] = defaultdict(float)
+    templates: Counter = Counter()
+    levels: Counter = Counter()
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        weight = rec.get("sample_every", 1)
+        levels[rec.get("level")] += weight
+        templates[rec.get("tpl", "")[:60]] += weight
+        if "stage" in rec and "duration_ms" in rec:
+            value = float(rec["duration_ms"])
+            durations[rec["stage"]].append(value)
+            counts[rec["stage"]] += weight
+            totals[rec["stage"]] += value * weight
+
+    stages = {}
+    for stage, values in durations.items():
+        values.sort()
+        stages[stage] = {
+            "count": counts[stage],
+            "total_s": round(totals[stage] / 1000, 2),
+            "p50_ms": round(_pct(values, 50), 2),
+            "p95_ms": round(_pct(values, 95), 2),
+            "max_ms": round(values[-1], 2),
+        }
+    return {"stages": stages, "templates": dict(templates.most_common(30)), "levels": dict(levels)}
+
+
+def main(argv) -> None:
+    if not argv:
+        print("usage: python -m intermark_scraper.log_report <file.jsonl>")
+        sys.exit(2)
+    with open(argv[0], encoding="utf-8") as f:
+        report = build_report(f)
+
+    print("== stages ==")
+    print(f"{'stage':20} {'count':>8} {'total_s':>10} {'p50_ms':>10} {'p95_ms':>10} {'max_ms':>10}")
+    for stage, r in sorted(report["stages"].items(), key=lambda kv: -kv[1]["total_s"]):
+        print(f"{stage:20} {r['count']:>8} {r['total_s']:>10} {r['p50_ms']:>10} {r['p95_ms']:>10} {r['max_ms']:>10}")
+    print("\n== messages (sampling-adjusted) ==")
+    for tpl, n in report["templates"].items():
+        print(f"{n:>8}  {tpl}")
+    print("\n== levels ==")
+    for level, n in report["levels"].items():
+        print(f"{level:10} {n}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,158 @@
+"""
+Неблокирующее логирование для горячего пути (LOG_ASYNC_ENABLED).
+
+Scrapy пишет лог синхронно в LOG_FILE из потока реактора. AsyncLogging:
+- переносит файловые/консольные handler-ы root-логгера в QueueListener (фоновый поток),
+  в реакторе остаётся только QueueHandler (положить запись в очередь)
+- сэмплирует и ограничивает по частоте "per-item" сообщения (LOG_SAMPLING, LOG_RATE_LIMITS:
+  префикс шаблона сообщения -> каждое N-е / не больше N в секунду); WARNING и выше — всегда
+- опционально пишет JSON lines (LOG_JSON_FILE) с полями stage/duration_ms для log_report.py
+
+Счётчики log_count/* Scrapy не трогаем — они по-прежнему видят все записи.
+"""
+
+import json
+import logging
+import queue
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional, Tuple
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+_PRIMITIVES = (str, int, float, bool, type(None))
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Ключ — префикс шаблона (record.msg до подстановки args), например "[pipeline] got item".
+    sampling: {префикс: N} — пропускаем каждую N-ю запись (детерминированно, без random);
+    rate_limits: {префикс: N} — не больше N записей в секунду (token bucket).
+    Оставленные после сэмплирования записи помечаются record.sample_every = N — отчёт их масштабирует.
+    """
+
+    def __init__(self, sampling: Dict[str, int], rate_limits: Dict[str, float]):
+        super().__init__()
+        self.sampling: List[Tuple[str, int]] = [(p, max(int(n), 1)) for p, n in sampling.items()]
+        self.rate_limits: List[Tuple[str, float]] = [(p, float(n)) for p, n in rate_limits.items()]
+        self.seen: Dict[str, int] = {}
+        self.dropped: Dict[str, int] = {}
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def _drop(self, prefix: str) -> bool:
+        self.dropped[prefix] = self.dropped.get(prefix, 0) + 1
+        return False
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        template = record.msg if isinstance(record.msg, str) else str(record.msg)
+
+        for prefix, every in self.sampling:
+            if template.startswith(prefix):
+                n = self.seen.get(prefix, 0)
+                self.seen[prefix] = n + 1
+                if n % every:
+                    return self._drop(prefix)
+                record.sample_every = every
+                break
+
+        for prefix, per_second in self.rate_limits:
+            if template.startswith(prefix):
+                now = time.monotonic()
+                tokens, last = self._buckets.get(prefix, (per_second, now))
+                tokens = min(per_second, tokens + (now - last) * per_second)
+                if tokens < 1.0:
+                    self._buckets[prefix] = (tokens, now)
+                    return self._drop(prefix)
+                self._buckets[prefix] = (tokens - 1.0, now)
+                break
+
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler, который не форматирует сообщение в вызывающем потоке,
+    если все args — неизменяемые примитивы (форматирование уходит в QueueListener).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.tpl = record.msg if isinstance(record.msg, str) else str(record.msg)
+        args = record.args
+        if record.exc_info or (args and not all(isinstance(a, _PRIMITIVES) for a in (
+            args.values() if isinstance(args, dict) else args
+        ))):
+            return super().prepare(record)
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Одна запись — одна JSON-строка; stage/duration_ms/sample_every берутся из extra."""
+
+    EXTRA_FIELDS = ("stage", "duration_ms", "url", "sample_every")
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "tpl": getattr(record, "tpl", None) or str(record.msg),
+            "msg": record.getMessage(),
+        }
+        for field in self.EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                out[field] = value
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False)
+
+
+class AsyncLogging:
+    def __init__(self, crawler, json_file: Optional[str]):
+        s = crawler.settings
+        self.stats = crawler.stats
+        self.root = logging.getLogger()
+        # переносим только "выводящие" handler-ы; LogCounterHandler Scrapy остаётся синхронным
+        self.moved = [
+            h for h in self.root.handlers
+            if isinstance(h, logging.StreamHandler) and not isinstance(h, QueueHandler)
+        ]
+        handlers = list(self.moved)
+        if json_file:
+            json_handler = logging.FileHandler(json_file, encoding="utf-8")
+            json_handler.setLevel(s.get("LOG_LEVEL", "INFO"))
+            json_handler.setFormatter(JsonLinesFormatter())
+            handlers.append(json_handler)
+
+        self.filter = SamplingFilter(s.getdict("LOG_SAMPLING"), s.getdict("LOG_RATE_LIMITS"))
+        q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        self.queue_handler = DeferredQueueHandler(q)
+        self.queue_handler.setLevel(min((h.level for h in handlers), default=logging.NOTSET))
+        self.queue_handler.addFilter(self.filter)
+        self.listener = QueueListener(q, *handlers, respect_handler_level=True)
+
+        for h in self.moved:
+            self.root.removeHandler(h)
+        self.root.addHandler(self.queue_handler)
+        self.listener.start()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("LOG_ASYNC_ENABLED", False):
+            raise NotConfigured("LOG_ASYNC_ENABLED is off")
+        ext = cls(crawler, crawler.settings.get("LOG_JSON_FILE"))
+        crawler.signals.connect(ext.engine_stopped, signal=signals.engine_stopped)
+        return ext
+
+    def engine_stopped(self):
+        # дописываем очередь и возвращаем синхронные handler-ы — финальный дамп stats не потеряется
+        for prefix, n in self.filter.dropped.items():
+            self.stats.set_value(f"log/sampled_out/{prefix}", n)
+        self.listener.stop()
+        self.root.removeHandler(self.queue_handler)
+        for h in self.moved:
+            self.root.addHandler(h)
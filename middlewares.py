@@ -1,190 +1,556 @@
-# Define here the models for your spider middleware
-#
-# See documentation in:
-# https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-
-from scrapy import signals
-
-# useful for handling different item types with a single interface
-from itemadapter import ItemAdapter
-
-
-class IntermarkScraperSpiderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
-
-    @classmethod
-    def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
-        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
-        return s
-
-    def process_spider_input(self, response, spider):
-        # Called for each response that goes through the spider
-        # middleware and into the spider.
-
-        # Should return None or raise an exception.
-        return None
-
-    def process_spider_output(self, response, result, spider):
-        # Called with the results returned from the Spider, after
-        # it has processed the response.
-
-        # Must return an iterable of Request, or item objects.
-        for i in result:
-            yield i
-
-    def process_spider_exception(self, response, exception, spider):
-        # Called when a spider or process_spider_input() method
-        # (from other spider middleware) raises an exception.
-
-        # Should return either None or an iterable of Request or item objects.
-        pass
-
-    async def process_start(self, start):
-        # Called with an async iterator over the spider start() method or the
-        # matching method of an earlier spider middleware.
-        async for item_or_request in start:
-            yield item_or_request
-
-    def spider_opened(self, spider):
-        spider.logger.info("Spider opened: %s" % spider.name)
-
-
-class IntermarkScraperDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
-
-    @classmethod
-    def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
-        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
-        return s
-
-    def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
-        return None
-
-    def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
-
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
-        return response
-
-    def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
-
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
-
-    def spider_opened(self, spider):
-        spider.logger.info("Spider opened: %s" % spider.name)
-
-
-import random
-from fake_useragent import UserAgent
-
-
-# class RotateUserAgentMiddleware:
-#     """
-#     Меняет User-Agent на каждый запрос.
-#     """
-#
-#     def __init__(self):
-#         self.ua = UserAgent()
-#
-#     @classmethod
-#     def from_crawler(cls, crawler):
-#         return cls()
-#
-#     def process_request(self, request, spider):
-#         request.headers["User-Agent"] = self.ua.random
-
-import random
-
-
-class RotateUserAgentMiddleware:
-    USER_AGENTS = [
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15",
-        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-    ]
-
-    @classmethod
-    def from_crawler(cls, crawler):
-        return cls()
-
-    def process_request(self, request, spider):
-        request.headers["User-Agent"] = random.choice(self.USER_AGENTS)
-
-
-import time
-import random
-from scrapy.downloadermiddlewares.retry import RetryMiddleware
-from scrapy.utils.response import response_status_message
-
-
-class SmartRetryMiddleware(RetryMiddleware):
-    """
-    Ретрай для временных/антибот статусов с backoff-паузой.
-    Работает вместе со стандартным RetryMiddleware (мы его отключаем в settings).
-    """
-
-    RETRY_HTTP_CODES = {403, 408, 429, 500, 502, 503, 504}
-
-    def __init__(self, settings):
-        super().__init__(settings)
-        self.max_backoff = settings.getfloat("SMART_RETRY_MAX_BACKOFF", 15.0)
-        self.base_backoff = settings.getfloat("SMART_RETRY_BASE_BACKOFF", 1.5)
-
-    @classmethod
-    def from_crawler(cls, crawler):
-        return cls(crawler.settings)
-
-    def process_response(self, request, response, spider):
-        if request.meta.get("dont_retry", False):
-            return response
-
-        if response.status in self.RETRY_HTTP_CODES:
-            retries = request.meta.get("retry_times", 0) + 1
-            if retries <= self.max_retry_times:
-                # backoff: 1.5, 3, 6, 12... + jitter
-                backoff = min(self.base_backoff * (2 ** (retries - 1)), self.max_backoff)
-                jitter = random.uniform(0, 0.5)
-                sleep_s = backoff + jitter
-
-                spider.logger.info(
-                    "[smart-retry] %s status=%s retry=%s/%s sleep=%.2fs",
-                    request.url,
-                    response.status,
-                    retries,
-                    self.max_retry_times,
-                    sleep_s,
-                )
-                time.sleep(sleep_s)
-
-                reason = response_status_message(response.status)
-                return self._retry(request, reason, spider) or response
-
-        return response
-
+# Define here the models for your spider middleware
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/spider-middleware.html
+
+from scrapy import signals
+
+# useful for handling different item types with a single interface
+from itemadapter import ItemAdapter
+
+
+class IntermarkScraperSpiderMiddleware:
+    # Not all methods need to be defined. If a method is not defined,
+    # scrapy acts as if the spider middleware does not modify the
+    # passed objects.
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # This method is used by Scrapy to create your spiders.
+        s = cls()
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def process_spider_input(self, response, spider):
+        # Called for each response that goes through the spider
+        # middleware and into the spider.
+
+        # Should return None or raise an exception.
+        return None
+
+    def process_spider_output(self, response, result, spider):
+        # Called with the results returned from the Spider, after
+        # it has processed the response.
+
+        # Must return an iterable of Request, or item objects.
+        for i in result:
+            yield i
+
+    def process_spider_exception(self, response, exception, spider):
+        # Called when a spider or process_spider_input() method
+        # (from other spider middleware) raises an exception.
+
+        # Should return either None or an iterable of Request or item objects.
+        pass
+
+    async def process_start(self, start):
+        # Called with an async iterator over the spider start() method or the
+        # matching method of an earlier spider middleware.
+        async for item_or_request in start:
+            yield item_or_request
+
+    def spider_opened(self, spider):
+        spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class IntermarkScraperDownloaderMiddleware:
+    # Not all methods need to be defined. If a method is not defined,
+    # scrapy acts as if the downloader middleware does not modify the
+    # passed objects.
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # This method is used by Scrapy to create your spiders.
+        s = cls()
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def process_request(self, request, spider):
+        # Called for each request that goes through the downloader
+        # middleware.
+
+        # Must either:
+        # - return None: continue processing this request
+        # - or return a Response object
+        # - or return a Request object
+        # - or raise IgnoreRequest: process_exception() methods of
+        #   installed downloader middleware will be called
+        return None
+
+    def process_response(self, request, response, spider):
+        # Called with the response returned from the downloader.
+
+        # Must either;
+        # - return a Response object
+        # - return a Request object
+        # - or raise IgnoreRequest
+        return response
+
+    def process_exception(self, request, exception, spider):
+        # Called when a download handler or a process_request()
+        # (from other downloader middleware) raises an exception.
+
+        # Must either:
+        # - return None: continue processing this exception
+        # - return a Response object: stops process_exception() chain
+        # - return a Request object: stops process_exception() chain
+        pass
+
+    def spider_opened(self, spider):
+        spider.logger.info("Spider opened: %s" % spider.name)
+
+
+import random
+
+
+class RotateUserAgentMiddleware:
+    USER_AGENTS = [
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15",
+        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    ]
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls()
+
+    def process_request(self, request, spider):
+        request.headers["User-Agent"] = random.choice(self.USER_AGENTS)
+
+
+import time
+import random
+from scrapy.downloadermiddlewares.retry import RetryMiddleware
+from scrapy.utils.response import response_status_message
+
+
+class SmartRetryMiddleware(RetryMiddleware):
+    """
+    Ретрай для временных/антибот статусов с backoff-паузой.
+    Работает вместе со стандартным RetryMiddleware (мы его отключаем в settings).
+    """
+
+    RETRY_HTTP_CODES = {403, 408, 429, 500, 502, 503, 504}
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.max_backoff = settings.getfloat("SMART_RETRY_MAX_BACKOFF", 15.0)
+        self.base_backoff = settings.getfloat("SMART_RETRY_BASE_BACKOFF", 1.5)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings)
+
+    def process_response(self, request, response, spider):
+        if request.meta.get("dont_retry", False):
+            return response
+
+        if response.status in self.RETRY_HTTP_CODES:
+            retries = request.meta.get("retry_times", 0) + 1
+            if retries <= self.max_retry_times:
+                # backoff: 1.5, 3, 6, 12... + jitter
+                backoff = min(self.base_backoff * (2 ** (retries - 1)), self.max_backoff)
+                jitter = random.uniform(0, 0.5)
+                sleep_s = backoff + jitter
+                if request.meta.get("proxy_session"):
+                    # SessionPoolMiddleware уже отправил endpoint в cooldown, ретрай уйдёт через другой
+                    sleep_s = 0.0
+
+                spider.logger.info(
+                    "[smart-retry] %s status=%s retry=%s/%s sleep=%.2fs",
+                    request.url,
+                    response.status,
+                    retries,
+                    self.max_retry_times,
+                    sleep_s,
+                )
+                if sleep_s:
+                    time.sleep(sleep_s)
+
+                reason = response_status_message(response.status)
+                return self._retry(request, reason, spider) or response
+
+        return response
+
+
+
+from scrapy.exceptions import NotConfigured
+from scrapy.http import HtmlResponse
+from scrapy.utils.defer import deferred_from_coro
+
+from intermark_scraper.extensions import render_finished, render_limit_changed
+
+
+class TabRenderMiddleware:
+    """
+    Рендер запросов с meta["render"] ("listing"/"detail") во вкладках одного Chromium
+    (render_pool.TabPool). Включается RENDER_BACKEND = "tabs"; иначе паук рендерит Selenium-ом сам.
+
+    Рендер-запросы не доходят до download slot-ов, но занимают общий лимит движка
+    (CONCURRENT_REQUESTS): на spider_opened он поднимается на число вкладок пула, иначе при
+    CONCURRENT_REQUESTS = 1 вкладки рендерили бы по одной. С ADAPTIVE_CONCURRENCY_ENABLED
+    общий лимит (HTTP + рендеры) ведёт AdaptiveConcurrency.
+    """
+
+    def __init__(self, settings):
+        from intermark_scraper.render_pool import TabPool
+
+        self.pool = TabPool(
+            max_tabs=settings.getint("RENDER_MAX_TABS", 4),
+            pages_per_tab=settings.getint("RENDER_PAGES_PER_TAB", 50),
+            tab_budget_mb=settings.getint("RENDER_TAB_BUDGET_MB", 80),
+        )
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.get("RENDER_BACKEND", "selenium") != "tabs":
+            raise NotConfigured("RENDER_BACKEND is not 'tabs'")
+        mw = cls(crawler.settings)
+        mw.crawler = crawler
+        mw.stats = crawler.stats
+        mw.signals = crawler.signals
+        crawler.signals.connect(mw.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(mw.render_limit_changed, signal=render_limit_changed)
+        return mw
+
+    def spider_opened(self, spider):
+        # MemoryGuard перезапускает браузер пула через spider.tab_pool.recycle()
+        spider.tab_pool = self.pool
+        if self.crawler.settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED", False):
+            return
+        downloader = self.crawler.engine.downloader
+        downloader.total_concurrency = self.crawler.settings.getint("CONCURRENT_REQUESTS") + self.pool.max_tabs
+        spider.logger.info("[tabs] engine concurrency %s (HTTP + %s tabs)", downloader.total_concurrency, self.pool.max_tabs)
+
+    def render_limit_changed(self, limit: int):
+        self.pool.set_limit(limit)
+
+    async def process_request(self, request, spider):
+        kind = request.meta.get("render")
+        if not kind:
+            return None
+
+        # та же сессия (прокси + User-Agent), что выдал SessionPoolMiddleware
+        session_pool = getattr(spider, "session_pool", None)
+        session = session_pool.by_key.get(request.meta.get("proxy_session")) if session_pool else None
+
+        start = time.perf_counter()
+        ok = True
+        try:
+            if kind == "listing":
+                html = await self.pool.render_listing(request.url, session=session)
+            else:
+                html = await self.pool.render_detail(request.url, session=session)
+        except Exception as e:
+            # как в Selenium-ветке: не падаем, отдаём пустую страницу (пагинация остановится по 0 карточек)
+            spider.logger.error("[tabs] render failed url=%s err=%s", request.url, e)
+            self.stats.inc_value(f"render/{kind}/failed")
+            html = ""
+            ok = False
+
+        elapsed = time.perf_counter() - start
+        self.stats.inc_value(f"render/{kind}/count")
+        self.stats.inc_value(f"render/{kind}/seconds", round(elapsed, 3))
+        self.signals.send_catch_log(render_finished, seconds=elapsed, ok=ok)
+        spider.logger.info(
+            "[tabs] rendered %s kind=%s ok=%s", request.url, kind, ok,
+            extra={"stage": f"render_{kind}", "duration_ms": round(elapsed * 1000, 2), "url": request.url},
+        )
+        return HtmlResponse(url=request.url, body=html.encode("utf-8"), encoding="utf-8", request=request)
+
+    def spider_closed(self, spider):
+        return deferred_from_coro(self.pool.close())
+
+
+from collections import OrderedDict
+
+from typing import Optional
+
+from scrapy import Request
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.misc import arg_to_iter
+
+from intermark_scraper.items import PropertyItem
+
+
+class ItemCoalescerMiddleware:
+    """
+    Склеивает listing- и detail-item одного url в один item перед pipeline.
+
+    Если за listing-item следует detail-запрос с meta["listing_item"] на этот же item,
+    listing-item придерживается до прихода detail-item и отдаётся один раз, уже смерженный
+    (pipeline делает один INSERT вместо INSERT + SELECT/UPDATE).
+
+    Ничего не теряется: придержанный item отпускается как есть
+    - при ошибке detail-запроса (errback паука coalesce_errback — метод паука, чтобы запрос
+      сериализовался в JOBDIR; errback, который паук задал сам, вызывается следом),
+    - по таймауту COALESCE_TIMEOUT,
+    - при переполнении COALESCE_MAX_PENDING (самый старый),
+    - когда паук простаивает (spider_idle) — через data:-запрос.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.timeout = crawler.settings.getfloat("COALESCE_TIMEOUT", 300.0)
+        self.max_pending = crawler.settings.getint("COALESCE_MAX_PENDING", 1000)
+        self._held = OrderedDict()  # url -> (listing_item, held_at)
+        self._can_hold = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("COALESCE_ENABLED", True):
+            raise NotConfigured("COALESCE_ENABLED is off")
+        mw = cls(crawler)
+        crawler.signals.connect(mw.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(mw.spider_idle, signal=signals.spider_idle)
+        return mw
+
+    def spider_opened(self, spider):
+        # без errback-а на стороне паука придержанный item при ошибке detail не отпустить
+        self._can_hold = callable(getattr(spider, "coalesce_errback", None))
+        if self._can_hold:
+            spider.item_coalescer = self
+        else:
+            spider.logger.warning("[coalesce] spider has no coalesce_errback(); items are passed through as is")
+
+    @staticmethod
+    def _stage(x) -> Optional[str]:
+        if isinstance(x, PropertyItem):
+            return x.stage
+        if isinstance(x, dict) and isinstance(x.get("features"), dict):
+            return x["features"].get("from")
+        return None
+
+    def _hold(self, item, request: Request) -> Request:
+        url = item["url"]
+        self._held[url] = (item, time.monotonic())
+        self._held.move_to_end(url)
+        self.stats.set_value("coalesce/pending", len(self._held))
+        self.stats.max_value("coalesce/pending_max", len(self._held))
+        meta = {**request.meta, "coalesce_key": url}
+        if request.errback is not None:
+            # метод паука — по имени (сериализуемо), иное — как есть
+            spider = self.crawler.spider
+            original = request.errback
+            meta["coalesce_errback"] = (
+                original.__name__ if getattr(original, "__self__", None) is spider else original
+            )
+        return request.replace(meta=meta, errback=self.crawler.spider.coalesce_errback)
+
+    def _merge(self, listing_item, detail_item):
+        from intermark_scraper.storage import _merge_features
+
+        if isinstance(listing_item, PropertyItem) and isinstance(detail_item, PropertyItem):
+            self.stats.inc_value("coalesce/merged")
+            return listing_item.merged_with(
+                detail_item, _merge_features(listing_item.features, detail_item.features)
+            )
+
+        merged = dict(listing_item)
+        for k, v in detail_item.items():
+            if k == "features" or v is None:
+                continue
+            merged[k] = v
+        merged["features"] = _merge_features(listing_item.get("features"), detail_item.get("features"))
+        self.stats.inc_value("coalesce/merged")
+        return merged
+
+    def _release(self, reason: str, expired_only: bool = True):
+        now = time.monotonic()
+        out = []
+        while self._held:
+            url, (item, held_at) = next(iter(self._held.items()))
+            overflow = len(self._held) > self.max_pending
+            if expired_only and not overflow and now - held_at < self.timeout:
+                break
+            del self._held[url]
+            self.stats.inc_value(f"coalesce/released_{'overflow' if overflow else reason}")
+            out.append(item)
+        self.stats.set_value("coalesce/pending", len(self._held))
+        return out
+
+    def _coalesce(self, x, key: Optional[str], pending: list):
+        """
+        Шаг автомата по одному выходному объекту.
+        pending — listing-item, для которого ещё не ясно, пойдёт ли за ним detail-запрос.
+        """
+        if isinstance(x, Request) and pending and self._can_hold and x.meta.get("listing_item") is pending[0]:
+            yield self._hold(pending.pop(), x)
+            return
+
+        if pending:
+            yield pending.pop()
+
+        stage = self._stage(x)
+        if stage == "listing":
+            pending.append(x)
+        elif stage == "detail" and key and key in self._held:
+            listing_item, _ = self._held.pop(key)
+            yield self._merge(listing_item, x)
+        else:
+            yield x
+
+    def _run(self, result, key: Optional[str]):
+        pending: list = []
+        for x in result:
+            yield from self._coalesce(x, key, pending)
+        if pending:
+            yield pending.pop()
+        yield from self._release("timeout")
+
+    def process_spider_output(self, response, result, spider):
+        key = response.meta.get("coalesce_key") if response is not None else None
+        yield from self._run(result, key)
+
+    async def process_spider_output_async(self, response, result, spider):
+        key = response.meta.get("coalesce_key") if response is not None else None
+        pending: list = []
+        async for x in result:
+            for out in self._coalesce(x, key, pending):
+                yield out
+        if pending:
+            yield pending.pop()
+        for out in self._release("timeout"):
+            yield out
+
+    def process_start_requests(self, start_requests, spider):
+        # listing в Selenium-режиме отдаёт item-ы прямо из start_requests
+        yield from self._run(start_requests, None)
+
+    async def process_start(self, start):
+        pending: list = []
+        async for x in start:
+            for out in self._coalesce(x, None, pending):
+                yield out
+        if pending:
+            yield pending.pop()
+
+    def on_detail_failure(self, failure, spider):
+        """Вызывается из spider.coalesce_errback: отпускает придержанный item, затем исходный errback."""
+        request = failure.request
+        held = self._held.pop(request.meta.get("coalesce_key"), None)
+        if held is not None:
+            self.stats.inc_value("coalesce/released_failure")
+            self.stats.set_value("coalesce/pending", len(self._held))
+            yield held[0]
+
+        original = request.meta.get("coalesce_errback")
+        if isinstance(original, str):
+            original = getattr(spider, original, None)
+        if original is not None:
+            yield from arg_to_iter(original(failure))
+
+    def _flush_all(self, response):
+        yield from self._release("idle", expired_only=False)
+
+    def spider_idle(self, spider):
+        if not self._held:
+            return
+        self.crawler.engine.crawl(Request("data:,", callback=self._flush_all, dont_filter=True))
+        raise DontCloseSpider
+
+
+from twisted.internet.task import deferLater
+from scrapy.utils.defer import maybe_deferred_to_future
+
+from intermark_scraper.sessions import SessionPool
+
+
+class SessionPoolMiddleware:
+    """
+    Раздаёт запросам сессии из sessions.SessionPool (PROXY_POOL_ENABLED):
+    meta["proxy"] + User-Agent + meta["cookiejar"] сессии, свой download slot на endpoint.
+
+    Стоит после SmartRetryMiddleware по process_response (priority 560 > 550): видит 403/429
+    раньше ретрая, отправляет endpoint в cooldown, а ретрай уходит через другую сессию.
+    Запросы с чужим download_slot (например, "images") и meta["dont_proxy"] не трогает.
+    Пул доступен рендеру как spider.session_pool.
+    """
+
+    def __init__(self, crawler, pool: SessionPool):
+        self.stats = crawler.stats
+        self.pool = pool
+        self.block_codes = {int(c) for c in crawler.settings.getlist("PROXY_BLOCK_CODES", [403, 429])}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("PROXY_POOL_ENABLED", False):
+            raise NotConfigured("PROXY_POOL_ENABLED is off")
+        mw = cls(crawler, SessionPool.from_settings(crawler.settings))
+        crawler.signals.connect(mw.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    def spider_opened(self, spider):
+        spider.session_pool = self.pool
+        spider.logger.info("[proxy] session pool: %s", [s.key for s in self.pool.sessions])
+
+    @staticmethod
+    def _managed(request) -> bool:
+        if request.meta.get("dont_proxy") or request.url.startswith("data:"):
+            return False
+        return "download_slot" not in request.meta or "proxy_session" in request.meta
+
+    async def process_request(self, request, spider):
+        if not self._managed(request):
+            return None
+
+        # ретрай — через другую сессию, если есть из чего выбирать
+        exclude = request.meta.get("proxy_session") if request.meta.get("retry_times") else None
+        session, wait = self.pool.acquire(exclude=exclude)
+        if wait > 0:
+            self.stats.inc_value("proxy/rate_limited")
+            # реактор — лениво: импорт на уровне модуля установил бы дефолтный вместо asyncio (TWISTED_REACTOR)
+            from twisted.internet import reactor
+
+            await maybe_deferred_to_future(deferLater(reactor, wait, lambda: None))
+
+        request.meta["proxy_session"] = session.key
+        request.meta["cookiejar"] = session.key
+        request.meta["download_slot"] = f"session:{session.key}"
+        if session.proxy:
+            request.meta["proxy"] = session.proxy
+        else:
+            request.meta.pop("proxy", None)
+        request.headers["User-Agent"] = session.user_agent
+        self.stats.inc_value(f"proxy/{session.key}/requests")
+        return None
+
+    def _session(self, request):
+        key = request.meta.get("proxy_session")
+        return self.pool.by_key.get(key) if key else None
+
+    def process_response(self, request, response, spider):
+        session = self._session(request)
+        # рендер меряет браузер, а не endpoint — в здоровье сессии не учитываем
+        if session is None or request.meta.get("render"):
+            return response
+
+        blocked = response.status in self.block_codes
+        self.pool.record(session, request.meta.get("download_latency"), blocked)
+        if blocked:
+            self.stats.inc_value(f"proxy/{session.key}/blocked")
+            spider.logger.info(
+                "[proxy] %s blocked status=%s url=%s (streak %s)",
+                session.key, response.status, request.url, session.consecutive_blocks,
+            )
+        self.stats.set_value("proxy/healthy", self.pool.healthy_count())
+        return response
+
+    def process_exception(self, request, exception, spider):
+        session = self._session(request)
+        if session is not None and not request.meta.get("render"):
+            self.pool.record(session, None, blocked=True)
+            self.stats.inc_value(f"proxy/{session.key}/errors")
+            self.stats.set_value("proxy/healthy", self.pool.healthy_count())
+        return None
+
+    def spider_closed(self, spider):
+        report = self.pool.report()
+        for key, row in report.items():
+            self.stats.set_value(f"proxy/{key}/score", row["score"])
+            self.stats.set_value(f"proxy/{key}/latency_s", row["latency_s"])
+        spider.logger.info("[proxy] session health: %s", report)
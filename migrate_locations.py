@@ -0,0 +1,51 @@
+"""
+Миграция: нормализованный location в properties_raw.
+
+- колонки country_id/region_id/city_id + B-tree индексы (краулер их не создаёт, только проверяет при старте)
+- справочник intermark.geo_places из gazetteer.json (или --gazetteer)
+- backfill ключей для уже собранных строк (по distinct location)
+
+Запуск:
+    python -m intermark_scraper.migrate_locations
+
+Агрегация по регионам после миграции — целочисленный join вместо LIKE:
+    SELECT g.name, count(*) FROM intermark.properties_raw p
+    JOIN intermark.geo_places g ON g.id = p.region_id GROUP BY g.name;
+"""
+
+import argparse
+import logging
+
+from sqlalchemy import create_engine
+
+from intermark_scraper.locations import Gazetteer, backfill_locations, ensure_location_schema, sync_places
+from intermark_scraper.models import GeoPlace
+from intermark_scraper.pipelines import get_connection_string
+
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нормализация location -> geo_places")
+    parser.add_argument("--gazetteer", default=None, help="путь к gazetteer.json (по умолчанию — рядом с модулем)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
+    gazetteer = Gazetteer.load(args.gazetteer)
+    engine = create_engine(get_connection_string())
+    try:
+        GeoPlace.__table__.create(engine, checkfirst=True)
+        ensure_location_schema(engine)
+        sync_places(engine, gazetteer)
+        updated = backfill_locations(engine, gazetteer)
+        info = gazetteer.cache_info()
+        logger.info(
+            "Locations normalized: %s rows updated, %s distinct locations, %s places",
+            updated, info.currsize, len(gazetteer.places),
+        )
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Миграция properties_raw -> property_snapshots (layout "snapshots").
+
+Текущее содержимое properties_raw копируется одним INSERT ... SELECT в отдельный ран
+(note = "migration from properties_raw"), затем обновляется properties_current.
+properties_raw не изменяется — после проверки можно переключить RAW_STORAGE_LAYOUT = "snapshots".
+
+Запуск:
+    python -m intermark_scraper.migrate_raw_to_snapshots
+"""
+
+import logging
+
+from sqlalchemy import create_engine, text
+
+from intermark_scraper import snapshots
+from intermark_scraper.models import Base
+from intermark_scraper.pipelines import get_connection_string
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = "url, scraped_at, source_page, title, location, price_raw, area_raw, object_id, description, features"
+
+
+def migrate(engine) -> int:
+    Base.metadata.create_all(engine)
+    snapshots.ensure_snapshot_schema(engine)
+
+    run_id = snapshots.start_run(engine, note="migration from properties_raw")
+    with engine.begin() as conn:
+        result = conn.execute(text(
+            f"INSERT INTO intermark.property_snapshots (run_id, {_COLUMNS}) "
+            f"SELECT :run_id, {_COLUMNS} FROM intermark.properties_raw"
+        ), {"run_id": run_id})
+        logger.info("Copied %s rows into run_id=%s", result.rowcount, run_id)
+
+    # keep_runs=0: при миграции ничего не отсоединяем, только закрываем ран и обновляем представление
+    snapshots.finish_run(engine, run_id, keep_runs=0)
+    return run_id
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
+    engine = create_engine(get_connection_string())
+    try:
+        migrate(engine)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
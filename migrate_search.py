@@ -0,0 +1,35 @@
+"""
+Миграция: полнотекстовый и trigram-поиск по properties_raw.
+
+- pg_trgm
+- generated-колонка search_tsv (russian) — на существующей таблице ADD COLUMN перепишет её целиком
+- GIN по search_tsv, GIN trigram по title и location (CREATE INDEX CONCURRENTLY — без блокировки записи)
+
+Краулер эту схему не создаёт (PostgresStorage только предупреждает, если search_tsv нет).
+
+Запуск:
+    python -m intermark_scraper.migrate_search
+"""
+
+import logging
+
+from sqlalchemy import create_engine
+
+from intermark_scraper.pipelines import get_connection_string
+from intermark_scraper.search import ensure_search_schema
+
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
+    engine = create_engine(get_connection_string())
+    try:
+        ensure_search_schema(engine)
+        logger.info("Search schema is up to date")
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,149 @@
-from sqlalchemy import (
-    Column,
-    Integer,
-    Text,
-    DateTime,
-    func,
-)
-from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.orm import declarative_base
-
-Base = declarative_base()
-
-
-class PropertiesRaw(Base):
-    """
-    Сырой слой по объявлениям Intermark.
-
-    Храним:
-    - обязательные поля: url, scraped_at
-    - текстовый контент: title, location, description
-    - цены/площади в raw-виде (чтобы не потерять формат)
-    - вложенные структуры (характеристики/фичи) в JSONB
-    """
-    __tablename__ = "properties_raw"
-    __table_args__ = {"schema": "intermark"}
-
-    id = Column(Integer, primary_key=True, autoincrement=True)
-
-    # обязательные
-    url = Column(Text, nullable=False, unique=True)
-    scraped_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
-
-    # минимум 5+ полей
-    source_page = Column(Text, nullable=True)       # страница каталога, где нашли объект
-    title = Column(Text, nullable=True)             # заголовок карточки/объекта
-    location = Column(Text, nullable=True, index=True)          # город/регион/страна
-    price_raw = Column(Text, nullable=True)         # "€ 896 000 – 1 682 000"
-    area_raw = Column(Text, nullable=True)          # "2700 м²" (если есть)
-    object_id = Column(Text, nullable=True, index=True)         # "ID 724599" (если есть)
-    description = Column(Text, nullable=True)       # описание (если на странице есть)
-
-    # вложенные структуры
-    features = Column(JSONB, nullable=True)         # dict/list: характеристики, теги, параметры
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Index,
+    Integer,
+    SmallInteger,
+    Text,
+    DateTime,
+    Float,
+    func,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import declarative_base
+
+Base = declarative_base()
+
+
+class PropertiesRaw(Base):
+    """
+    Сырой слой по объявлениям Intermark.
+
+    Храним:
+    - обязательные поля: url, scraped_at
+    - текстовый контент: title, location, description
+    - цены/площади в raw-виде (чтобы не потерять формат)
+    - вложенные структуры (характеристики/фичи) в JSONB
+    """
+    __tablename__ = "properties_raw"
+    __table_args__ = {"schema": "intermark"}
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    # обязательные
+    url = Column(Text, nullable=False, unique=True)
+    scraped_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    # минимум 5+ полей
+    source_page = Column(Text, nullable=True)       # страница каталога, где нашли объект
+    title = Column(Text, nullable=True)             # заголовок карточки/объекта
+    location = Column(Text, nullable=True, index=True)          # город/регион/страна
+    price_raw = Column(Text, nullable=True)         # "€ 896 000 – 1 682 000"
+    area_raw = Column(Text, nullable=True)          # "2700 м²" (если есть)
+    object_id = Column(Text, nullable=True, index=True)         # "ID 724599" (если есть)
+    description = Column(Text, nullable=True)       # описание (если на странице есть)
+
+    # нормализованный location -> intermark.geo_places (см. locations.py, migrate_locations.py)
+    country_id = Column(Integer, nullable=True, index=True)
+    region_id = Column(Integer, nullable=True, index=True)
+    city_id = Column(Integer, nullable=True, index=True)
+
+    # вложенные структуры
+    features = Column(JSONB, nullable=True)         # dict/list: характеристики, теги, параметры
+
+    # search_tsv (generated tsvector для полнотекстового поиска) есть только в DDL — search.SEARCH_DDL:
+    # в ORM не мапится, чтобы INSERT не возвращал его (RETURNING) и работал на базе без миграции
+
+
+class GeoPlace(Base):
+    """Справочник мест (страна/регион/город) из gazetteer.json; id — суррогатный ключ для properties_raw."""
+    __tablename__ = "geo_places"
+    __table_args__ = {"schema": "intermark"}
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    level = Column(Text, nullable=False)            # country / region / city
+    name = Column(Text, nullable=False)
+    parent_id = Column(Integer, nullable=True, index=True)
+
+
+class PropertyChange(Base):
+    """
+    История изменений (CDC) по объявлениям: append-only, только изменившиеся поля.
+
+    - field: компактный код поля (см. history.FIELD_CODES), а не имя строкой
+    - old_value/new_value: значения до/после (для description — хеш, не текст)
+    - таблица секционирована по месяцам (RANGE по changed_at), секции создаёт
+      history.ensure_month_partitions()
+    - BRIN по changed_at: данные пишутся по времени, индекс крошечный
+    """
+    __tablename__ = "property_changes"
+    __table_args__ = (
+        Index("ix_property_changes_changed_at_brin", "changed_at", postgresql_using="brin"),
+        Index("ix_property_changes_property_id", "property_id"),
+        {"schema": "intermark", "postgresql_partition_by": "RANGE (changed_at)"},
+    )
+
+    # в секционированной таблице ключ секционирования обязан входить в PK
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    changed_at = Column(DateTime(timezone=True), primary_key=True, nullable=False, server_default=func.now())
+
+    property_id = Column(Integer, nullable=False)   # properties_raw.id
+    field = Column(SmallInteger, nullable=False)    # 1=price_raw, 2=area_raw, 3=description_hash
+    old_value = Column(Text, nullable=True)
+    new_value = Column(Text, nullable=True)
+
+
+class CrawlRun(Base):
+    """Один запуск паука; id используется как ключ секции в property_snapshots."""
+    __tablename__ = "crawl_runs"
+    __table_args__ = {"schema": "intermark"}
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    started_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    note = Column(Text, nullable=True)              # например "migration from properties_raw"
+
+
+class PropertySnapshot(Base):
+    """
+    Снимки объявлений по ранам (layout "snapshots", см. RAW_STORAGE_LAYOUT).
+
+    - LIST-секция на каждый run_id: строки прошлых ранов не обновляются,
+      старые секции отсоединяются (DETACH), а не чистятся VACUUM-ом
+    - description/features — lz4-сжатие TOAST (задаётся в snapshots.ensure_snapshot_schema)
+    - последнее состояние — материализованное представление intermark.properties_current
+    """
+    __tablename__ = "property_snapshots"
+    __table_args__ = {"schema": "intermark", "postgresql_partition_by": "LIST (run_id)"}
+
+    run_id = Column(Integer, primary_key=True)
+    url = Column(Text, primary_key=True)
+    scraped_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    source_page = Column(Text, nullable=True)
+    title = Column(Text, nullable=True)
+    location = Column(Text, nullable=True)
+    price_raw = Column(Text, nullable=True)
+    area_raw = Column(Text, nullable=True)
+    object_id = Column(Text, nullable=True)
+    description = Column(Text, nullable=True)
+
+    features = Column(JSONB, nullable=True)
+
+
+class CrawlState(Base):
+    """
+    Состояние пересканирования detail-страниц (см. freshness.py).
+
+    change_rate — EWMA доли визитов, на которых изменились price_raw/area_raw/description;
+    из неё считается интервал пересканирования и next_due_at.
+    """
+    __tablename__ = "crawl_state"
+    __table_args__ = {"schema": "intermark"}
+
+    url = Column(Text, primary_key=True)
+    last_detail_at = Column(DateTime(timezone=True), nullable=True)
+    next_due_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    visits = Column(Integer, nullable=False, server_default="0")
+    changes = Column(Integer, nullable=False, server_default="0")
+    change_rate = Column(Float, nullable=False, server_default="0.5")
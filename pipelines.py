@@ -1,287 +1,182 @@
-# Вариант-4
-
-import logging
-from contextlib import contextmanager
-from datetime import datetime
-from pathlib import Path
-from typing import Any, Dict, Optional, Set
-
-from environs import Env
-from itemadapter import ItemAdapter
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
-
-from intermark_scraper.models import Base, PropertiesRaw
-
-logger = logging.getLogger(__name__)
-
-
-def get_connection_string() -> str:
-    env = Env()
-    project_root = Path(__file__).resolve().parents[2]
-    env.read_env(project_root / ".env")
-
-    user = env.str("POSTGRES_USER")
-    password = env.str("POSTGRES_PASSWORD")
-    db = env.str("POSTGRES_DB")
-    host = env.str("POSTGRES_HOST", "localhost")
-    port = env.int("POSTGRES_PORT", 5432)
-
-    return f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{db}"
-
-
-def _parse_iso_dt(value: Optional[Any]) -> Optional[datetime]:
-    if not value:
-        return None
-    if isinstance(value, datetime):
-        return value
-    try:
-        return datetime.fromisoformat(str(value))
-    except Exception:
-        return None
-
-
-def _is_blank(value: Any) -> bool:
-    if value is None:
-        return True
-    s = str(value).strip()
-    return s == ""
-
-
-def _merge_features(existing: Optional[Any], incoming: Optional[Any]) -> Optional[Any]:
-    """
-    features: JSONB
-    - dict + dict: мерджим
-      - images: объединяем уникально
-      - params: мерджим ключи
-      - params_list: объединяем уникально
-      - остальные ключи: incoming перезапишет existing (если incoming не None)
-    """
-    if incoming is None:
-        return existing
-    if existing is None:
-        return incoming
-
-    if not isinstance(existing, dict) or not isinstance(incoming, dict):
-        return incoming or existing
-
-    out = dict(existing)
-
-    # images
-    ex_imgs = out.get("images") if isinstance(out.get("images"), list) else []
-    in_imgs = incoming.get("images") if isinstance(incoming.get("images"), list) else []
-    if ex_imgs or in_imgs:
-        seen = set()
-        merged = []
-        for x in ex_imgs + in_imgs:
-            if not x:
-                continue
-            if x in seen:
-                continue
-            seen.add(x)
-            merged.append(x)
-        out["images"] = merged
-
-    # params (dict)
-    ex_params = out.get("params") if isinstance(out.get("params"), dict) else {}
-    in_params = incoming.get("params") if isinstance(incoming.get("params"), dict) else {}
-    if ex_params or in_params:
-        merged_params = dict(ex_params)
-        for k, v in in_params.items():
-            if v is None:
-                continue
-            # detail-стадия имеет приоритет: если ключ уже есть, можно перезаписать
-            merged_params[k] = v
-        out["params"] = merged_params
-
-    # params_list (list)
-    ex_pl = out.get("params_list") if isinstance(out.get("params_list"), list) else []
-    in_pl = incoming.get("params_list") if isinstance(incoming.get("params_list"), list) else []
-    if ex_pl or in_pl:
-        seen = set()
-        merged = []
-        for x in ex_pl + in_pl:
-            if not x:
-                continue
-            if x in seen:
-                continue
-            seen.add(x)
-            merged.append(x)
-        out["params_list"] = merged
-
-    # остальные ключи
-    for k, v in incoming.items():
-        if k in {"images", "params", "params_list"}:
-            continue
-        if v is not None:
-            out[k] = v
-
-    return out
-
-
-class DatabasePipeline:
-    def __init__(self):
-        self.engine = create_engine(
-            get_connection_string(),
-            pool_size=5,
-            max_overflow=10,
-            pool_pre_ping=True,
-            pool_recycle=3600,
-        )
-        Base.metadata.create_all(self.engine)
-        self.session_factory = scoped_session(
-            sessionmaker(bind=self.engine, autocommit=False, autoflush=False)
-        )
-
-    @contextmanager
-    def session_scope(self):
-        session = self.session_factory()
-        try:
-            yield session
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            logger.exception("DB operation failed: %s", e)
-            raise
-        finally:
-            session.close()
-
-    def open_spider(self, spider):
-        """
-        Готовим подсказки для Spider:
-        - spider.db_urls: все url
-        - spider.db_need_detail_urls: url, где надо дозаполнить detail (нет description)
-        """
-        db_urls: Set[str] = set()
-        need_detail: Set[str] = set()
-
-        with self.session_scope() as session:
-            rows = session.query(PropertiesRaw.url, PropertiesRaw.description).all()
-            for url, desc in rows:
-                if not url:
-                    continue
-                db_urls.add(url)
-                if _is_blank(desc):
-                    need_detail.add(url)
-
-        spider.db_urls = db_urls
-        spider.db_need_detail_urls = need_detail
-
-        logger.info("Loaded %s urls from DB into spider.db_urls", len(db_urls))
-        logger.info("Need detail (missing description): %s", len(need_detail))
-
-    def process_item(self, item, spider):
-        a = ItemAdapter(item)
-
-        url = a.get("url") or a.get("link")
-        if not url:
-            logger.warning("Skip item: url is empty. Item=%s", dict(a))
-            return item
-
-        scraped_at = _parse_iso_dt(a.get("scraped_at") or a.get("parsed_at"))
-
-        incoming: Dict[str, Any] = {
-            "url": url,
-            "scraped_at": scraped_at,
-            "source_page": a.get("source_page"),
-            "title": a.get("title"),
-            "location": a.get("location"),
-            "price_raw": a.get("price_raw"),
-            "area_raw": a.get("area_raw"),
-            "object_id": a.get("object_id"),
-            "description": a.get("description"),
-            "features": a.get("features"),
-        }
-
-        new_desc = incoming.get("description")
-        new_features = incoming.get("features") if isinstance(incoming.get("features"), dict) else None
-        stage = None
-        if new_features:
-            stage = new_features.get("from")
-
-        logger.info(
-            "[pipeline] got item url=%s stage=%s desc_len=%s area_raw=%r",
-            url,
-            stage,
-            0 if not new_desc else len(str(new_desc)),
-            incoming.get("area_raw"),
-        )
-
-        with self.session_scope() as session:
-            existing = session.query(PropertiesRaw).filter(PropertiesRaw.url == url).one_or_none()
-
-            if not existing:
-                # INSERT (первая стадия или новый объект)
-                row = PropertiesRaw(
-                    url=url,
-                    source_page=incoming.get("source_page"),
-                    title=incoming.get("title"),
-                    location=incoming.get("location"),
-                    price_raw=incoming.get("price_raw"),
-                    area_raw=incoming.get("area_raw"),
-                    object_id=incoming.get("object_id"),
-                    description=incoming.get("description"),
-                    features=incoming.get("features"),
-                )
-                if scraped_at is not None:
-                    row.scraped_at = scraped_at
-                session.add(row)
-                session.flush()
-
-                spider.db_urls.add(url)
-                # если вставили без описания — попросим деталку
-                if _is_blank(incoming.get("description")):
-                    spider.db_need_detail_urls.add(url)
-
-                logger.info("[pipeline] inserted url=%s", url)
-                return item
-
-            # UPDATE (важно: работаем даже если нет UNIQUE на url)
-            changed = False
-
-            # source_page/title/location/price/object_id/area_raw — добиваем если пусто
-            for field in ["source_page", "title", "location", "price_raw", "object_id", "area_raw"]:
-                new_val = incoming.get(field)
-                old_val = getattr(existing, field)
-                if _is_blank(old_val) and not _is_blank(new_val):
-                    setattr(existing, field, new_val)
-                    changed = True
-
-            # description: детальная стадия имеет приоритет — обновляем, если incoming не пустой
-            if not _is_blank(new_desc):
-                if _is_blank(existing.description) or len(str(new_desc)) > len(str(existing.description or "")):
-                    existing.description = new_desc
-                    changed = True
-
-            # features: мерджим (и это должно поднять from -> detail, если пришла деталка)
-            merged = _merge_features(existing.features, incoming.get("features"))
-            if merged != existing.features:
-                existing.features = merged
-                changed = True
-
-            # scraped_at: можно хранить “последний парсинг”
-            if scraped_at is not None:
-                existing.scraped_at = scraped_at
-                changed = True
-
-            if changed:
-                session.add(existing)
-                session.flush()
-                logger.info("[pipeline] updated url=%s (fields merged/filled)", url)
-            else:
-                logger.info("[pipeline] no changes url=%s", url)
-
-            # обновим подсказки спайдеру на текущий ран
-            spider.db_urls.add(url)
-            if _is_blank(existing.description):
-                spider.db_need_detail_urls.add(url)
-            else:
-                if url in spider.db_need_detail_urls:
-                    spider.db_need_detail_urls.remove(url)
-
-        return item
-
-    def close_spider(self, spider):
-        self.session_factory.remove()
-        self.engine.dispose()
-        logger.info("Database connection closed")
+# Вариант-4
+
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from itemadapter import ItemAdapter
+from scrapy import signals
+
+from intermark_scraper.items import PropertyItem
+from intermark_scraper.locations import Gazetteer
+# get_connection_string/_merge_features исторически импортируются отсюда (скрипты, middlewares)
+from intermark_scraper.storage import (  # noqa: F401
+    Storage,
+    UpsertResult,
+    _is_blank,
+    _merge_features,
+    _parse_iso_dt,
+    get_connection_string,
+    open_storage,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DatabasePipeline:
+    def __init__(self, settings=None):
+        self.settings = settings
+        self.gazetteer = Gazetteer.from_settings(settings) if settings else Gazetteer.load()
+        # STORAGE_BACKEND: "postgres" (prod) или "sqlite" (локально, без внешних сервисов), см. storage.py
+        self.storage: Storage = open_storage(settings, self.gazetteer)
+        # item-ы копятся и уходят в storage.upsert_many пачкой (одна транзакция; новые url в Postgres — COPY):
+        # по PIPELINE_BATCH_SIZE штук или если первый item в буфере старше PIPELINE_FLUSH_INTERVAL секунд
+        self.batch_size = max(1, settings.getint("PIPELINE_BATCH_SIZE", 100)) if settings else 100
+        self.flush_interval = settings.getfloat("PIPELINE_FLUSH_INTERVAL", 5.0) if settings else 5.0
+        self._buffer: List[Dict[str, Any]] = []
+        self._buffer_started = 0.0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(crawler.settings)
+        # паук простаивает (ждёт рендер/ретраи) — не держим буфер до следующего item-а
+        crawler.signals.connect(pipeline._flush, signal=signals.spider_idle)
+        return pipeline
+
+    def open_spider(self, spider):
+        """
+        Готовим подсказки для Spider:
+        - spider.db_urls: все url
+        - spider.db_need_detail_urls: url, где надо дозаполнить detail (нет description или title)
+        - spider.entity_index: индекс сущностей для дедупликации между url (если есть у паука)
+        - spider.freshness: планировщик пересканирования известных url (или None)
+        """
+        entity_index = getattr(spider, "entity_index", None)
+        db_urls, need_detail = self.storage.load_hints(entity_index)
+
+        spider.freshness = self.storage.freshness
+
+        spider.db_urls = db_urls
+        spider.db_need_detail_urls = need_detail
+
+        logger.info("Loaded %s urls from DB into spider.db_urls", len(db_urls))
+        logger.info("Need detail (missing description/title): %s", len(need_detail))
+        if entity_index is not None:
+            logger.info("Entity index seeded: %s canonical urls", len(entity_index))
+
+    def process_item(self, item, spider):
+        started = time.perf_counter()
+        incoming = self._incoming(item)
+        if incoming is None:
+            return item
+        url = incoming["url"]
+
+        new_desc = incoming.get("description")
+        new_features = incoming.get("features") if isinstance(incoming.get("features"), dict) else None
+        stage = None
+        if new_features:
+            stage = new_features.get("from")
+
+        logger.info(
+            "[pipeline] got item url=%s stage=%s desc_len=%s area_raw=%r",
+            url,
+            stage,
+            0 if not new_desc else len(str(new_desc)),
+            incoming.get("area_raw"),
+        )
+
+        # подсказки пауку — сразу, не дожидаясь записи пачки: иначе до _flush url выглядит новым
+        # и паук ставит повторный detail. Мердж не стирает заполненные поля, поэтому строка полна,
+        # если полон item или url уже был в БД полным; _flush уточняет по фактическому результату
+        complete = not (_is_blank(new_desc) or _is_blank(incoming.get("title"))) or (
+            url in spider.db_urls and url not in spider.db_need_detail_urls
+        )
+        self._update_hints(spider, url, complete)
+
+        if not self._buffer:
+            self._buffer_started = started
+        self._buffer.append(incoming)
+        if len(self._buffer) >= self.batch_size or started - self._buffer_started >= self.flush_interval:
+            self._flush(spider)
+
+        return item
+
+    def _flush(self, spider) -> None:
+        """Пишет буфер одной пачкой и обновляет подсказки пауку по результатам."""
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        started = time.perf_counter()
+        try:
+            results = self.storage.upsert_many(batch)
+        except Exception:
+            # пачка откатилась целиком: пишем по одной, чтобы одна плохая строка не потянула остальные
+            logger.warning("[pipeline] batch of %s failed, retrying items one by one", len(batch))
+            results = [self._upsert_one(incoming) for incoming in batch]
+        # время пачки делим поровну: log_report.py считает длительность стадии pipeline на item
+        elapsed_ms = (time.perf_counter() - started) * 1000 / len(batch)
+
+        for incoming, result in zip(batch, results):
+            if result is None:
+                continue
+            url = incoming["url"]
+            timing = {"stage": "pipeline", "duration_ms": round(elapsed_ms, 2), "url": url}
+            if result.action == "inserted":
+                logger.info("[pipeline] inserted url=%s", url, extra=timing)
+            elif result.action == "updated":
+                logger.info("[pipeline] updated url=%s (fields merged/filled)", url, extra=timing)
+            else:
+                logger.info("[pipeline] no changes url=%s", url, extra=timing)
+
+            self._update_hints(spider, url, result.complete)
+
+    @staticmethod
+    def _update_hints(spider, url: str, complete: bool) -> None:
+        """Подсказки спайдеру на текущий ран: без описания/карточных полей — попросим деталку."""
+        spider.db_urls.add(url)
+        if complete:
+            spider.db_need_detail_urls.discard(url)
+        else:
+            spider.db_need_detail_urls.add(url)
+
+    def _upsert_one(self, incoming: Dict[str, Any]) -> Optional[UpsertResult]:
+        try:
+            return self.storage.upsert(incoming)
+        except Exception:
+            # storage уже залогировал исключение (session_scope / upsert_many)
+            logger.error("[pipeline] dropped url=%s", incoming["url"])
+            return None
+
+    @staticmethod
+    def _incoming(item) -> Optional[Dict[str, Any]]:
+        """
+        Поля item-а в виде dict для merge. PropertyItem (items.py) уже провалидирован и хранит
+        scraped_at как datetime — берём как есть; dict-ы (старые/сторонние) — через ItemAdapter.
+        """
+        if isinstance(item, PropertyItem):
+            return item.as_dict()
+
+        a = ItemAdapter(item)
+        url = a.get("url") or a.get("link")
+        if not url:
+            logger.warning("Skip item: url is empty. Item=%s", dict(a))
+            return None
+
+        return {
+            "url": url,
+            "scraped_at": _parse_iso_dt(a.get("scraped_at") or a.get("parsed_at")),
+            "source_page": a.get("source_page"),
+            "title": a.get("title"),
+            "location": a.get("location"),
+            "price_raw": a.get("price_raw"),
+            "area_raw": a.get("area_raw"),
+            "object_id": a.get("object_id"),
+            "description": a.get("description"),
+            "features": a.get("features"),
+        }
+
+    def close_spider(self, spider):
+        self._flush(spider)
+        self.storage.close()
+        logger.info("[pipeline] location cache: %s", self.gazetteer.cache_info())
+        logger.info("Database connection closed")
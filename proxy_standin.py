@@ -0,0 +1,163 @@
+"""
+Подставные HTTP-прокси для локальной проверки пула сессий (sessions.py / SessionPoolMiddleware).
+
+Каждый порт — отдельный "endpoint" со своей задержкой и долей блокировок (429):
+    python -m intermark_scraper.proxy_standin --ports 8891 8892 8893 --latency 0.1 0.5 1.5 --block-rate 0 0.1 0.6
+
+и краул через них:
+    scrapy crawl intermark_spain -s PROXY_POOL_ENABLED=True \\
+        -s PROXY_LIST=http://127.0.0.1:8891,http://127.0.0.1:8892,http://127.0.0.1:8893
+
+Умеет GET/HEAD через absolute-URI и CONNECT (https-туннель). С --echo в сеть не ходит:
+на любой GET отвечает маленькой HTML-страницей с номером порта (проверка без интернета).
+Итог по каждому порту (запросы/блокировки) печатается при Ctrl+C.
+"""
+
+import argparse
+import random
+import select
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+_HOP_HEADERS = {"connection", "keep-alive", "proxy-connection", "proxy-authorization", "transfer-encoding", "te", "upgrade"}
+
+
+class StandInProxy(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, latency: float, block_rate: float, echo: bool):
+        super().__init__(("127.0.0.1", port), StandInHandler)
+        self.latency = latency
+        self.block_rate = block_rate
+        self.echo = echo
+        self.counts: Dict[str, int] = {"requests": 0, "blocked": 0}
+        self._lock = threading.Lock()
+
+    def admit(self) -> bool:
+        """Задержка endpoint-а + решение "блокировать ли" (считается в counts)."""
+        time.sleep(self.latency * random.uniform(0.5, 1.5))
+        blocked = random.random() < self.block_rate
+        with self._lock:
+            self.counts["requests"] += 1
+            self.counts["blocked"] += int(blocked)
+        return not blocked
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server: StandInProxy
+
+    def _block(self) -> None:
+        self.send_response(429)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _relay(self) -> None:
+        if not self.server.admit():
+            self._block()
+            return
+
+        if self.server.echo:
+            body = f"<html><body><h1>stand-in {self.server.server_port}</h1>{self.path}</body></html>".encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+            return
+
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in _HOP_HEADERS}
+        try:
+            resp = urlopen(Request(self.path, headers=headers, method=self.command), timeout=30)
+        except HTTPError as e:
+            resp = e
+        body = resp.read()
+        self.send_response(resp.status if hasattr(resp, "status") else resp.code)
+        for k, v in resp.headers.items():
+            if k.lower() not in _HOP_HEADERS and k.lower() != "content-length":
+                self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_GET = _relay
+    do_HEAD = _relay
+
+    def do_CONNECT(self):
+        if not self.server.admit():
+            self._block()
+            return
+        host, _, port = self.path.partition(":")
+        try:
+            upstream = socket.create_connection((host, int(port or 443)), timeout=30)
+        except OSError:
+            self.send_error(502)
+            return
+        self.send_response(200, "Connection established")
+        self.end_headers()
+
+        sockets = [self.connection, upstream]
+        try:
+            while True:
+                readable, _, errored = select.select(sockets, [], sockets, 60)
+                if errored or not readable:
+                    break
+                for sock in readable:
+                    data = sock.recv(65536)
+                    if not data:
+                        return
+                    (upstream if sock is self.connection else self.connection).sendall(data)
+        finally:
+            upstream.close()
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def _per_port(values, n: int, name: str):
+    if len(values) == 1:
+        return values * n
+    if len(values) != n:
+        raise SystemExit(f"--{name}: нужно 1 значение или по одному на порт ({n})")
+    return values
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Подставные прокси для проверки пула сессий")
+    parser.add_argument("--ports", type=int, nargs="+", default=[8891, 8892, 8893])
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.2], help="секунды, на порт или одна на все")
+    parser.add_argument("--block-rate", type=float, nargs="+", default=[0.0], help="доля ответов 429")
+    parser.add_argument("--echo", action="store_true", help="не ходить в сеть, отвечать заглушкой")
+    args = parser.parse_args()
+
+    n = len(args.ports)
+    servers = [
+        StandInProxy(port, latency, block_rate, args.echo)
+        for port, latency, block_rate in zip(
+            args.ports, _per_port(args.latency, n, "latency"), _per_port(args.block_rate, n, "block-rate")
+        )
+    ]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"stand-in proxy :{server.server_port} latency={server.latency}s block_rate={server.block_rate}")
+    print("PROXY_LIST=" + ",".join(f"http://127.0.0.1:{s.server_port}" for s in servers))
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            print(f":{server.server_port} {server.counts}")
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
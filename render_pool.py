@@ -0,0 +1,226 @@
+"""
+Рендер многими вкладками в одном headless Chromium (RENDER_BACKEND = "tabs").
+
+Вместо отдельного Chrome на каждый параллельный рендер:
+- один процесс браузера (Playwright, async API), каждая "вкладка" — отдельный BrowserContext
+  (свои cookies/storage, изоляция как у отдельного браузера, но без нового процесса)
+- число вкладок ограничено RENDER_MAX_TABS и доступной памятью (MemAvailable / RENDER_TAB_BUDGET_MB)
+- вкладка пересоздаётся после RENDER_PAGES_PER_TAB страниц, чтобы не копила память
+- с пулом сессий (sessions.py) контекст вкладки открывается с прокси и User-Agent сессии запроса;
+  вкладка чужой сессии пересоздаётся под нужную
+- recycle() перезапускает весь браузер (MemoryGuard, MEMGUARD_BROWSER_RECYCLE_MB): новые рендеры ждут,
+  пока закончатся текущие, браузер закрывается и поднимается заново при следующем рендере
+
+Playwright — необязательная зависимость, импортируется только при первом рендере.
+"""
+
+import asyncio
+import logging
+from typing import List, Optional
+
+from intermark_scraper.browser import CHROME_ARGS
+
+logger = logging.getLogger(__name__)
+
+
+def available_memory_mb() -> Optional[int]:
+    """MemAvailable из /proc/meminfo (Linux); None, если узнать нельзя."""
+    try:
+        with open("/proc/meminfo", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def tabs_for_memory(max_tabs: int, tab_budget_mb: int, reserve_mb: int = 512) -> int:
+    avail = available_memory_mb()
+    if avail is None:
+        return max_tabs
+    return max(1, min(max_tabs, (avail - reserve_mb) // max(tab_budget_mb, 1)))
+
+
+class _Tab:
+    def __init__(self, context, page, session=None):
+        self.context = context
+        self.page = page
+        self.session = session
+        self.pages_done = 0
+
+    @property
+    def session_key(self) -> Optional[str]:
+        return self.session.key if self.session is not None else None
+
+
+class TabPool:
+    def __init__(self, max_tabs: int = 4, pages_per_tab: int = 50, tab_budget_mb: int = 80):
+        self.max_tabs = tabs_for_memory(max_tabs, tab_budget_mb)
+        self.pages_per_tab = pages_per_tab
+        self._playwright = None
+        self._browser = None
+        self._start_lock = asyncio.Lock()
+        self._free: Optional[asyncio.Queue] = None
+        self._created = 0
+        self._all: List[_Tab] = []
+        # мягкий лимит одновременных рендеров (<= max_tabs), его двигает AdaptiveConcurrency
+        self.limit = self.max_tabs
+        self._in_use = 0
+        self._slots = asyncio.Condition()
+        self.recycling = False
+        logger.info("[tabs] max_tabs=%s (budget %s MB/tab)", self.max_tabs, tab_budget_mb)
+
+    async def _ensure_browser(self) -> None:
+        async with self._start_lock:
+            if self._browser is not None:
+                return
+            from playwright.async_api import async_playwright
+
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=True, args=list(CHROME_ARGS[1:]))
+            self._free = asyncio.Queue()
+            logger.info("[tabs] browser started")
+
+    async def _new_tab(self, session=None) -> _Tab:
+        options = {"locale": "ru-RU", "viewport": {"width": 1600, "height": 900}}
+        if session is not None:
+            options["user_agent"] = session.user_agent
+            proxy = session.browser_proxy()
+            if proxy:
+                options["proxy"] = proxy
+        context = await self._browser.new_context(**options)
+        page = await context.new_page()
+        tab = _Tab(context, page, session)
+        self._all.append(tab)
+        return tab
+
+    def set_limit(self, limit: int) -> None:
+        self.limit = max(1, min(int(limit), self.max_tabs))
+
+    async def _acquire(self, session=None) -> _Tab:
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._in_use < self.limit and not self.recycling)
+            self._in_use += 1
+        new_tab = False  # True — под эту вкладку уже занят _created, при ошибке его надо вернуть
+        try:
+            await self._ensure_browser()
+            if self._free.empty() and self._created < self.max_tabs:
+                self._created += 1
+                new_tab = True
+                return await self._new_tab(session)
+            tab = None
+            while tab is None:
+                tab = await self._free.get()
+                # None — метка потерянной вкладки (_lose_tab): на её место можно создать новую
+                if tab is None and self._created < self.max_tabs:
+                    self._created += 1
+                    new_tab = True
+                    return await self._new_tab(session)
+            if session is not None and tab.session_key != session.key:
+                new_tab = True
+                await self._discard(tab)
+                tab = await self._new_tab(session)
+            return tab
+        except BaseException:
+            if new_tab:
+                self._lose_tab()
+            await self._free_slot()
+            raise
+
+    async def _release(self, tab: _Tab) -> None:
+        tab.pages_done += 1
+        try:
+            if tab.pages_done >= self.pages_per_tab:
+                # пересоздаём контекст: память вкладки освобождается целиком
+                await self._discard(tab)
+                try:
+                    tab = await self._new_tab(tab.session)
+                except Exception as e:
+                    logger.warning("[tabs] tab re-create failed: %s", e)
+                    self._lose_tab()
+                    return
+            self._free.put_nowait(tab)
+        finally:
+            await self._free_slot()
+
+    async def _discard(self, tab: _Tab) -> None:
+        self._all.remove(tab)
+        try:
+            await tab.context.close()
+        except Exception as e:
+            logger.warning("[tabs] context close error: %s", e)
+
+    def _lose_tab(self) -> None:
+        """Вкладку не удалось (пере)создать: освобождаем её место в max_tabs и будим ждущего в _free.get()."""
+        self._created -= 1
+        self._free.put_nowait(None)
+
+    async def _free_slot(self) -> None:
+        async with self._slots:
+            self._in_use -= 1
+            self._slots.notify_all()
+
+    async def render_listing(self, url: str, max_scrolls: int = 4, session=None) -> str:
+        """Как IntermarkSpainSpider._get_selenium_listing_response: ждём карточки, скроллим до стабилизации."""
+        tab = await self._acquire(session)
+        try:
+            page = tab.page
+            await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+            try:
+                await page.wait_for_selector("div.object-card", timeout=15000)
+            except Exception:
+                logger.info("[tabs] no object-card found (timeout) on %s", url)
+
+            prev_cnt = -1
+            for _ in range(max_scrolls):
+                await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+                await asyncio.sleep(0.7)
+                cards_cnt = await page.locator("div.object-card").count()
+                if cards_cnt == prev_cnt:
+                    break
+                prev_cnt = cards_cnt
+            return await page.content()
+        finally:
+            await self._release(tab)
+
+    async def render_detail(self, url: str, session=None) -> str:
+        tab = await self._acquire(session)
+        try:
+            page = tab.page
+            await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+            await asyncio.sleep(1.2)  # небольшая пауза на догрузку текста
+            return await page.content()
+        finally:
+            await self._release(tab)
+
+    async def recycle(self) -> None:
+        """Перезапуск браузера: ждём окончания текущих рендеров, закрываем всё; следующий _acquire поднимет новый."""
+        if self.recycling:
+            return
+        async with self._slots:
+            self.recycling = True
+            try:
+                await self._slots.wait_for(lambda: self._in_use == 0)
+                await self.close()
+                self._free = None
+                self._created = 0
+            finally:
+                self.recycling = False
+                self._slots.notify_all()
+        logger.info("[tabs] browser recycled")
+
+    async def close(self) -> None:
+        for tab in self._all:
+            try:
+                await tab.context.close()
+            except Exception as e:
+                logger.warning("[tabs] context close error: %s", e)
+        self._all.clear()
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+        logger.info("[tabs] browser closed")
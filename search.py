@@ -0,0 +1,97 @@
+"""
+Поиск по объявлениям без seq scan.
+
+- полнотекстовый: properties_raw.search_tsv (generated, russian) + GIN,
+  ранжирование ts_rank_cd, keyset-пагинация по (rank, id)
+- нечёткий по title/location: pg_trgm GIN-индексы (similarity, а также ILIKE '%...%')
+
+Схема (колонка, расширение, индексы) создаётся только migrate_search.py (ensure_search_schema):
+CREATE EXTENSION требует прав владельца, ADD COLUMN ... STORED переписывает таблицу под
+ACCESS EXCLUSIVE — не для старта краулера. PostgresStorage лишь проверяет has_search_schema().
+В ORM (models.PropertiesRaw) search_tsv не мапится.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+_TABLE = "intermark.properties_raw"
+
+SEARCH_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"ALTER TABLE {_TABLE} ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('russian'::regconfig, coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('russian'::regconfig, left(coalesce(description, ''), 100000)), 'B')"
+    ") STORED",
+)
+
+# CONCURRENTLY: без блокировки записи; нельзя внутри транзакции — выполняется в AUTOCOMMIT
+SEARCH_INDEXES = (
+    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_properties_raw_search_tsv ON {_TABLE} USING gin (search_tsv)",
+    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_properties_raw_title_trgm ON {_TABLE} USING gin (title gin_trgm_ops)",
+    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_properties_raw_location_trgm "
+    f"ON {_TABLE} USING gin (location gin_trgm_ops)",
+)
+
+
+def ensure_search_schema(engine) -> None:
+    """DDL поиска (migrate_search.py)."""
+    with engine.begin() as conn:
+        for ddl in SEARCH_DDL:
+            conn.execute(text(ddl))
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        for ddl in SEARCH_INDEXES:
+            conn.execute(text(ddl))
+
+
+def has_search_schema(engine) -> bool:
+    """Есть ли search_tsv (дешёвая проверка каталога при старте, без DDL)."""
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_schema = 'intermark' AND table_name = 'properties_raw' AND column_name = 'search_tsv'"
+        )).first() is not None
+
+
+def search(
+    session,
+    query: str,
+    limit: int = 20,
+    after: Optional[Tuple[float, int]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[Tuple[float, int]]]:
+    """
+    Полнотекстовый поиск (websearch-синтаксис: "слова в кавычках", -исключить, or).
+    Возвращает (rows, cursor); cursor передаётся в after для следующей страницы, None — страниц больше нет.
+    """
+    params: Dict[str, Any] = {"q": query, "limit": limit}
+    keyset = ""
+    if after is not None:
+        keyset = "WHERE (rank, id) < (:after_rank, :after_id)"
+        params["after_rank"], params["after_id"] = after
+
+    rows = session.execute(text(
+        "SELECT id, url, title, location, price_raw, rank FROM ("
+        "  SELECT id, url, title, location, price_raw,"
+        "         ts_rank_cd(search_tsv, websearch_to_tsquery('russian', :q))::float8 AS rank"
+        f"  FROM {_TABLE}"
+        "  WHERE search_tsv @@ websearch_to_tsquery('russian', :q)"
+        f") s {keyset} "
+        "ORDER BY rank DESC, id DESC LIMIT :limit"
+    ), params).mappings().all()
+
+    result = [dict(r) for r in rows]
+    cursor = (result[-1]["rank"], result[-1]["id"]) if len(result) == limit else None
+    return result, cursor
+
+
+def search_fuzzy(session, query: str, limit: int = 20, min_similarity: float = 0.3) -> List[Dict[str, Any]]:
+    """Нечёткий поиск по title/location (опечатки, части слов) через pg_trgm."""
+    rows = session.execute(text(
+        "SELECT id, url, title, location, price_raw,"
+        "       greatest(similarity(title, :q), similarity(location, :q)) AS score"
+        f" FROM {_TABLE}"
+        " WHERE title % :q OR location % :q"
+        " ORDER BY score DESC, id DESC LIMIT :limit"
+    ), {"q": query, "limit": limit}).mappings().all()
+    return [dict(r) for r in rows if r["score"] >= min_similarity]
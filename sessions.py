@@ -0,0 +1,162 @@
+"""
+Пул сессий (прокси + User-Agent + cookie jar) с оценкой здоровья каждого endpoint-а.
+
+Весь трафик раньше шёл с одного IP, и любое ускорение упиралось в 403/429 и backoff SmartRetryMiddleware.
+Сессия = endpoint (PROXY_LIST; "direct" — без прокси) + закреплённый за ним User-Agent + свой cookie jar
+(meta["cookiejar"] штатного CookiesMiddleware). Для каждой сессии:
+- EWMA латентности и доли блокировок (PROXY_BLOCK_CODES, сетевые ошибки)
+- score = (1 - block_rate) / (1 + latency / PROXY_TARGET_LATENCY); запрос получает сессию
+  случайно с весом score — хорошие endpoint-ы нагружаются сильнее, плохие не выпадают навсегда
+- лимит частоты PROXY_RATE_PER_SEC на endpoint; после блокировки — cooldown, растущий экспоненциально
+
+Те же сессии использует рендер: TabPool открывает контекст браузера с прокси и User-Agent сессии,
+Selenium-драйвер стартует через сессию, выбранную pick_for_browser().
+Локальная проверка — proxy_standin.py (подставные прокси с задержкой и блокировками).
+"""
+
+import random
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse, urlunparse
+
+DEFAULT_USER_AGENTS = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+)
+DIRECT = "direct"
+_ALPHA = 0.2
+
+
+class Session:
+    def __init__(self, key: str, proxy: Optional[str], user_agent: str, min_interval: float):
+        self.key = key                  # "host:port" без логина/пароля или "direct" — для stats и cookiejar
+        self.proxy = proxy              # url для meta["proxy"] (с логином/паролем, если есть)
+        self.user_agent = user_agent
+        self.min_interval = min_interval
+        self.latency = 0.0              # EWMA, секунды
+        self.block_rate = 0.0           # EWMA доли блокировок/ошибок
+        self.next_allowed = 0.0         # monotonic: раньше этого момента запрос не отдаём
+        self.cooldown_until = 0.0
+        self.consecutive_blocks = 0
+        self.requests = 0
+        self.blocks = 0
+
+    def score(self, target_latency: float) -> float:
+        return max(1.0 - self.block_rate, 0.01) / (1.0 + self.latency / max(target_latency, 0.01))
+
+    def ready_at(self) -> float:
+        return max(self.next_allowed, self.cooldown_until)
+
+    def browser_proxy(self) -> Optional[Dict[str, str]]:
+        """Прокси в формате Playwright (server без логина/пароля + отдельные поля)."""
+        if not self.proxy:
+            return None
+        u = urlparse(self.proxy)
+        out = {"server": urlunparse((u.scheme, f"{u.hostname}:{u.port}" if u.port else u.hostname, "", "", "", ""))}
+        if u.username:
+            out["username"] = u.username
+            out["password"] = u.password or ""
+        return out
+
+
+def _session_key(proxy: Optional[str]) -> str:
+    if not proxy:
+        return DIRECT
+    u = urlparse(proxy)
+    return f"{u.hostname}:{u.port}" if u.port else str(u.hostname)
+
+
+class SessionPool:
+    def __init__(
+        self,
+        proxies: List[Optional[str]],
+        user_agents=DEFAULT_USER_AGENTS,
+        rate_per_sec: float = 1.0,
+        target_latency: float = 2.0,
+        cooldown: float = 30.0,
+        max_cooldown: float = 600.0,
+    ):
+        min_interval = 1.0 / rate_per_sec if rate_per_sec > 0 else 0.0
+        # User-Agent закрепляется за endpoint-ом: один "браузер" на один IP
+        self.sessions: List[Session] = [
+            Session(_session_key(proxy), proxy or None, user_agents[i % len(user_agents)], min_interval)
+            for i, proxy in enumerate(proxies or [None])
+        ]
+        self.by_key: Dict[str, Session] = {s.key: s for s in self.sessions}
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+    @classmethod
+    def from_settings(cls, settings) -> "SessionPool":
+        proxies: List[Optional[str]] = list(settings.getlist("PROXY_LIST"))
+        proxy_file = settings.get("PROXY_LIST_FILE")
+        if proxy_file:
+            with open(proxy_file, encoding="utf-8") as f:
+                proxies += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        proxies = [None if p == DIRECT else p for p in proxies]
+        if settings.getbool("PROXY_INCLUDE_DIRECT", False) and None not in proxies:
+            proxies.append(None)
+        return cls(
+            proxies,
+            user_agents=settings.getlist("SESSION_USER_AGENTS") or DEFAULT_USER_AGENTS,
+            rate_per_sec=settings.getfloat("PROXY_RATE_PER_SEC", 1.0),
+            target_latency=settings.getfloat("PROXY_TARGET_LATENCY", 2.0),
+            cooldown=settings.getfloat("PROXY_COOLDOWN", 30.0),
+            max_cooldown=settings.getfloat("PROXY_MAX_COOLDOWN", 600.0),
+        )
+
+    def acquire(self, now: Optional[float] = None, exclude: Optional[str] = None):
+        """
+        (session, wait_seconds): сессия, готовая сейчас (выбор с весом score), иначе —
+        та, что освободится раньше всех, и сколько её ждать. exclude — не брать (например, только что заблокированную).
+        """
+        now = time.monotonic() if now is None else now
+        candidates = [s for s in self.sessions if s.key != exclude] or self.sessions
+        ready = [s for s in candidates if s.ready_at() <= now]
+        if ready:
+            session = random.choices(ready, weights=[s.score(self.target_latency) for s in ready])[0]
+            wait = 0.0
+        else:
+            session = min(candidates, key=Session.ready_at)
+            wait = session.ready_at() - now
+        session.next_allowed = max(now + wait, session.next_allowed) + session.min_interval
+        session.requests += 1
+        return session, wait
+
+    def pick_for_browser(self) -> Session:
+        """Сессия для долгоживущего браузера (Selenium): лучшая по score среди не заблокированных."""
+        now = time.monotonic()
+        healthy = [s for s in self.sessions if s.cooldown_until <= now] or self.sessions
+        return max(healthy, key=lambda s: s.score(self.target_latency))
+
+    def record(self, session: Session, latency: Optional[float], blocked: bool, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        if latency is not None:
+            session.latency = latency if session.latency == 0.0 else (1 - _ALPHA) * session.latency + _ALPHA * latency
+        session.block_rate = (1 - _ALPHA) * session.block_rate + _ALPHA * (1.0 if blocked else 0.0)
+        if blocked:
+            session.blocks += 1
+            session.consecutive_blocks += 1
+            backoff = self.cooldown * 2 ** min(session.consecutive_blocks - 1, 10)
+            session.cooldown_until = now + min(backoff, self.max_cooldown)
+        else:
+            session.consecutive_blocks = 0
+
+    def healthy_count(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        return sum(1 for s in self.sessions if s.cooldown_until <= now)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        return {
+            s.key: {
+                "requests": s.requests,
+                "blocks": s.blocks,
+                "latency_s": round(s.latency, 3),
+                "block_rate": round(s.block_rate, 3),
+                "score": round(s.score(self.target_latency), 3),
+            }
+            for s in self.sessions
+        }
@@ -1,147 +1,287 @@
-# Scrapy settings for intermark_scraper project
-#
-# For simplicity, this file contains only settings considered important or
-# commonly used. You can find more settings consulting the documentation:
-#
-#     https://docs.scrapy.org/en/latest/topics/settings.html
-#     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-
-BOT_NAME = "intermark_scraper"
-
-SPIDER_MODULES = ["intermark_scraper.spiders"]
-NEWSPIDER_MODULE = "intermark_scraper.spiders"
-
-ADDONS = {}
-
-
-# Crawl responsibly by identifying yourself (and your website) on the user-agent
-#USER_AGENT = "intermark_scraper (+http://www.yourdomain.com)"
-
-# Obey robots.txt rules
-ROBOTSTXT_OBEY = True
-
-# Concurrency and throttling settings
-#CONCURRENT_REQUESTS = 16
-CONCURRENT_REQUESTS_PER_DOMAIN = 1
-DOWNLOAD_DELAY = 1
-
-# Disable cookies (enabled by default)
-#COOKIES_ENABLED = False
-
-# Disable Telnet Console (enabled by default)
-#TELNETCONSOLE_ENABLED = False
-
-# Override the default request headers:
-#DEFAULT_REQUEST_HEADERS = {
-#    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-#    "Accept-Language": "en",
-#}
-
-# Enable or disable spider middlewares
-# See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    "intermark_scraper.middlewares.IntermarkScraperSpiderMiddleware": 543,
-#}
-
-# Enable or disable downloader middlewares
-# See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "intermark_scraper.middlewares.IntermarkScraperDownloaderMiddleware": 543,
-#}
-
-# Enable or disable extensions
-# See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
-
-# Configure item pipelines
-# See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "intermark_scraper.pipelines.IntermarkScraperPipeline": 300,
-#}
-
-# Enable and configure the AutoThrottle extension (disabled by default)
-# See https://docs.scrapy.org/en/latest/topics/autothrottle.html
-#AUTOTHROTTLE_ENABLED = True
-# The initial download delay
-#AUTOTHROTTLE_START_DELAY = 5
-# The maximum download delay to be set in case of high latencies
-#AUTOTHROTTLE_MAX_DELAY = 60
-# The average number of requests Scrapy should be sending in parallel to
-# each remote server
-#AUTOTHROTTLE_TARGET_CONCURRENCY = 1.0
-# Enable showing throttling stats for every response received:
-#AUTOTHROTTLE_DEBUG = False
-
-# Enable and configure HTTP caching (disabled by default)
-# See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-#HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = "httpcache"
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
-
-# Set settings whose default value is deprecated to a future-proof value
-FEED_EXPORT_ENCODING = "utf-8"
-
-################################
-
-SPIDER_MODULES = ["intermark_scraper.spiders"]
-NEWSPIDER_MODULE = "intermark_scraper.spiders"
-
-LOG_LEVEL = "INFO"
-LOGSTATS_INTERVAL = 30
-
-DOWNLOAD_TIMEOUT = 30
-RETRY_TIMES = 5
-
-AUTOTHROTTLE_ENABLED = True
-AUTOTHROTTLE_START_DELAY = 1.0
-AUTOTHROTTLE_MAX_DELAY = 10.0
-
-# включим свои мидлвари (добавим позже)
-
-# DOWNLOADER_MIDDLEWARES = {
-#     "intermark_scraper.middlewares.RotateUserAgentMiddleware": 400,
-#     "intermark_scraper.middlewares.SmartRetryMiddleware": 550,
-#     "scrapy.downloadermiddlewares.retry.RetryMiddleware": None,
-# }
-
-DOWNLOADER_MIDDLEWARES = {
-    "scrapy.downloadermiddlewares.useragent.UserAgentMiddleware": None,
-    "intermark_scraper.middlewares.RotateUserAgentMiddleware": 400,
-
-    "scrapy.downloadermiddlewares.retry.RetryMiddleware": None,
-    "intermark_scraper.middlewares.SmartRetryMiddleware": 550,
-}
-
-
-
-ITEM_PIPELINES = {
-    "intermark_scraper.pipelines.DatabasePipeline": 300,
-}
-
-
-LOG_FORMAT = "%(asctime)s [%(name)s] %(levelname)s: %(message)s"
-LOG_FILE = "scrapy.log"
-
-
-CONCURRENT_REQUESTS = 1
-CONCURRENT_REQUESTS_PER_DOMAIN = 1
-
-HTTPERROR_ALLOWED_CODES = [404, 500, 502, 503]
-
-RETRY_ENABLED = True
-#DOWNLOAD_DELAY = 0.5
-RANDOMIZE_DOWNLOAD_DELAY = True
-
-#AUTOTHROTTLE_START_DELAY = 0.5
-AUTOTHROTTLE_TARGET_CONCURRENCY = 1.0
-
-LOG_FILE = "logs/scrapy_run.log"
-LOG_LEVEL = "INFO"
-
-
-
+# Scrapy settings for intermark_scraper project
+#
+# For simplicity, this file contains only settings considered important or
+# commonly used. You can find more settings consulting the documentation:
+#
+#     https://docs.scrapy.org/en/latest/topics/settings.html
+#     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
+#     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
+
+BOT_NAME = "intermark_scraper"
+
+SPIDER_MODULES = ["intermark_scraper.spiders"]
+NEWSPIDER_MODULE = "intermark_scraper.spiders"
+
+ADDONS = {}
+
+
+# Crawl responsibly by identifying yourself (and your website) on the user-agent
+#USER_AGENT = "intermark_scraper (+http://www.yourdomain.com)"
+
+# Obey robots.txt rules
+ROBOTSTXT_OBEY = True
+
+# Concurrency and throttling settings
+#CONCURRENT_REQUESTS = 16
+CONCURRENT_REQUESTS_PER_DOMAIN = 1
+DOWNLOAD_DELAY = 1
+
+# Disable cookies (enabled by default)
+#COOKIES_ENABLED = False
+
+# Disable Telnet Console (enabled by default)
+#TELNETCONSOLE_ENABLED = False
+
+# Override the default request headers:
+#DEFAULT_REQUEST_HEADERS = {
+#    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+#    "Accept-Language": "en",
+#}
+
+# Enable or disable spider middlewares
+# See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
+#SPIDER_MIDDLEWARES = {
+#    "intermark_scraper.middlewares.IntermarkScraperSpiderMiddleware": 543,
+#}
+
+# Enable or disable downloader middlewares
+# See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
+#DOWNLOADER_MIDDLEWARES = {
+#    "intermark_scraper.middlewares.IntermarkScraperDownloaderMiddleware": 543,
+#}
+
+# Enable or disable extensions
+# See https://docs.scrapy.org/en/latest/topics/extensions.html
+#EXTENSIONS = {
+#    "scrapy.extensions.telnet.TelnetConsole": None,
+#}
+
+# Configure item pipelines
+# See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+#ITEM_PIPELINES = {
+#    "intermark_scraper.pipelines.IntermarkScraperPipeline": 300,
+#}
+
+# Enable and configure the AutoThrottle extension (disabled by default)
+# See https://docs.scrapy.org/en/latest/topics/autothrottle.html
+#AUTOTHROTTLE_ENABLED = True
+# The initial download delay
+#AUTOTHROTTLE_START_DELAY = 5
+# The maximum download delay to be set in case of high latencies
+#AUTOTHROTTLE_MAX_DELAY = 60
+# The average number of requests Scrapy should be sending in parallel to
+# each remote server
+#AUTOTHROTTLE_TARGET_CONCURRENCY = 1.0
+# Enable showing throttling stats for every response received:
+#AUTOTHROTTLE_DEBUG = False
+
+# Enable and configure HTTP caching (disabled by default)
+# See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
+#HTTPCACHE_ENABLED = True
+#HTTPCACHE_EXPIRATION_SECS = 0
+#HTTPCACHE_DIR = "httpcache"
+#HTTPCACHE_IGNORE_HTTP_CODES = []
+#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+
+# Set settings whose default value is deprecated to a future-proof value
+FEED_EXPORT_ENCODING = "utf-8"
+
+################################
+
+SPIDER_MODULES = ["intermark_scraper.spiders"]
+NEWSPIDER_MODULE = "intermark_scraper.spiders"
+
+LOG_LEVEL = "INFO"
+LOGSTATS_INTERVAL = 30
+
+DOWNLOAD_TIMEOUT = 30
+RETRY_TIMES = 5
+
+AUTOTHROTTLE_ENABLED = True
+AUTOTHROTTLE_START_DELAY = 1.0
+AUTOTHROTTLE_MAX_DELAY = 10.0
+
+# включим свои мидлвари (добавим позже)
+
+# DOWNLOADER_MIDDLEWARES = {
+#     "intermark_scraper.middlewares.RotateUserAgentMiddleware": 400,
+#     "intermark_scraper.middlewares.SmartRetryMiddleware": 550,
+#     "scrapy.downloadermiddlewares.retry.RetryMiddleware": None,
+# }
+
+DOWNLOADER_MIDDLEWARES = {
+    "scrapy.downloadermiddlewares.useragent.UserAgentMiddleware": None,
+    "intermark_scraper.middlewares.RotateUserAgentMiddleware": 400,
+
+    "scrapy.downloadermiddlewares.retry.RetryMiddleware": None,
+    "intermark_scraper.middlewares.SmartRetryMiddleware": 550,
+
+    # включается PROXY_POOL_ENABLED; после SmartRetry по process_response — видит 403/429 раньше ретрая
+    "intermark_scraper.middlewares.SessionPoolMiddleware": 560,
+
+    # включается только при RENDER_BACKEND = "tabs"
+    "intermark_scraper.middlewares.TabRenderMiddleware": 950,
+}
+
+# Пул сессий: прокси + User-Agent + cookie jar на endpoint, оценка здоровья (см. sessions.py).
+# PROXY_LIST — url прокси ("direct" — без прокси); локальная проверка — proxy_standin.py
+PROXY_POOL_ENABLED = False
+PROXY_LIST = []
+PROXY_LIST_FILE = None
+PROXY_INCLUDE_DIRECT = False
+PROXY_RATE_PER_SEC = 1.0
+PROXY_TARGET_LATENCY = 2.0
+PROXY_COOLDOWN = 30.0
+PROXY_MAX_COOLDOWN = 600.0
+PROXY_BLOCK_CODES = [403, 429]
+
+# Рендер: "selenium" (один Chrome, синхронно в пауке) или "tabs" (вкладки одного Chromium, Playwright)
+RENDER_BACKEND = "selenium"
+RENDER_MAX_TABS = 4
+RENDER_PAGES_PER_TAB = 50
+RENDER_TAB_BUDGET_MB = 80
+TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
+
+# Адаптивная параллельность (AIMD, см. extensions.AdaptiveConcurrency).
+# При включении CONCURRENT_REQUESTS/-_PER_DOMAIN — только стартовые значения, дальше их двигает контроллер;
+# задержка слота = DOWNLOAD_DELAY / concurrency, AutoThrottle паук выключает.
+ADAPTIVE_CONCURRENCY_ENABLED = False
+ADAPTIVE_INTERVAL = 10.0
+ADAPTIVE_HTTP_MIN = 1
+ADAPTIVE_HTTP_MAX = 8
+ADAPTIVE_RENDER_MIN = 1
+ADAPTIVE_RENDER_MAX = 4
+ADAPTIVE_TARGET_LATENCY = 2.0
+ADAPTIVE_RENDER_TARGET_LATENCY = 8.0
+ADAPTIVE_MAX_ERROR_RATE = 0.05
+
+# Диагностика памяти и защита от OOM (см. extensions.MemoryGuard); 0 — порог выключен
+MEMGUARD_ENABLED = False
+MEMGUARD_INTERVAL = 30.0
+MEMGUARD_TRACEMALLOC = False
+MEMGUARD_TRACEMALLOC_TOP = 10
+MEMGUARD_BROWSER_RECYCLE_MB = 0
+MEMGUARD_PAUSE_MB = 0
+MEMGUARD_MAX_PAUSE = 120.0
+
+EXTENSIONS = {
+    "intermark_scraper.extensions.AdaptiveConcurrency": 500,
+    "intermark_scraper.extensions.MemoryGuard": 510,
+    "intermark_scraper.logging_setup.AsyncLogging": 0,
+}
+
+
+
+SPIDER_MIDDLEWARES = {
+    "intermark_scraper.middlewares.ItemCoalescerMiddleware": 100,
+}
+
+# listing + detail одного url -> один item (см. middlewares.ItemCoalescerMiddleware)
+COALESCE_ENABLED = True
+COALESCE_TIMEOUT = 300.0
+COALESCE_MAX_PENDING = 1000
+
+ITEM_PIPELINES = {
+    "intermark_scraper.images.ImageMetadataPipeline": 250,
+    "intermark_scraper.pipelines.DatabasePipeline": 300,
+}
+
+# Метаданные картинок (см. images.py; нужен Pillow). Выключено по умолчанию.
+IMAGES_META_ENABLED = False
+IMAGES_META_STORE = "images_store"
+IMAGES_META_CONCURRENCY = 4
+IMAGES_META_MAX_BYTES = 5 * 1024 * 1024
+IMAGES_META_PHASH_DISTANCE = 3
+DOWNLOAD_SLOTS = {
+    "images": {"concurrency": 4, "delay": 0.0, "randomize_delay": False},
+}
+
+# Хранилище сырого слоя: "table" (properties_raw) или "snapshots" (секции по ранам, см. snapshots.py)
+RAW_STORAGE_LAYOUT = "table"
+RAW_SNAPSHOT_KEEP_RUNS = 5
+
+# Бэкенд DatabasePipeline (см. storage.py): "postgres" или "sqlite" (локальный файл, без внешних сервисов)
+STORAGE_BACKEND = "postgres"
+STORAGE_DSN = None  # None — из .env (get_connection_string)
+STORAGE_SQLITE_PATH = "data/intermark.sqlite3"
+# DatabasePipeline пишет item-ы пачками (upsert_many): размер пачки и максимум секунд ожидания первого item-а
+PIPELINE_BATCH_SIZE = 100
+PIPELINE_FLUSH_INTERVAL = 5.0
+
+# chromedriver: кеш пути (см. browser.py) и закреплённая версия (None — не проверять версию)
+CHROMEDRIVER_CACHE = ".chromedriver.json"
+CHROMEDRIVER_VERSION = None
+
+# Discovery listing-а: "render" (браузер) или "http" (обычный Scrapy HTTP -> sitemap.xml -> рендер).
+# В "http" первая страница сверяется с рендером; при расхождении ран переключается на рендер.
+DISCOVERY_MODE = "render"
+DISCOVERY_VERIFY = True
+DISCOVERY_MIN_OVERLAP = 0.9
+DISCOVERY_SITEMAP_URL = "/sitemap.xml"
+DISCOVERY_SITEMAP_PATTERN = r"/objects/ispaniya-"
+
+# Пересканирование известных объектов по свежести (см. freshness.py)
+FRESHNESS_ENABLED = True
+FRESHNESS_DETAIL_BUDGET = 50
+FRESHNESS_MIN_INTERVAL_H = 24.0
+FRESHNESS_MAX_INTERVAL_H = 720.0
+
+# Не ходить в detail, если объект уже известен под другим url (см. dedupe.py);
+# False — индекс сущностей (MinHash описаний) не строится вовсе
+DEDUPE_SKIP_DETAIL = True
+
+# Роутер static/render для detail (см. fetch_router.py): разделы, где описание
+# не находится в статическом HTML, сразу идут в рендер; каждый N-й — probe по HTTP
+ROUTER_ENABLED = True
+ROUTER_STATE_FILE = ".fetch_router.json"
+ROUTER_MIN_SAMPLES = 10
+ROUTER_STATIC_MIN_SUCCESS = 0.2
+ROUTER_PROBE_EVERY = 20
+ROUTER_WINDOW = 200
+
+# Parquet как формат feed export: scrapy crawl intermark_spain -O items.parquet:parquet (см. export_parquet.py)
+FEED_EXPORTERS = {
+    "parquet": "intermark_scraper.export_parquet.ParquetItemExporter",
+}
+
+# Нормализация location -> country_id/region_id/city_id (см. locations.py)
+LOCATION_GAZETTEER = None  # None — gazetteer.json рядом с модулем
+LOCATION_CACHE_SIZE = 4096
+
+
+LOG_FORMAT = "%(asctime)s [%(name)s] %(levelname)s: %(message)s"
+
+
+CONCURRENT_REQUESTS = 1
+CONCURRENT_REQUESTS_PER_DOMAIN = 1
+
+HTTPERROR_ALLOWED_CODES = [404, 500, 502, 503]
+
+RETRY_ENABLED = True
+#DOWNLOAD_DELAY = 0.5
+RANDOMIZE_DOWNLOAD_DELAY = True
+
+#AUTOTHROTTLE_START_DELAY = 0.5
+AUTOTHROTTLE_TARGET_CONCURRENCY = 1.0
+
+LOG_FILE = "logs/scrapy_run.log"
+LOG_LEVEL = "INFO"
+
+# Неблокирующее логирование (см. logging_setup.py): запись в файл — в фоновом потоке,
+# per-item сообщения сэмплируются (каждое N-е) / ограничиваются по частоте (N в секунду).
+# WARNING и выше пишутся всегда. LOG_JSON_FILE — JSON lines для log_report.py.
+LOG_ASYNC_ENABLED = True
+LOG_JSON_FILE = None
+LOG_SAMPLING = {
+    "[pipeline] got item": 20,
+    "[pipeline] inserted": 10,
+    "[pipeline] updated": 10,
+    "[pipeline] no changes": 10,
+    "[selenium] scroll=": 10,
+}
+LOG_RATE_LIMITS = {
+    "[detail] url=": 5,
+}
+
+
+
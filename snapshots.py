@@ -0,0 +1,140 @@
+"""
+Секционированное хранилище сырых снимков (RAW_STORAGE_LAYOUT = "snapshots").
+
+Вместо UPDATE-ов одной строки properties_raw на каждом краулe:
+- каждый ран пишет в свою LIST-секцию property_snapshots (run_id)
+- старые секции отсоединяются (DETACH PARTITION) — без VACUUM и раздувания; последнее состояние
+  url из них перед этим переносится в текущий ран (finish_run)
+- description/features сжимаются lz4 в TOAST
+- последнее состояние по url — materialized view intermark.properties_current;
+  первая строка url в ране сидируется из него (previous_state), поэтому снимок рана — полное состояние
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from intermark_scraper.models import CrawlRun
+
+logger = logging.getLogger(__name__)
+
+_PARENT = "intermark.property_snapshots"
+_CURRENT = "intermark.properties_current"
+
+_SNAPSHOT_COLUMNS = (
+    "url, scraped_at, source_page, title, location, price_raw, area_raw, object_id, description, features"
+)
+
+
+def _partition_name(run_id: int) -> str:
+    return f"{_PARENT}_r{int(run_id)}"
+
+
+def ensure_snapshot_schema(engine) -> None:
+    """
+    Настройки, которых нет в ORM-метаданных: сжатие TOAST и materialized view последнего состояния.
+    Таблицы создаёт Base.metadata.create_all().
+    """
+    with engine.begin() as conn:
+        # lz4 (PG14+): дешевле pglz по CPU и лучше жмёт JSON/текст
+        conn.execute(text(f"ALTER TABLE {_PARENT} ALTER COLUMN description SET COMPRESSION lz4"))
+        conn.execute(text(f"ALTER TABLE {_PARENT} ALTER COLUMN features SET COMPRESSION lz4"))
+        conn.execute(text(
+            f"CREATE MATERIALIZED VIEW IF NOT EXISTS {_CURRENT} AS "
+            f"SELECT DISTINCT ON (url) run_id, {_SNAPSHOT_COLUMNS} "
+            f"FROM {_PARENT} ORDER BY url, run_id DESC"
+        ))
+        # уникальный индекс нужен для REFRESH ... CONCURRENTLY
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS ix_properties_current_url ON {_CURRENT} (url)"
+        ))
+
+
+def start_run(engine, note: str = None) -> int:
+    """Регистрирует ран и создаёт его секцию."""
+    with engine.begin() as conn:
+        run_id = conn.execute(
+            CrawlRun.__table__.insert().values(note=note).returning(CrawlRun.id)
+        ).scalar_one()
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {_partition_name(run_id)} PARTITION OF {_PARENT} "
+            f"FOR VALUES IN ({int(run_id)}) WITH (toast_tuple_target = 4080)"
+        ))
+    logger.info("[snapshots] started run_id=%s", run_id)
+    return run_id
+
+
+def finish_run(engine, run_id: int, keep_runs: int) -> None:
+    """
+    Закрывает ран: finished_at, REFRESH properties_current, DETACH секций старше keep_runs ранов.
+    Отсоединённые таблицы остаются в схеме (архив) — их можно выгрузить/удалить отдельно.
+    DETACH отбрасывает только историю: url, чьё последнее состояние лежит в отсоединяемой секции
+    (не встречался в последних keep_runs ранах, например ран миграции), сначала переносится в текущий ран.
+    """
+    with engine.begin() as conn:
+        conn.execute(
+            CrawlRun.__table__.update()
+            .where(CrawlRun.id == run_id)
+            .values(finished_at=datetime.now(timezone.utc))
+        )
+
+        if keep_runs > 0:
+            rows = conn.execute(text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "JOIN pg_namespace n ON n.oid = p.relnamespace "
+                "WHERE n.nspname = 'intermark' AND p.relname = 'property_snapshots'"
+            )).scalars().all()
+
+            run_ids = sorted(
+                int(name.rsplit("_r", 1)[1]) for name in rows if name.rsplit("_r", 1)[-1].isdigit()
+            )
+            old_ids = [old_id for old_id in run_ids[:-keep_runs] if old_id != run_id]
+            if old_ids:
+                # после REFRESH properties_current включает текущий ран: если run_id строки из old_ids,
+                # последняя версия url есть только в отсоединяемых секциях
+                conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {_CURRENT}"))
+                carried = conn.execute(text(
+                    f"INSERT INTO {_PARENT} (run_id, {_SNAPSHOT_COLUMNS}) "
+                    f"SELECT :run_id, {_SNAPSHOT_COLUMNS} FROM {_CURRENT} WHERE run_id = ANY(:old_ids)"
+                ), {"run_id": run_id, "old_ids": old_ids}).rowcount
+                logger.info("[snapshots] carried %s latest rows forward into run_id=%s", carried, run_id)
+
+            for old_id in old_ids:
+                conn.execute(text(f"ALTER TABLE {_PARENT} DETACH PARTITION {_partition_name(old_id)}"))
+                logger.info("[snapshots] detached run_id=%s", old_id)
+
+    # REFRESH — отдельной транзакцией после DETACH, чтобы отсоединённые раны ушли из представления
+    with engine.begin() as conn:
+        conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {_CURRENT}"))
+
+
+def previous_state(session, url: str) -> Optional[Dict[str, Any]]:
+    """
+    Последнее состояние url из прошлых ранов (properties_current, уникальный индекс по url) или None.
+    Первая строка url в новом ране начинается с него: ран, видевший только listing,
+    не должен затирать в properties_current description/features, собранные раньше.
+    """
+    row = session.execute(
+        text(f"SELECT {_SNAPSHOT_COLUMNS} FROM {_CURRENT} WHERE url = :url"), {"url": url}
+    ).mappings().first()
+    return dict(row) if row is not None else None
+
+
+def load_hints(session, entity_index=None) -> Tuple[Set[str], Set[str]]:
+    """Те же подсказки, что DatabasePipeline.open_spider даёт из properties_raw, но из properties_current."""
+    db_urls: Set[str] = set()
+    need_detail: Set[str] = set()
+    rows = session.execute(text(f"SELECT url, object_id, title, description FROM {_CURRENT}")).all()
+    for url, object_id, title, desc in rows:
+        if not url:
+            continue
+        db_urls.add(url)
+        if any(v is None or str(v).strip() == "" for v in (desc, title)):
+            need_detail.add(url)
+        if entity_index is not None:
+            entity_index.seed(url, object_id, desc)
+    return db_urls, need_detail
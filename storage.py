@@ -0,0 +1,663 @@
+"""
+Хранилища сырого слоя для DatabasePipeline (STORAGE_BACKEND в settings.py).
+
+- Storage — интерфейс: load_hints (подсказки пауку), upsert_many/upsert (мердж пачки одной транзакцией), close
+- PostgresStorage — intermark.* в Postgres (prod; CDC, снимки по ранам, freshness, NOTIFY);
+  новые url пачки вставляются одним COPY (items.write_copy_rows)
+- SQLiteStorage — встроенный файл sqlite3: локальные краулы и бенчмарки без контейнера с Postgres
+
+Правила мерджа (_merge_into_row, _merge_features) общие для всех реализаций: строка-приёмник —
+ORM-объект или SimpleNamespace с теми же атрибутами.
+"""
+
+import abc
+import io
+import json
+import logging
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from environs import Env
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from intermark_scraper.history import (
+    TRACKED_FIELDS,
+    change_row,
+    description_hash,
+    ensure_month_partitions,
+    write_changes,
+)
+from intermark_scraper import snapshots
+from intermark_scraper.freshness import FreshnessScheduler
+from intermark_scraper.items import ROW_FIELDS, write_copy_rows
+from intermark_scraper.locations import Gazetteer, has_location_schema, sync_places
+from intermark_scraper.models import Base, PropertiesRaw, PropertySnapshot
+from intermark_scraper.search import has_search_schema
+
+logger = logging.getLogger(__name__)
+
+
+def get_connection_string() -> str:
+    env = Env()
+    project_root = Path(__file__).resolve().parents[2]
+    env.read_env(project_root / ".env")
+
+    user = env.str("POSTGRES_USER")
+    password = env.str("POSTGRES_PASSWORD")
+    db = env.str("POSTGRES_DB")
+    host = env.str("POSTGRES_HOST", "localhost")
+    port = env.int("POSTGRES_PORT", 5432)
+
+    return f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{db}"
+
+
+def _parse_iso_dt(value: Optional[Any]) -> Optional[datetime]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except Exception:
+        return None
+
+
+def _is_blank(value: Any) -> bool:
+    if value is None:
+        return True
+    s = str(value).strip()
+    return s == ""
+
+
+def _merge_features(existing: Optional[Any], incoming: Optional[Any]) -> Optional[Any]:
+    """
+    features: JSONB
+    - dict + dict: мерджим
+      - images, images_unique: объединяем уникально
+      - image_meta: объединяем по url картинки ("u"), incoming-строка заменяет прежнюю
+      - params: мерджим ключи
+      - params_list: объединяем уникально
+      - остальные ключи: incoming перезапишет existing (если incoming не None)
+    """
+    if incoming is None:
+        return existing
+    if existing is None:
+        return incoming
+
+    if not isinstance(existing, dict) or not isinstance(incoming, dict):
+        return incoming or existing
+
+    out = dict(existing)
+
+    # images / images_unique
+    for key in ("images", "images_unique"):
+        ex_imgs = out.get(key) if isinstance(out.get(key), list) else []
+        in_imgs = incoming.get(key) if isinstance(incoming.get(key), list) else []
+        if ex_imgs or in_imgs:
+            seen = set()
+            merged = []
+            for x in ex_imgs + in_imgs:
+                if not x:
+                    continue
+                if x in seen:
+                    continue
+                seen.add(x)
+                merged.append(x)
+            out[key] = merged
+
+    # image_meta (list of dict, см. images.py): по url картинки
+    ex_meta = out.get("image_meta") if isinstance(out.get("image_meta"), list) else []
+    in_meta = incoming.get("image_meta") if isinstance(incoming.get("image_meta"), list) else []
+    if ex_meta or in_meta:
+        by_url = {}
+        for row in ex_meta + in_meta:
+            if isinstance(row, dict) and row.get("u"):
+                by_url[row["u"]] = row
+        out["image_meta"] = list(by_url.values())
+
+    # params (dict)
+    ex_params = out.get("params") if isinstance(out.get("params"), dict) else {}
+    in_params = incoming.get("params") if isinstance(incoming.get("params"), dict) else {}
+    if ex_params or in_params:
+        merged_params = dict(ex_params)
+        for k, v in in_params.items():
+            if v is None:
+                continue
+            # detail-стадия имеет приоритет: если ключ уже есть, можно перезаписать
+            merged_params[k] = v
+        out["params"] = merged_params
+
+    # params_list (list)
+    ex_pl = out.get("params_list") if isinstance(out.get("params_list"), list) else []
+    in_pl = incoming.get("params_list") if isinstance(incoming.get("params_list"), list) else []
+    if ex_pl or in_pl:
+        seen = set()
+        merged = []
+        for x in ex_pl + in_pl:
+            if not x:
+                continue
+            if x in seen:
+                continue
+            seen.add(x)
+            merged.append(x)
+        out["params_list"] = merged
+
+    # остальные ключи
+    for k, v in incoming.items():
+        if k in {"images", "images_unique", "image_meta", "params", "params_list"}:
+            continue
+        if v is not None:
+            out[k] = v
+
+    return out
+
+
+def _merge_into_row(row: Any, incoming: Dict[str, Any], scraped_at: Optional[datetime]):
+    """
+    Мерджит incoming в строку (PropertiesRaw, PropertySnapshot или SimpleNamespace у SQLiteStorage —
+    набор полей одинаковый). Возвращает (changed, cdc_changes); cdc_changes ссылаются на row.id
+    и не пишутся для снимков.
+    """
+    changed = False
+    changes = []
+    new_desc = incoming.get("description")
+
+    # source_page/title/location/object_id — добиваем если пусто
+    for field in ["source_page", "title", "location", "object_id"]:
+        new_val = incoming.get(field)
+        old_val = getattr(row, field)
+        if _is_blank(old_val) and not _is_blank(new_val):
+            setattr(row, field, new_val)
+            changed = True
+
+    # price_raw/area_raw — новое непустое значение заменяет старое, изменение пишем в историю
+    for field in TRACKED_FIELDS:
+        new_val = incoming.get(field)
+        old_val = getattr(row, field)
+        if not _is_blank(new_val) and new_val != old_val:
+            changes.append(change_row(getattr(row, "id", None), field, old_val, new_val, scraped_at))
+            setattr(row, field, new_val)
+            changed = True
+
+    # description: текст с detail-страницы — текущая версия (правки, в т.ч. укорачивающие, доходят до истории);
+    # с остальных стадий — только если он длиннее сохранённого. Изменение хеша пишем при любой замене текста
+    if not _is_blank(new_desc):
+        features = incoming.get("features")
+        from_detail = isinstance(features, dict) and features.get("from") == "detail"
+        old_hash = description_hash(row.description)
+        new_hash = description_hash(new_desc)
+        if old_hash != new_hash and (
+            from_detail or _is_blank(row.description) or len(str(new_desc)) > len(str(row.description))
+        ):
+            changes.append(change_row(getattr(row, "id", None), "description_hash", old_hash, new_hash, scraped_at))
+            row.description = new_desc
+            changed = True
+
+    # features: мерджим (и это должно поднять from -> detail, если пришла деталка)
+    merged = _merge_features(row.features, incoming.get("features"))
+    if merged != row.features:
+        row.features = merged
+        changed = True
+
+    # scraped_at: можно хранить “последний парсинг”
+    if scraped_at is not None:
+        row.scraped_at = scraped_at
+        changed = True
+
+    return changed, changes
+
+
+def apply_location(row: Any, gazetteer: Optional[Gazetteer]) -> bool:
+    """location -> country_id/region_id/city_id (LRU-кеш в Gazetteer); True, если ключ изменился."""
+    if gazetteer is None:
+        return False
+    key = gazetteer.normalize(row.location)
+    if (row.country_id, row.region_id, row.city_id) == key:
+        return False
+    row.country_id, row.region_id, row.city_id = key
+    return True
+
+
+def _initial_changes(property_id: Optional[int], incoming: Dict[str, Any], scraped_at: Optional[datetime]) -> List[Dict[str, Any]]:
+    """CDC: стартовые значения, чтобы тренд цены начинался с первой точки."""
+    changes = [
+        change_row(property_id, field, None, incoming.get(field), scraped_at)
+        for field in TRACKED_FIELDS
+        if not _is_blank(incoming.get(field))
+    ]
+    new_hash = description_hash(incoming.get("description"))
+    if new_hash:
+        changes.append(change_row(property_id, "description_hash", None, new_hash, scraped_at))
+    return changes
+
+
+def _needs_detail(row: Any) -> bool:
+    """Нет description или карточных полей (объект найден через sitemap, без listing) — нужен detail."""
+    return _is_blank(row.description) or _is_blank(row.title)
+
+
+class UpsertResult(NamedTuple):
+    action: str             # "inserted" / "updated" / "unchanged"
+    complete: bool          # False -> паук должен сходить в detail (см. _needs_detail)
+
+
+class Storage(abc.ABC):
+    """
+    Хранилище сырого слоя для DatabasePipeline (STORAGE_BACKEND).
+
+    Абстрактный: реализация без load_hints/upsert_many/close не создаётся (TypeError при open_storage,
+    а не посреди краула). Семантика одна для всех реализаций (_merge_into_row): пустые поля добиваются,
+    price_raw/area_raw перезаписываются с записью в историю, описание с detail-страницы
+    (или более длинное с других стадий) заменяет сохранённое, features мерджатся.
+    """
+
+    # планировщик пересканирования (freshness.py), если хранилище его поддерживает
+    freshness: Optional[FreshnessScheduler] = None
+
+    @abc.abstractmethod
+    def load_hints(self, entity_index=None) -> Tuple[Set[str], Set[str]]:
+        """(все url, url без description или карточных полей); попутно сидирует entity_index."""
+
+    @abc.abstractmethod
+    def upsert_many(self, rows: List[Dict[str, Any]]) -> List[UpsertResult]:
+        """Мерджит пачку incoming-строк одной транзакцией."""
+
+    def upsert(self, incoming: Dict[str, Any]) -> UpsertResult:
+        return self.upsert_many([incoming])[0]
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """Освобождает соединения; вызывается из DatabasePipeline.close_spider."""
+
+
+class PostgresStorage(Storage):
+    """
+    intermark.* в Postgres (как раньше): properties_raw или снимки по ранам (RAW_STORAGE_LAYOUT),
+    CDC в property_changes, crawl_state для freshness, NOTIFY для api.py.
+    """
+
+    # колонки COPY для новых строк properties_raw: поля item-а + нормализованный location
+    COPY_COLUMNS = ROW_FIELDS + ("country_id", "region_id", "city_id")
+
+    def __init__(self, dsn: str, settings=None, gazetteer: Optional[Gazetteer] = None):
+        # "table" — одна строка на url в properties_raw (как раньше);
+        # "snapshots" — секции по ранам в property_snapshots (см. snapshots.py)
+        self.raw_layout = settings.get("RAW_STORAGE_LAYOUT", "table") if settings else "table"
+        self.keep_runs = settings.getint("RAW_SNAPSHOT_KEEP_RUNS", 5) if settings else 5
+        self.run_id: Optional[int] = None
+        self.settings = settings
+        self.gazetteer = gazetteer
+
+        self.engine = create_engine(
+            dsn,
+            pool_size=5,
+            max_overflow=10,
+            pool_pre_ping=True,
+            pool_recycle=3600,
+        )
+        Base.metadata.create_all(self.engine)
+        ensure_month_partitions(self.engine)
+        # DDL на живой таблице — только в миграциях; create_all создаёт новую properties_raw уже с ключами
+        if not has_location_schema(self.engine):
+            raise RuntimeError(
+                "properties_raw has no country_id/region_id/city_id: run python -m intermark_scraper.migrate_locations"
+            )
+        if not has_search_schema(self.engine):
+            logger.warning("properties_raw.search_tsv is missing: run python -m intermark_scraper.migrate_search")
+        if gazetteer is not None:
+            sync_places(self.engine, gazetteer)
+        if self.raw_layout == "snapshots":
+            snapshots.ensure_snapshot_schema(self.engine)
+        self.session_factory = scoped_session(
+            sessionmaker(bind=self.engine, autocommit=False, autoflush=False)
+        )
+
+    @contextmanager
+    def session_scope(self):
+        session = self.session_factory()
+        try:
+            yield session
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.exception("DB operation failed: %s", e)
+            raise
+        finally:
+            session.close()
+
+    def load_hints(self, entity_index=None) -> Tuple[Set[str], Set[str]]:
+        db_urls: Set[str] = set()
+        need_detail: Set[str] = set()
+
+        if self.raw_layout == "snapshots":
+            self.run_id = snapshots.start_run(self.engine)
+            with self.session_scope() as session:
+                return snapshots.load_hints(session, entity_index)
+
+        with self.session_scope() as session:
+            rows = session.query(
+                PropertiesRaw.url, PropertiesRaw.object_id, PropertiesRaw.title, PropertiesRaw.description
+            ).order_by(PropertiesRaw.id).all()
+            for url, object_id, title, desc in rows:
+                if not url:
+                    continue
+                db_urls.add(url)
+                if _is_blank(desc) or _is_blank(title):
+                    need_detail.add(url)
+                if entity_index is not None:
+                    entity_index.seed(url, object_id, desc)
+
+            # пересканирование известных url по свежести (только layout "table")
+            if self.settings is not None and self.settings.getbool("FRESHNESS_ENABLED", True):
+                self.freshness = FreshnessScheduler.from_settings(self.settings)
+                self.freshness.load(session)
+
+        return db_urls, need_detail
+
+    def upsert_many(self, rows: List[Dict[str, Any]]) -> List[UpsertResult]:
+        try:
+            with self.session_scope() as session:
+                if self.raw_layout == "snapshots":
+                    results = [self._upsert_snapshot(session, incoming) for incoming in rows]
+                else:
+                    results = self._upsert_batch(session, rows)
+        except Exception:
+            # record_visit уже сдвинул EWMA в памяти — откатываем вместе с транзакцией
+            if self.freshness is not None:
+                self.freshness.rollback()
+            raise
+        if self.freshness is not None:
+            self.freshness.commit()
+        return results
+
+    def _upsert_batch(self, session, rows: List[Dict[str, Any]]) -> List[UpsertResult]:
+        """
+        Layout "table": известные url пачки читаются одним SELECT ... WHERE url IN (...) и мерджатся
+        через ORM; новые собираются в памяти (listing + detail одного url в пачке — одна строка)
+        и вставляются одним COPY (_copy_new_rows).
+        """
+        urls = {incoming["url"] for incoming in rows}
+        existing = {
+            row.url: row
+            for row in session.query(PropertiesRaw).filter(PropertiesRaw.url.in_(urls))
+        }
+        fresh: Dict[str, SimpleNamespace] = {}
+        # CDC новых url: стартовые значения + изменения от следующих item-ов пачки; property_id — после COPY
+        fresh_changes: Dict[str, List[Dict[str, Any]]] = {}
+        visited_fresh: Set[str] = set()
+        results: List[UpsertResult] = []
+
+        for incoming in rows:
+            url = incoming["url"]
+            scraped_at = incoming.get("scraped_at")
+            features = incoming.get("features")
+            stage = features.get("from") if isinstance(features, dict) else None
+
+            row = existing.get(url)
+            if row is not None:
+                results.append(self._merge_existing(session, row, incoming, stage))
+                continue
+
+            row = fresh.get(url)
+            if row is None:
+                # INSERT (первая стадия или новый объект) — уйдёт в COPY в конце пачки
+                row = SimpleNamespace(id=None, **{name: None for name in self.COPY_COLUMNS})
+                for name, value in incoming.items():
+                    setattr(row, name, value)
+                fresh[url] = row
+                fresh_changes[url] = _initial_changes(None, incoming, scraped_at)
+                action = "inserted"
+            else:
+                changed, changes = _merge_into_row(row, incoming, scraped_at)
+                fresh_changes[url].extend(changes)
+                action = "updated" if changed else "unchanged"
+            if stage == "detail":
+                visited_fresh.add(url)
+            results.append(UpsertResult(action, not _needs_detail(row)))
+
+        if fresh:
+            self._copy_new_rows(session, list(fresh.values()), fresh_changes, visited_fresh)
+        return results
+
+    def _merge_existing(
+        self, session, existing: PropertiesRaw, incoming: Dict[str, Any], stage: Optional[str]
+    ) -> UpsertResult:
+        scraped_at = incoming.get("scraped_at")
+        changed, changes = _merge_into_row(existing, incoming, scraped_at)
+        if apply_location(existing, self.gazetteer):
+            changed = True
+
+        if changed:
+            session.add(existing)
+            session.flush()
+            write_changes(session, changes)
+
+        if self.freshness is not None and stage == "detail":
+            self.freshness.record_visit(session, existing.url, changed=bool(changes), at=scraped_at)
+
+        return UpsertResult("updated" if changed else "unchanged", not _needs_detail(existing))
+
+    def _copy_new_rows(
+        self,
+        session,
+        rows: List[SimpleNamespace],
+        changes: Dict[str, List[Dict[str, Any]]],
+        visited: Set[str],
+    ) -> None:
+        """COPY новых строк в properties_raw в транзакции сессии + их CDC по полученным id."""
+        for row in rows:
+            if row.scraped_at is None:
+                # в COPY server_default не срабатывает: \N в NOT NULL колонке
+                row.scraped_at = datetime.now(timezone.utc)
+            apply_location(row, self.gazetteer)
+
+        buf = io.StringIO()
+        write_copy_rows((tuple(getattr(row, name) for name in self.COPY_COLUMNS) for row in rows), buf)
+        buf.seek(0)
+        cursor = session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY intermark.properties_raw ({', '.join(self.COPY_COLUMNS)}) FROM STDIN", buf
+            )
+        finally:
+            cursor.close()
+
+        ids = dict(
+            session.query(PropertiesRaw.url, PropertiesRaw.id)
+            .filter(PropertiesRaw.url.in_([row.url for row in rows]))
+            .all()
+        )
+        cdc: List[Dict[str, Any]] = []
+        for row in rows:
+            for change in changes[row.url]:
+                change["property_id"] = ids[row.url]
+                cdc.append(change)
+        write_changes(session, cdc)
+
+        if self.freshness is not None:
+            for row in rows:
+                if row.url in visited:
+                    self.freshness.record_visit(session, row.url, changed=False, at=row.scraped_at)
+
+    def _upsert_snapshot(self, session, incoming: Dict[str, Any]) -> UpsertResult:
+        """
+        Layout "snapshots": пишем только в секцию текущего рана.
+        Первая строка url в ране — прошлое состояние (properties_current) + incoming; listing и detail
+        одного url в пределах рана мерджатся в одну строку; прошлые раны не трогаем.
+        CDC (property_changes) тут не пишем — изменения видны сравнением соседних снимков.
+        """
+        url = incoming["url"]
+        scraped_at = incoming.get("scraped_at")
+
+        existing = session.get(PropertySnapshot, (self.run_id, url))
+        if existing is None:
+            previous = snapshots.previous_state(session, url)
+            if previous is None:
+                row = PropertySnapshot(run_id=self.run_id, **{k: v for k, v in incoming.items() if k != "scraped_at"})
+                if scraped_at is not None:
+                    row.scraped_at = scraped_at
+            else:
+                # url уже известен: стартуем с прошлого состояния и мерджим поверх, как в layout "table"
+                row = PropertySnapshot(run_id=self.run_id, **previous)
+                _merge_into_row(row, incoming, scraped_at)
+            session.add(row)
+            # flush: следующий item того же url в этой же пачке должен найти строку
+            session.flush()
+            return UpsertResult("inserted", not _needs_detail(row))
+
+        changed, _ = _merge_into_row(existing, incoming, scraped_at)
+        return UpsertResult("updated" if changed else "unchanged", not _needs_detail(existing))
+
+    def close(self) -> None:
+        if self.raw_layout == "snapshots" and self.run_id is not None:
+            snapshots.finish_run(self.engine, self.run_id, self.keep_runs)
+        # сигнал read-only API (api.py) сбросить кеш ответов
+        with self.engine.begin() as conn:
+            conn.execute(text("NOTIFY intermark_data_changed"))
+        self.session_factory.remove()
+        self.engine.dispose()
+
+
+class SQLiteStorage(Storage):
+    """
+    Встроенное хранилище (stdlib sqlite3) для локальных ранов и бенчмарков без Postgres.
+
+    Та же таблица properties_raw (features — JSON-текст) и property_changes (CDC),
+    та же семантика мерджа. Нет freshness (crawl_state), снимков по ранам и NOTIFY.
+    """
+
+    DDL = (
+        "CREATE TABLE IF NOT EXISTS properties_raw ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " url TEXT NOT NULL UNIQUE,"
+        " scraped_at TEXT NOT NULL,"
+        " source_page TEXT, title TEXT, location TEXT, price_raw TEXT, area_raw TEXT,"
+        " object_id TEXT, description TEXT,"
+        " country_id INTEGER, region_id INTEGER, city_id INTEGER,"
+        " features TEXT)",
+        "CREATE INDEX IF NOT EXISTS ix_properties_raw_location ON properties_raw (location)",
+        "CREATE INDEX IF NOT EXISTS ix_properties_raw_object_id ON properties_raw (object_id)",
+        "CREATE INDEX IF NOT EXISTS ix_properties_raw_region_id ON properties_raw (region_id)",
+        "CREATE TABLE IF NOT EXISTS property_changes ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " changed_at TEXT NOT NULL,"
+        " property_id INTEGER NOT NULL,"
+        " field INTEGER NOT NULL,"
+        " old_value TEXT, new_value TEXT)",
+        "CREATE INDEX IF NOT EXISTS ix_property_changes_property_id ON property_changes (property_id)",
+    )
+    COLUMNS = (
+        "url", "scraped_at", "source_page", "title", "location", "price_raw", "area_raw",
+        "object_id", "description", "country_id", "region_id", "city_id", "features",
+    )
+
+    def __init__(self, path: str, gazetteer: Optional[Gazetteer] = None):
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.gazetteer = gazetteer
+        # isolation_level=None: транзакциями управляем сами (BEGIN/COMMIT на пачку)
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for ddl in self.DDL:
+            self.conn.execute(ddl)
+
+    def load_hints(self, entity_index=None) -> Tuple[Set[str], Set[str]]:
+        db_urls: Set[str] = set()
+        need_detail: Set[str] = set()
+        for url, object_id, title, desc in self.conn.execute(
+            "SELECT url, object_id, title, description FROM properties_raw ORDER BY id"
+        ):
+            db_urls.add(url)
+            if _is_blank(desc) or _is_blank(title):
+                need_detail.add(url)
+            if entity_index is not None:
+                entity_index.seed(url, object_id, desc)
+        return db_urls, need_detail
+
+    @staticmethod
+    def _to_db(row: Any) -> Dict[str, Any]:
+        out = {name: getattr(row, name) for name in SQLiteStorage.COLUMNS}
+        scraped_at = out["scraped_at"] or datetime.now(timezone.utc)
+        out["scraped_at"] = scraped_at.isoformat() if isinstance(scraped_at, datetime) else str(scraped_at)
+        out["features"] = None if row.features is None else json.dumps(row.features, ensure_ascii=False)
+        return out
+
+    def _write_changes(self, changes: List[Dict[str, Any]]) -> None:
+        if changes:
+            self.conn.executemany(
+                "INSERT INTO property_changes (changed_at, property_id, field, old_value, new_value) "
+                "VALUES (:changed_at, :property_id, :field, :old_value, :new_value)",
+                [{**c, "changed_at": c["changed_at"].isoformat()} for c in changes],
+            )
+
+    def _upsert_row(self, incoming: Dict[str, Any]) -> UpsertResult:
+        scraped_at = incoming.get("scraped_at")
+        found = self.conn.execute("SELECT * FROM properties_raw WHERE url = ?", (incoming["url"],)).fetchone()
+
+        if found is None:
+            row = SimpleNamespace(**{name: None for name in self.COLUMNS})
+            for name, value in incoming.items():
+                setattr(row, name, value)
+            apply_location(row, self.gazetteer)
+            values = self._to_db(row)
+            cur = self.conn.execute(
+                f"INSERT INTO properties_raw ({', '.join(self.COLUMNS)}) "
+                f"VALUES ({', '.join(':' + name for name in self.COLUMNS)})",
+                values,
+            )
+            self._write_changes(_initial_changes(cur.lastrowid, incoming, scraped_at))
+            return UpsertResult("inserted", not _needs_detail(row))
+
+        existing = SimpleNamespace(**dict(found))
+        existing.features = json.loads(existing.features) if existing.features else None
+        changed, changes = _merge_into_row(existing, incoming, scraped_at)
+        if apply_location(existing, self.gazetteer):
+            changed = True
+
+        if changed:
+            self.conn.execute(
+                f"UPDATE properties_raw SET {', '.join(f'{name} = :{name}' for name in self.COLUMNS)} "
+                "WHERE id = :id",
+                {**self._to_db(existing), "id": existing.id},
+            )
+            self._write_changes(changes)
+        return UpsertResult("updated" if changed else "unchanged", not _needs_detail(existing))
+
+    def upsert_many(self, rows: List[Dict[str, Any]]) -> List[UpsertResult]:
+        self.conn.execute("BEGIN")
+        try:
+            results = [self._upsert_row(incoming) for incoming in rows]
+        except Exception as e:
+            self.conn.execute("ROLLBACK")
+            logger.exception("DB operation failed: %s", e)
+            raise
+        self.conn.execute("COMMIT")
+        return results
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def open_storage(settings=None, gazetteer: Optional[Gazetteer] = None) -> Storage:
+    """
+    STORAGE_BACKEND:
+    - "postgres" (по умолчанию): STORAGE_DSN или .env (get_connection_string)
+    - "sqlite": файл STORAGE_SQLITE_PATH, внешние сервисы не нужны
+    """
+    backend = settings.get("STORAGE_BACKEND", "postgres") if settings else "postgres"
+    if backend == "sqlite":
+        if settings.get("RAW_STORAGE_LAYOUT", "table") != "table":
+            raise ValueError("STORAGE_BACKEND=sqlite supports only RAW_STORAGE_LAYOUT=table")
+        return SQLiteStorage(settings.get("STORAGE_SQLITE_PATH", "data/intermark.sqlite3"), gazetteer)
+    if backend == "postgres":
+        dsn = (settings.get("STORAGE_DSN") if settings else None) or get_connection_string()
+        return PostgresStorage(dsn, settings, gazetteer)
+    raise ValueError(f"unknown STORAGE_BACKEND: {backend!r}")